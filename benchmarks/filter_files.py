@@ -0,0 +1,97 @@
+"""Times how long it takes processes to filter a large list of files.
+
+Usage: python benchmarks/filter_files.py [--files N] [--processes N] [--repeat N]
+
+Compares `Process.filter_files` with the implementation it replaced, which built the include
+and exclude specs on every call and removed excluded files with a list lookup, and with a
+`Router` selecting the files for all of the processes in a single pass.
+"""
+import argparse
+import time
+
+from pathspec import PathSpec
+from pathspec.patterns import GitWildMatchPattern
+
+from therapist.process import Process
+from therapist.runner.router import Router
+
+
+EXTENSIONS = ("py", "js", "txt", "md", "json", "css", "html", "yml")
+
+
+def previous_filter_files(process, files):
+    if process.include:
+        spec = PathSpec(map(GitWildMatchPattern, process.include))
+        files = list(spec.match_files(files))
+
+    if process.exclude:
+        spec = PathSpec(map(GitWildMatchPattern, process.exclude))
+        exclude = list(spec.match_files(files))
+        files = list(filter(lambda f: f not in exclude, files))
+
+    return files
+
+
+def make_files(count):
+    return [
+        "dir{}/sub{}/file{}.{}".format(i % 100, i % 7, i, EXTENSIONS[i % len(EXTENSIONS)])
+        for i in range(count)
+    ]
+
+
+def make_processes(count):
+    processes = []
+    for i in range(count):
+        extension = EXTENSIONS[i % len(EXTENSIONS)]
+        processes.append(
+            Process(
+                "process{}".format(i),
+                include=["*.{}".format(extension), "dir{}/**".format(i % 100)],
+                exclude=["dir{}/".format((i + 1) % 100), "sub{}/".format(i % 7), "*.min.js"],
+            )
+        )
+    return processes
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--processes", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    files = make_files(args.files)
+    processes = make_processes(args.processes)
+
+    # The previous implementation didn't keep the files in order
+    for process in processes:
+        assert set(process.filter_files(files)) == set(previous_filter_files(process, files))
+
+    routed = Router(processes).route(files)
+    for process in processes:
+        assert routed[process] == process.filter_files(files)
+
+    previous = best_of(
+        args.repeat, lambda: [previous_filter_files(process, files) for process in processes]
+    )
+    current = best_of(args.repeat, lambda: [process.filter_files(files) for process in processes])
+
+    router = best_of(args.repeat, lambda: Router(processes).route(files))
+
+    print("{} files, {} processes, best of {} runs".format(args.files, args.processes, args.repeat))
+    print("previous: {:.3f}s".format(previous))
+    print("current:  {:.3f}s ({:.1f}x)".format(current, previous / current))
+    print("router:   {:.3f}s ({:.1f}x)".format(router, previous / router))
+
+
+if __name__ == "__main__":
+    main()
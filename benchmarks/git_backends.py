@@ -0,0 +1,113 @@
+"""Compares the git backends on the operations therapist uses.
+
+Usage: python benchmarks/git_backends.py [REPO_PATH] [--files N] [--repeat N]
+
+Without a repository path, a temporary repository with `--files` files is created.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from therapist.utils.git import RepoSnapshot
+from therapist.utils.git.backend import BACKENDS
+
+
+def create_repo(path, count):
+    subprocess.check_call(["git", "init", "-q", path])
+    for i in range(count):
+        directory = os.path.join(path, "dir{}".format(i % 100))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "file{}.py".format(i)), "w") as f:
+            f.write("print({})\n".format(i) * (i % 50 + 1))
+
+    subprocess.check_call(["git", "add", "."], cwd=path)
+    subprocess.check_call(
+        [
+            "git",
+            "-c",
+            "user.name=benchmark",
+            "-c",
+            "user.email=benchmark@example.com",
+            "commit",
+            "-q",
+            "-m",
+            "Initial commit",
+        ],
+        cwd=path,
+    )
+
+    # Pack half of the objects so both loose and packed objects are read
+    subprocess.check_call(["git", "gc", "-q"], cwd=path)
+    for i in range(0, count, 2):
+        with open(os.path.join(path, "dir{}".format(i % 100), "file{}.py".format(i)), "a") as f:
+            f.write("# changed\n")
+    subprocess.check_call(["git", "add", "."], cwd=path)
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def cat_one_at_a_time(backend, object_ids):
+    for object_id in object_ids:
+        backend.cat_file([object_id])
+
+
+def run(path, repeat):
+    object_ids = None
+    rows = []
+
+    for name, backend_class in sorted(BACKENDS.items()):
+        with backend_class(repo_path=path) as backend:
+            if object_ids is None:
+                object_ids = list(backend.ls_files().values())[:1000]
+
+            rows.append(
+                (
+                    name,
+                    best_of(repeat, lambda: backend.ls_files()),
+                    best_of(repeat, lambda: backend.status(untracked_files="no")),
+                    best_of(repeat, lambda: RepoSnapshot(backend).blob_ids),
+                    best_of(repeat, lambda: backend.cat_file(object_ids)),
+                    best_of(repeat, lambda: cat_one_at_a_time(backend, object_ids[:100])),
+                    best_of(repeat, lambda: backend.object_info(object_ids)),
+                )
+            )
+
+    print("{} objects read, best of {} runs, in milliseconds\n".format(len(object_ids), repeat))
+    columns = ("backend", "ls-files", "status", "snapshot", "cat-file", "cat-file x100")
+    columns += ("object-info",)
+    print("".join(column.ljust(15) for column in columns))
+    for row in rows:
+        print(row[0].ljust(15) + "".join("{:.1f}".format(t * 1000).ljust(15) for t in row[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repo_path", nargs="?")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.repo_path:
+        run(os.path.abspath(args.repo_path), args.repeat)
+        return
+
+    path = tempfile.mkdtemp()
+    try:
+        create_repo(path, args.files)
+        run(path, args.repeat)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
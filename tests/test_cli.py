@@ -1,3 +1,4 @@
+import os
 import re
 
 from therapist import cli, __version__
@@ -328,6 +329,65 @@ class TestRun(object):
             assert result.exception
             assert result.exit_code == 2
 
+    def test_jobs(self, cli_runner, project):
+        project.write("pass.py")
+        project.write("fail.txt")
+        project.git.add(".")
+
+        with chdir(project.path):
+            result = cli_runner.invoke(cli.run, ["--jobs", "2"])
+            assert re.search(
+                r"Linting.+?\[FAILURE].+?simple.+?\[SUCCESS]", result.output, flags=re.DOTALL
+            )
+            assert result.exit_code == 2
+
+            result = cli_runner.invoke(cli.run, ["-j", "0"])
+            assert result.exit_code == 2
+            assert "Invalid value" in result.output
+
+    def test_shard(self, cli_runner, project):
+        project.write("pass.py")
+        project.write("fail.txt")
+        project.git.add(".")
+
+        with chdir(project.path):
+            result = cli_runner.invoke(cli.run, ["-a", "lint", "--shard", "2"])
+            assert re.search(r"Linting.+?\[FAILURE]", result.output)
+            assert "FAIL!" in result.output
+            assert result.exit_code == 2
+
+    def test_asyncio_engine(self, cli_runner, project):
+        project.write("pass.py")
+        project.write("fail.txt")
+        project.git.add(".")
+
+        with chdir(project.path):
+            result = cli_runner.invoke(cli.run, ["--engine", "asyncio", "--no-cache"])
+            assert re.search(
+                r"Linting.+?\[FAILURE].+?simple.+?\[SUCCESS]", result.output, flags=re.DOTALL
+            )
+            assert "FAIL!" in result.output
+            assert result.exit_code == 2
+
+    def test_cache(self, cli_runner, project):
+        project.write("fail.py")
+        project.git.add(".")
+
+        with chdir(project.path):
+            result = cli_runner.invoke(cli.run, ["--no-cache"])
+            assert result.exit_code == 2
+            assert not project.exists(".git/therapist/cache")
+
+            result = cli_runner.invoke(cli.run)
+            assert re.search(r"Linting.+?\[FAILURE]", result.output)
+            assert result.exit_code == 2
+            assert project.exists(".git/therapist/cache")
+
+            result = cli_runner.invoke(cli.run)
+            assert re.search(r"Linting.+?\[FAILURE]", result.output)
+            assert "FAIL!" in result.output
+            assert result.exit_code == 2
+
     def test_action(self, cli_runner, project):
         project.write("pass.py")
 
@@ -463,6 +523,19 @@ class TestRun(object):
             assert result.exception
             assert result.exit_code == 2
 
+    def test_dir_ignored(self, cli_runner, project):
+        project.write(".gitignore", "build/")
+        project.write("dir/pass.py")
+        project.write("dir/build/fail.py")
+        project.write("dir/scripts/fail.py")
+
+        with chdir(project.path):
+            for args in (["dir"], ["--disable-git", "dir"], ["-a", "lint", "dir"]):
+                result = cli_runner.invoke(cli.run, args)
+                assert re.search(r"Linting.+?\[SUCCESS]", result.output)
+                assert not result.exception
+                assert result.exit_code == 0
+
     def test_file(self, cli_runner, project):
         project.write("pass.py")
 
@@ -536,6 +609,28 @@ class TestRun(object):
             assert result.exit_code == 0
             assert project.read("pass.py") == "x"
 
+    def test_checkout_isolation(self, cli_runner, project):
+        project.write("pass.py", "FAIL")
+        project.git.add(".")
+        project.write("pass.py", "x")
+        mtime = os.stat(project.abspath("pass.py")).st_mtime_ns
+
+        with chdir(project.path):
+            result = cli_runner.invoke(cli.run, ["--isolation", "checkout"])
+            assert re.search(r"Linting.+?\[FAILURE]", result.output)
+            assert result.exit_code == 2
+            assert project.read("pass.py") == "x"
+            assert os.stat(project.abspath("pass.py")).st_mtime_ns == mtime
+
+            result = cli_runner.invoke(cli.run, ["--isolation", "nope"])
+            assert result.exit_code == 2
+            assert "Invalid value" in result.output
+
+            project.append(".therapist.yml", "isolation: checkout")
+            result = cli_runner.invoke(cli.run)
+            assert re.search(r"Linting.+?\[FAILURE]", result.output)
+            assert os.stat(project.abspath("pass.py")).st_mtime_ns == mtime
+
     def test_use_tracked_files(self, cli_runner, project):
         project.write("fail.py")
         project.git.add(".")
@@ -560,6 +655,44 @@ class TestRun(object):
             assert result.exception
             assert result.exit_code == 2
 
+    def test_use_tracked_files_from_subdirectory(self, cli_runner, project):
+        project.write("fail.py")
+        project.write("dir/pass.txt")
+        project.git.add(".")
+        project.git.commit(m="Add files.")
+
+        with chdir(project.abspath("dir")):
+            result = cli_runner.invoke(cli.run, ["-a", "lint", "--use-tracked-files"])
+            assert re.search(r"Linting.+?\[FAILURE]", result.output)
+            assert result.exit_code == 2
+
+    def test_use_tracked_files_disable_git(self, cli_runner, project, monkeypatch):
+        project.write("fail.py")
+        project.git.add(".")
+        project.git.commit(m="Add file.")
+
+        closed = []
+        get_backend = cli.get_backend
+
+        def recording_get_backend(*args, **kwargs):
+            backend = get_backend(*args, **kwargs)
+            close = backend.close
+
+            def recording_close():
+                closed.append(backend)
+                close()
+
+            backend.close = recording_close
+            return backend
+
+        monkeypatch.setattr(cli, "get_backend", recording_get_backend)
+
+        with chdir(project.path):
+            result = cli_runner.invoke(cli.run, ["--use-tracked-files", "--disable-git"])
+            assert re.search(r"Linting.+?\[FAILURE]", result.output)
+            assert result.exit_code == 2
+            assert len(closed) == 1
+
     def test_no_false_positive_modified_files(self, cli_runner, project):
         project.write("fail.py")
         project.git.add(".")
@@ -612,8 +745,11 @@ class TestRun(object):
             assert junit_xml.startswith('<?xml version="1.0" encoding="UTF-8"?>')
 
     def test_errors(self, cli_runner, project):
-        for i in range(10000):
-            project.write("pass{}.txt".format(str(i).ljust(200, "_")))
+        config_data = project.get_config_data()
+        config_data["actions"]["lint"]["working_dir"] = "does-not-exist"
+        project.set_config_data(config_data)
+
+        project.write("pass.txt")
         project.git.add(".")
 
         with chdir(project.path):
@@ -622,6 +758,17 @@ class TestRun(object):
             assert result.exception
             assert result.exit_code == 1
 
+    def test_long_command_lines_are_batched(self, cli_runner, project):
+        for i in range(10000):
+            project.write("pass{}.txt".format(str(i).ljust(200, "_")))
+        project.git.add(".")
+
+        with chdir(project.path):
+            result = cli_runner.invoke(cli.run, ["-a", "lint"])
+            assert re.search(r"Linting.+?\[SUCCESS]", result.output)
+            assert not result.exception
+            assert result.exit_code == 0
+
     def test_run_without_git_no_config(self, cli_runner, project):
         project.remove(".therapist.yml")
         project.write("pass.py")
@@ -185,3 +185,102 @@ class TestConfig(object):
         project.append(".therapist.yml", "requires: {}".format(__version__))
         config = Config(project.path)
         assert config.requires.get("min") == __version__
+
+    def test_dependencies_wrongly_configured(self, project):
+        data = project.get_config_data()
+        data["actions"]["lint"]["needs"] = "notanaction"
+        project.set_config_data(data)
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.DEPENDENCIES_WRONGLY_CONFIGURED
+
+    def test_circular_dependencies(self, project):
+        data = project.get_config_data()
+        data["actions"]["lint"]["needs"] = "simple"
+        data["plugins"]["simple"] = {"needs": ["lint"]}
+        project.set_config_data(data)
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.DEPENDENCIES_WRONGLY_CONFIGURED
+        assert err.value.message == "Circular dependency between `lint` -> `simple` -> `lint`."
+
+    def test_dependencies(self, project):
+        data = project.get_config_data()
+        data["actions"]["lint"]["needs"] = "simple"
+        project.set_config_data(data)
+
+        c = Config(project.path)
+        assert c.actions.get("lint").needs == ["simple"]
+
+    def test_shard_wrongly_configured(self, project):
+        project.write(".therapist.yml", "actions:\n  lint:\n    run: lint\n    shard: auto")
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.SHARD_WRONGLY_CONFIGURED
+        assert err.value.message == "`shard` for `lint` must be a positive integer."
+
+        project.write(".therapist.yml", "actions:\n  lint:\n    run: lint\n    shard: 0")
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.SHARD_WRONGLY_CONFIGURED
+
+    def test_timeout_wrongly_configured(self, project):
+        project.write(".therapist.yml", "actions:\n  lint:\n    run: lint\n    timeout: soon")
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.TIMEOUT_WRONGLY_CONFIGURED
+        assert err.value.message == "`timeout` for `lint` must be a positive number."
+
+        project.write(".therapist.yml", "actions:\n  lint:\n    run: lint\n    timeout: 1.5")
+        c = Config(project.path)
+        assert c.actions.get("lint").get_timeout() == 1.5
+
+    def test_git_backend(self, project):
+        project.append(".therapist.yml", "git_backend: batch")
+        c = Config(project.path)
+        assert c.git_backend == "batch"
+
+    def test_git_backend_wrongly_configured(self, project):
+        project.append(".therapist.yml", "git_backend: notabackend")
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.GIT_BACKEND_WRONGLY_CONFIGURED
+        assert err.value.message == "`git_backend` must be one of: batch, inprocess, subprocess."
+
+    def test_isolation(self, project):
+        project.append(".therapist.yml", "isolation: checkout")
+        c = Config(project.path)
+        assert c.isolation == "checkout"
+
+    def test_skip_attributes(self, project):
+        project.append(".therapist.yml", "skip_attributes: linguist-generated")
+        c = Config(project.path)
+        assert c.skip_attributes == ["linguist-generated"]
+
+    def test_skip_attributes_wrongly_configured(self, project):
+        project.append(".therapist.yml", "skip_attributes: {a: b}")
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.SKIP_ATTRIBUTES_WRONGLY_CONFIGURED
+
+    def test_isolation_wrongly_configured(self, project):
+        project.append(".therapist.yml", "isolation: notamode")
+
+        with pytest.raises(Config.Misconfigured) as err:
+            Config(project.path)
+
+        assert err.value.code == Config.Misconfigured.ISOLATION_WRONGLY_CONFIGURED
@@ -13,9 +13,39 @@ class TestProcess(object):
         assert p.description == "Process description"
         assert p.config == {"setting": "my-setting"}
 
+    def test_scheduling_options(self):
+        p = Process("my-process")
+        assert p.needs == []
+        assert not p.exclusive
+        assert p.concurrency_group is None
+
+        p = Process("my-process", needs="other", exclusive=True, concurrency_group="db")
+        assert p.needs == ["other"]
+        assert p.exclusive
+        assert p.concurrency_group == "db"
+        assert p.config == {}
+
     def test_str(self):
         p = Process("my-process")
         assert str(p) == "my-process"
 
         p = Process("my-process", description="Process description")
         assert str(p) == "Process description"
+
+    def test_is_read_only(self):
+        p = Process("my-process")
+        assert p.is_read_only()
+        assert not p.is_read_only(fix=True)
+
+    def test_match_files(self):
+        p = Process("my-process", include=["*.py", "*.txt"], exclude="ignored/")
+
+        def files():
+            yield "a.py"
+            yield "ignored/b.py"
+            raise AssertionError("Files should be matched as they arrive.")
+
+        matches = p.match_files(files())
+        assert next(matches) == "a.py"
+
+        assert p.filter_files(["a.py", "b.js", "c.txt", "ignored/d.py"]) == ["a.py", "c.txt"]
@@ -1,16 +1,35 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import os
 import pytest
+import signal
+import threading
+import time
 
 from xml.etree import ElementTree as ET
 
 from therapist.config import Config
+from therapist.plugins import Plugin
 from therapist.runner import Runner
-from therapist.runner.action import Action, ActionCollection
+from therapist.runner.runner import ENGINES, iterate_async
+from therapist.runner.action import (
+    Action,
+    ActionCollection,
+    batch_files,
+    format_command,
+    split_files,
+)
+from therapist.runner import cache as cache_module
+from therapist.runner.output import OutputBuffer
+from therapist.runner.cache import ResultCache, StatCache, hash_file, stat_signature
 from therapist.runner.result import Result, ResultCollection
+from therapist.runner.router import Router
+from therapist.runner.scheduler import Scheduler, find_cycle
+from therapist.utils.git import Git
+from therapist.utils.paths import PathIndex
 
-from . import Project
+from . import Project, chdir
 
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -52,6 +71,244 @@ class TestAction(object):
         a.exclude = ["a.py", "b.py"]
         assert a.exclude == ["a.py", "b.py"]
 
+    def test_select_files(self, tmpdir):
+        files = ["a.py", "working/b.py", "./working/c.py", "working-copy/d.py", "../e.py"]
+
+        a = Action("flake8", include="*.py")
+        assert a.select_files(files, cwd=tmpdir.strpath) == files[:4]
+
+        # Files have to be within the files root, not just start with its path
+        a.config["files_root"] = "working"
+        assert a.select_files(files, cwd=tmpdir.strpath) == ["working/b.py", "./working/c.py"]
+
+        a.config["working_dir"] = "working"
+        paths = a.filter_files(files, cwd=tmpdir.strpath, path_index=PathIndex())
+        assert paths == ["b.py", "c.py"]
+
+    def test_is_read_only(self):
+        a = Action("flake8", run="flake8 {files}")
+        assert a.is_read_only()
+        assert a.is_read_only(fix=True)
+
+        a = Action("black", run="black --check {files}", fix="black {files}")
+        assert a.is_read_only()
+        assert not a.is_read_only(fix=True)
+
+    def test_split_files(self, tmpdir):
+        for name, size in (("a", 10), ("b", 50), ("c", 30), ("d", 20)):
+            tmpdir.join(name).write("x" * size)
+
+        chunks = split_files(["a", "b", "c", "d"], 2, tmpdir.strpath)
+        assert sorted(chunks) == [["a", "b"], ["c", "d"]]
+
+        assert sorted(split_files(["a", "b"], 4, tmpdir.strpath)) == [["a"], ["b"]]
+        assert split_files(["a", "b"], 1, tmpdir.strpath) == [["a", "b"]]
+        assert split_files([], 2, tmpdir.strpath) == []
+
+        tmpdir.join("e").write("")
+        assert sorted(split_files(["d", "e", "missing"], 3, tmpdir.strpath)) == [
+            ["d"],
+            ["e"],
+            ["missing"],
+        ]
+
+    def test_batch_files(self):
+        files = ["a.py", "bb.py", "ccc.py"]
+        assert batch_files("lint {files}", files, 100) == [files]
+        assert batch_files("lint {files}", files, 17) == [["a.py", "bb.py"], ["ccc.py"]]
+        assert batch_files("lint {files}", files, 1) == [["a.py"], ["bb.py"], ["ccc.py"]]
+        assert batch_files("lint {files} && check {files}", files, 40) == [
+            ["a.py", "bb.py"],
+            ["ccc.py"],
+        ]
+        assert batch_files("lint", files, 1) == [files]
+
+    def test_execute_sharded(self, project):
+        project.write("pass.txt")
+        project.write("fail.txt")
+        project.write("pass2.txt")
+
+        a = Config(project.path).actions.get("lint")
+        result = a(files=["pass.txt", "fail.txt", "pass2.txt"], cwd=project.path, shard=3)
+
+        assert result.is_failure
+        assert result.output.count("SUCCESS!") == 2
+        assert "FAIL!  {}".format(project.abspath("fail.txt")) in result.output
+
+        a.config["shard"] = 2
+        result = a(files=["pass.txt", "pass2.txt"], cwd=project.path)
+        assert result.is_success
+        assert result.output.count("SUCCESS!") == 2
+
+    def test_timeout(self, project):
+        a = Action("sleep", run="sleep 5 # {files}", timeout=0.1)
+
+        start = time.time()
+        result = a(files=["pass.py"], cwd=project.path)
+
+        assert result.is_error
+        assert result.error == "Timed out after 0.1 seconds."
+        assert time.time() - start < 5
+
+    def test_execute_stdin(self, project):
+        project.write("pass.txt", "x")
+        project.write("fail.txt", "FAIL")
+        project.write("dir/pass.txt", "x")
+
+        script = "import sys; data = sys.stdin.read(); print('{file}', data); "
+        script += "sys.exit(data == 'FAIL')"
+        a = Action("stdin", run='python -c "{}"'.format(script), stdin=True)
+        assert a.uses_stdin()
+
+        result = a(files=["pass.txt", "fail.txt"], cwd=project.path)
+        assert result.is_failure
+        assert "pass.txt x\n" in result.output
+        assert "fail.txt FAIL\n" in result.output
+
+        result = a(files=["pass.txt"], cwd=project.path, read_file=lambda path: b"FAIL")
+        assert result.is_failure
+
+        a.config["working_dir"] = "dir"
+        result = a(files=["dir/pass.txt"], cwd=project.path)
+        assert result.is_success
+        assert result.output == "pass.txt x\n"
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            del a.config["working_dir"]
+            result = loop.run_until_complete(
+                a.execute_async(files=["pass.txt", "fail.txt"], cwd=project.path, shard=1)
+            )
+            assert result.is_failure
+            assert "pass.txt x\n" in result.output
+            assert "fail.txt FAIL\n" in result.output
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_execute_stdin_unread(self, project):
+        a = Action("stdin", run="true {file}", stdin=True)
+        data = b"x" * 1024 * 1024
+
+        result = a(files=["a.txt", "b.txt"], cwd=project.path, read_file=lambda path: data)
+        assert result.is_success
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            result = loop.run_until_complete(
+                a.execute_async(files=["a.txt"], cwd=project.path, read_file=lambda path: data)
+            )
+            assert result.is_success
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_stdin_fix(self):
+        a = Action("stdin", run="check {file}", fix="fix {files}", stdin=True)
+        assert a.uses_stdin()
+        assert not a.uses_stdin(fix=True)
+        assert a.get_cache_signature()["stdin"]
+        assert not a.get_cache_signature(fix=True)["stdin"]
+
+    def test_format_command(self):
+        ranges = {"a.py": "1-2,5-5", "b.py": "3-3"}
+        assert format_command("lint {files}", ["a.py", "b.py"]) == "lint a.py b.py"
+        assert format_command("lint {file} --lines={lines}", ["a.py"], ranges) == (
+            "lint a.py --lines=1-2,5-5"
+        )
+        assert format_command("lint {file_ranges}", ["a.py", "b.py"], ranges) == (
+            "lint a.py:1-2,5-5 b.py:3-3"
+        )
+
+        files = ["a.py", "b.py"]
+        assert batch_files("lint {file_ranges}", files, 20, ranges) == [["a.py"], ["b.py"]]
+        assert batch_files("lint {file_ranges}", files, 30, ranges) == [files]
+
+    def test_changed_lines(self, project):
+        project.write("a.txt", "1\n2\n3\n")
+        project.write("b.txt", "b\n")
+        project.write("c.txt", "")
+
+        changed_lines = {"a.txt": [(1, 1), (3, 3)], "b.txt": []}
+        a = Action("lines", run="echo {file} {lines}")
+        assert a.runs_per_file()
+        assert a.uses_changed_lines()
+        assert a.get_cache_signature() is None
+
+        # Files without changed lines are skipped and untracked files are changed throughout
+        kwargs = dict(cwd=project.path, changed_lines=changed_lines)
+        result = a(files=["a.txt", "b.txt", "c.txt"], **kwargs)
+        assert result.is_success
+        assert result.output == "a.txt 1-1,3-3\n"
+
+        result = a(files=["b.txt"], cwd=project.path, changed_lines=changed_lines)
+        assert result.is_skip
+
+        result = a(files=["a.txt", "b.txt"], cwd=project.path)
+        assert result.output == "a.txt 1-3\nb.txt 1-1\n"
+
+        a = Action("ranges", run="echo {file_ranges}", working_dir="dir")
+        project.write("dir/d.txt", "d\n")
+        assert not a.runs_per_file()
+
+        result = a(files=["a.txt", "dir/d.txt"], **kwargs)
+        assert result.output == "../a.txt:1-1,3-3 d.txt:1-1\n"
+
+    def test_execute_async(self, project):
+        project.write("pass.txt")
+        project.write("fail.txt")
+
+        a = Config(project.path).actions.get("lint")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+            result = loop.run_until_complete(
+                a.execute_async(files=["pass.txt", "fail.txt"], cwd=project.path, shard=2)
+            )
+            assert result.is_failure
+            assert "SUCCESS!" in result.output
+            assert "FAIL!  {}".format(project.abspath("fail.txt")) in result.output
+
+            result = loop.run_until_complete(a.execute_async(files=["pass.txt"], cwd=project.path))
+            assert result.is_success
+
+            result = loop.run_until_complete(a.execute_async(files=[], cwd=project.path))
+            assert result.is_skip
+
+            a.config["working_dir"] = "does-not-exist"
+            result = loop.run_until_complete(a.execute_async(files=["pass.txt"], cwd=project.path))
+            assert result.is_error
+            assert result.error.startswith("OSError")
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_execute_async_timeout_and_cancel(self, project):
+        a = Action("sleep", run="sleep 5 # {files}", timeout=0.1)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+            start = time.time()
+            result = loop.run_until_complete(a.execute_async(files=["a"], cwd=project.path))
+            assert result.is_error
+            assert result.error == "Timed out after 0.1 seconds."
+
+            del a.config["timeout"]
+            task = asyncio.ensure_future(a.execute_async(files=["a"], cwd=project.path))
+            loop.run_until_complete(asyncio.sleep(0.2))
+            task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                loop.run_until_complete(task)
+            assert time.time() - start < 5
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
 
 class TestActionCollection(object):
     def test_get(self):
@@ -186,6 +443,17 @@ class TestResultCollection(object):
             "ERR!\n"
         )
 
+    def test_dump_spilled_output(self):
+        output = OutputBuffer(spill_size=100, head_size=10, tail_size=10)
+        output.append("HEAD" + "x" * 200 + "TAIL")
+
+        r = Result(Action("flake8"), status=Result.FAILURE)
+        r.mark_complete(output=output)
+        rs = ResultCollection([r])
+
+        assert "HEADxxxxxx\n\n[... 188 characters omitted ...]\n\nxxxxxxTAIL\n" in rs.dump()
+        assert "HEAD" + "x" * 200 + "TAIL" in rs.dump_junit()
+
     def test_dump_skip(self):
         r = Result(Action("flake8"))
         rs = ResultCollection([r])
@@ -283,6 +551,350 @@ class TestResultCollection(object):
         )
 
 
+class TestOutputBuffer(object):
+    def test_in_memory(self):
+        output = OutputBuffer()
+        output.write(b"Hello ")
+        output.write(b"World!")
+        output.close()
+
+        assert not output.spilled
+        assert len(output) == 12
+        assert output.read() == "Hello World!"
+        assert output.preview == "Hello World!"
+
+    def test_decoding(self):
+        output = OutputBuffer()
+        data = "caf\u00e9 \u2603".encode("utf-8")
+
+        # Characters split across chunks are still decoded
+        for byte in data:
+            output.write(bytes([byte]))
+        output.write(b" \xff")
+        output.close()
+
+        assert output.read() == "caf\u00e9 \u2603 \ufffd"
+
+    def test_spill(self):
+        output = OutputBuffer(spill_size=100, head_size=10, tail_size=20)
+        for i in range(100):
+            output.append("{:04d}\n".format(i))
+
+        assert output.spilled
+        assert len(output) == 500
+        assert output.read() == "".join("{:04d}\n".format(i) for i in range(100))
+        assert output._tail_length < 40
+        assert output.preview == (
+            "0000\n0001\n\n\n[... 470 characters omitted ...]\n\n0096\n0097\n0098\n0099\n"
+        )
+
+        # Reading doesn't interfere with any output written afterwards
+        output.append("END")
+        assert output.read().endswith("0099\nEND")
+        assert output.preview.endswith("0098\n0099\nEND")
+
+    def test_join(self):
+        a = OutputBuffer(spill_size=10)
+        a.append("a" * 20)
+        joined = OutputBuffer.join([a, "b", OutputBuffer()])
+
+        assert joined.read() == "a" * 20 + "b"
+
+    def test_run_command_spills_long_output(self, project):
+        a = Action("noisy", run="python -c \"print('x' * 3000000)\"")
+        status, output, error = a.run_command(a.get_command(), project.path)
+
+        assert status == Result.SUCCESS
+        assert output.spilled
+        assert output.read() == "x" * 3000000 + "\n"
+        assert len(output.preview) < 3000000
+        assert error.read() == ""
+
+
+class TestResultCache(object):
+    def test_hash_file(self, tmpdir):
+        tmpdir.join("a.txt").write("content")
+        # The hash is the same as the blob id git would give the file
+        assert hash_file(tmpdir.join("a.txt").strpath) == (
+            "6b584e8ece562ebffc15d38808cd6b98fc3d97ea"
+        )
+        assert hash_file(tmpdir.join("missing.txt").strpath) is None
+
+    def test_key(self, tmpdir):
+        cache = ResultCache(tmpdir.strpath)
+        key = cache.key({"command": "lint {files}"}, {"a.py": "1", "b.py": "2"})
+
+        assert key == cache.key({"command": "lint {files}"}, {"b.py": "2", "a.py": "1"})
+        assert key != cache.key({"command": "lint {files}"}, {"a.py": "1", "b.py": "3"})
+        assert key != cache.key({"command": "lint {files}"}, {"a.py": "1"})
+        assert key != cache.key({"command": "fix {files}"}, {"a.py": "1", "b.py": "2"})
+
+    def test_get_set(self, tmpdir):
+        cache = ResultCache(tmpdir.strpath)
+        action = Action("lint")
+        key = cache.key({}, {"a.py": "1"})
+
+        assert cache.get(key, action) is None
+
+        r = Result(action, status=Result.FAILURE)
+        r.mark_complete(output="Failed!", error="ERR!")
+        cache.set(key, r)
+
+        cached = cache.get(key, action)
+        assert cached.is_failure
+        assert cached.cached
+        assert cached.process == action
+        assert cached.output == "Failed!"
+        assert cached.error == "ERR!"
+
+    def test_only_cacheable_results_are_stored(self, tmpdir):
+        cache = ResultCache(tmpdir.strpath)
+        action = Action("lint")
+
+        r = Result(action, status=Result.ERROR)
+        cache.set("a" * 64, r)
+        assert cache.get("a" * 64, action) is None
+
+        r = Result(action, status=Result.SUCCESS)
+        r.add_modified_file("a.py")
+        cache.set("b" * 64, r)
+        assert cache.get("b" * 64, action) is None
+
+        output = OutputBuffer(spill_size=10)
+        output.append("x" * 20)
+        r = Result(action, status=Result.FAILURE)
+        r.mark_complete(output=output)
+        cache.set("c" * 64, r)
+        assert cache.get("c" * 64, action) is None
+
+    def test_prune(self, tmpdir):
+        cache = ResultCache(tmpdir.strpath)
+        action = Action("lint")
+
+        for i, key in enumerate(("a" * 64, "b" * 64, "c" * 64)):
+            cache.set(key, Result(action, status=Result.SUCCESS))
+            path = tmpdir.join("results", key[:2], "{}.json".format(key)).strpath
+            os.utime(path, (i, i))
+
+        cache.prune(max_entries=2)
+
+        assert cache.get("a" * 64, action) is None
+        assert cache.get("b" * 64, action) is not None
+        assert cache.get("c" * 64, action) is not None
+
+    def test_passed_files(self, tmpdir):
+        cache = ResultCache(tmpdir.strpath)
+        signature = {"command": "lint {files}"}
+
+        assert cache.get_passed_files(signature, {"a.py": "1"}) == set()
+
+        cache.add_passed_files(signature, {"a.py": "1", "b.py": "2", "c.py": None})
+
+        hashes = {"a.py": "1", "b.py": "changed", "c.py": None}
+        assert cache.get_passed_files(signature, hashes) == {"a.py"}
+        assert cache.get_passed_files({"command": "other {files}"}, hashes) == set()
+
+        cache.add_passed_files(signature, {"d.py": "4"}, max_entries=2)
+        hashes = {"a.py": "1", "b.py": "2", "d.py": "4"}
+        assert len(cache.get_passed_files(signature, hashes)) == 2
+        assert "d.py" in cache.get_passed_files(signature, hashes)
+
+
+class TestStatCache(object):
+    def test_stat_signature(self, tmpdir):
+        tmpdir.join("a.txt").write("content")
+        st = os.stat(tmpdir.join("a.txt").strpath)
+
+        assert stat_signature(tmpdir.join("a.txt").strpath) == (
+            st.st_ino,
+            st.st_size,
+            st.st_mtime_ns,
+        )
+        assert stat_signature(tmpdir.join("missing.txt").strpath) is None
+
+    def test_hashes(self, tmpdir, monkeypatch):
+        tmpdir.join("a.txt").write("a")
+        tmpdir.join("b.txt").write("b")
+        for name in ("a.txt", "b.txt"):
+            os.utime(tmpdir.join(name).strpath, (1000000000, 1000000000))
+
+        hashed = []
+
+        def record_hash_file(path):
+            hashed.append(os.path.basename(path))
+            return hash_file(path)
+
+        monkeypatch.setattr(cache_module, "hash_file", record_hash_file)
+
+        path = tmpdir.join("cache", "stat.json").strpath
+        stat_cache = StatCache(tmpdir.strpath, path=path, jobs=2)
+        hashes = stat_cache.hashes(["a.txt", "b.txt", "missing.txt"])
+
+        assert hashes == {
+            "a.txt": "2e65efe2a145dda7ee51d1741299f848e5bf752e",
+            "b.txt": "63d8dbd40c23542e740659a7168a0ce3138ea748",
+            "missing.txt": None,
+        }
+        assert sorted(hashed) == ["a.txt", "b.txt"]
+
+        # Unchanged files are not hashed again, even by a new cache loaded from disk
+        stat_cache.save()
+        stat_cache = StatCache(tmpdir.strpath, path=path)
+        assert stat_cache.hashes(["a.txt", "b.txt"]) == {
+            "a.txt": "2e65efe2a145dda7ee51d1741299f848e5bf752e",
+            "b.txt": "63d8dbd40c23542e740659a7168a0ce3138ea748",
+        }
+        assert len(hashed) == 2
+
+        # Changed files are hashed again
+        tmpdir.join("b.txt").write("changed")
+        assert stat_cache.hashes(["a.txt", "b.txt"])["b.txt"] == (
+            "21fb1eca31e64cd3914025058b21992ab76edcf9"
+        )
+        assert hashed[2:] == ["b.txt"]
+
+        # Recently modified files may change without their signature changing so they are
+        # always hashed
+        assert stat_cache.hashes(["b.txt"])
+        assert hashed[3:] == ["b.txt"]
+
+
+class TestScheduler(object):
+    def test_find_cycle(self):
+        a = Action("a", needs="b")
+        b = Action("b", needs="c")
+        c = Action("c")
+        assert find_cycle([a, b, c]) is None
+
+        c.needs = "a"
+        assert find_cycle([a, b, c]) == [a, b, c, a]
+
+    def test_needs(self):
+        a = Action("a", needs="b")
+        b = Action("b")
+        c = Action("c", needs="missing")
+        s = Scheduler([a, b, c])
+
+        assert s.ready([], {}, 4) == [b, c]
+        assert s.ready([b, c], {}, 4) == []
+        assert s.ready([c], {b: None}, 4) == [a]
+
+    def test_capacity(self):
+        a, b, c = Action("a"), Action("b"), Action("c")
+        s = Scheduler([a, b, c])
+
+        assert s.ready([], {}, 2) == [a, b]
+        assert s.ready([a, b], {}, 0) == []
+
+    def test_exclusive(self):
+        a = Action("a")
+        b = Action("b", exclusive=True)
+        c = Action("c")
+        s = Scheduler([a, b, c])
+
+        assert s.ready([], {}, 4) == [a]
+        assert s.ready([a], {}, 4) == []
+        assert s.ready([], {a: None}, 4) == [b]
+        assert s.ready([b], {a: None}, 4) == []
+        assert s.ready([], {a: None, b: None}, 4) == [c]
+
+    def test_concurrency_group(self):
+        a = Action("a", concurrency_group="db")
+        b = Action("b", concurrency_group="db")
+        c = Action("c")
+        s = Scheduler([a, b, c])
+
+        assert s.ready([], {}, 4) == [a, c]
+        assert s.ready([a, c], {}, 4) == []
+        assert s.ready([c], {a: None}, 4) == [b]
+
+    def test_writers_run_before_readers(self):
+        check = Action("check", run="check {files}")
+        fix = Action("fix", run="check {files}", fix="fix {files}")
+        other = Action("other", run="check {files}")
+        files = {check: ["a.py"], fix: ["a.py", "b.py"], other: ["c.py"]}
+
+        s = Scheduler([check, fix, other], fix=False, files=files)
+        assert s.ready([], {}, 4) == [check, fix, other]
+
+        s = Scheduler([check, fix, other], fix=True, files=files)
+        assert s.dependencies[check] == {fix}
+        assert s.ready([], {}, 4) == [fix]
+        assert s.ready([], {fix: None}, 4) == [check, other]
+
+        # A writer that needs a reader still runs after it
+        fix.needs = "check"
+        s = Scheduler([check, fix, other], fix=True, files=files)
+        assert s.dependencies[check] == set()
+        assert s.ready([], {}, 4) == [check, other]
+
+
+class TestRouter(object):
+    files = [
+        "setup.py",
+        "README.md",
+        "docs/index.rst",
+        "./lib/a.py",
+        "lib/b.min.js",
+        "lib/c.js",
+        "lib/Makefile",
+        "lib/vendor/d.py",
+        "lib/vendor/e.tar.gz",
+        "tests/.hidden.py",
+        "tests/test_a.py",
+        "working/src/f.py",
+        "working-copy/g.py",
+    ]
+
+    def assert_routes(self, processes, cwd):
+        selected = Router(processes, cwd=cwd).route(iter(self.files))
+        for process in processes:
+            assert selected[process] == process.select_files(self.files, cwd=cwd)
+
+    def test_matches_select_files(self, tmpdir):
+        processes = [
+            Action("everything"),
+            Action("python", include="*.py"),
+            Action("scripts", include=["*.js", "*.py"], exclude=["*.min.js", "vendor/"]),
+            Action("archives", include="*.tar.gz"),
+            Action("names", include=["Makefile", "README.md", "lib"], exclude="*.js"),
+            Action("globs", include=["docs/**", "tests/test_*.py"]),
+            Action("negated", include=["*.py", "!tests/", "*.js"]),
+            Action("root", include="*.py", files_root="working"),
+            Action("nothing", include="*.go"),
+        ]
+        self.assert_routes(processes, tmpdir.strpath)
+
+    def test_could_match_within(self, tmpdir):
+        processes = [
+            Action("docs", include=["/docs/**/*.rst", "/README"], exclude="docs/build/"),
+            Action("python", include="*.py", exclude=["vendor/", "*.pyc"], files_root="src"),
+        ]
+        router = Router(processes, cwd=tmpdir.strpath)
+
+        for directory in (".", "docs", "docs/api", "src", "./src/lib", "src/lib/vendor2", ".."):
+            assert router.could_match_within(directory), directory
+        for directory in ("docs/build", "lib", "src/vendor", "src/lib/vendor"):
+            assert not router.could_match_within(directory), directory
+
+        # Negated patterns may bring back files within excluded directories
+        processes[1].exclude = ["vendor/", "!vendor/keep.py"]
+        assert Router(processes, cwd=tmpdir.strpath).could_match_within("src/vendor")
+
+        assert Router([Action("all")], cwd=tmpdir.strpath).could_match_within("lib")
+
+    def test_overridden_select_files(self, tmpdir):
+        class Custom(Action):
+            def select_files(self, files, **kwargs):
+                return [f for f in files if f.startswith("lib/")]
+
+        processes = [Custom("custom", include="*.py"), Action("python", include="*.py")]
+        selected = Router(processes, cwd=tmpdir.strpath).route(self.files)
+
+        assert selected[processes[0]] == [f for f in self.files if f.startswith("lib/")]
+        self.assert_routes(processes, tmpdir.strpath)
+
+
 class TestRunner(object):
     def test_unstaged_changes(self, project):
         project.write("pass.txt", "FAIL")
@@ -404,7 +1016,33 @@ class TestRunner(object):
             "#{cyan}[SKIPPED]"
         )
 
-    def test_run_process_error(self, project):
+    def test_run_process_error(self, tmpdir):
+        config_data = {
+            "actions": {
+                "lint": {
+                    "description": "Linting",
+                    "run": "./scripts/lint.py {files}",
+                    "working_dir": "missing",
+                }
+            }
+        }
+        project = Project(tmpdir.strpath, config_data=config_data)
+
+        project.write("pass.txt")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True)
+        result, message = r.run_process(c.actions.get("lint"))
+
+        assert result.is_error
+        assert result.error.startswith("OSError")
+        assert message == (
+            "#{bright}Linting ............................................................. "
+            "#{red}[ERROR!!]"
+        )
+
+    def test_run_process_batches_long_command_lines(self, project):
         for i in range(10000):
             project.write("pass{}.txt".format(str(i).ljust(200, "_")))
         project.git.add(".")
@@ -413,11 +1051,12 @@ class TestRunner(object):
         r = Runner(c.cwd, enable_git=True)
         result, message = r.run_process(c.actions.get("lint"))
 
-        assert result.is_error
+        assert result.is_success
+        assert result.output.count("SUCCESS!") > 1
         assert len(r.files) == 10000
         assert message == (
             "#{bright}Linting ............................................................. "
-            "#{red}[ERROR!!]"
+            "#{green}[SUCCESS]"
         )
 
     def test_run_process_skips_deleted(self, project):
@@ -610,6 +1249,22 @@ class TestRunner(object):
         assert result.is_failure
         assert project.exists("fail.txt")
 
+    def test_skip_attributes(self, project):
+        project.write(".gitattributes", "generated/** linguist-generated\n")
+        project.write("generated/fail.txt", "FAIL")
+        project.write("pass.txt")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True)
+        result, message = r.run_process(c.actions.get("lint"))
+        assert result.is_failure
+
+        r = Runner(c.cwd, enable_git=True, skip_attributes=["linguist-generated"])
+        assert "generated/fail.txt" not in r.files
+        result, message = r.run_process(c.actions.get("lint"))
+        assert result.is_success
+
     def test_action_files_root(self, project):
         project.copy("scripts", "working/scripts")
         project.git.add(".")
@@ -643,3 +1298,683 @@ class TestRunner(object):
         assert len(r.files) == 0
         assert result.is_skip
         assert not project.exists("pass.txt")
+
+    def test_run_processes(self, project):
+        project.write("pass.py")
+        project.write("fail.txt")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=4)
+        processes = [c.actions.get("lint"), c.plugins.get("simple")]
+
+        with chdir(project.path):
+            results = list(r.run_processes(processes))
+
+        assert [result.process for result, message in results] == processes
+        assert results[0][0].is_failure
+        assert results[1][0].is_success
+
+    def test_run_processes_with_fix(self, project):
+        project.write("pass.py", "UNFIXED")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, fix=True, jobs=4)
+        processes = [c.actions.get("lint"), c.plugins.get("simple")]
+
+        with chdir(project.path):
+            results = list(r.run_processes(processes))
+
+        assert results[0][0].modified_files == ["pass.py"]
+        assert results[1][0].is_success
+        assert project.read("pass.py") == "FIXED"
+
+    def test_run_processes_in_parallel(self, project):
+        project.write("pass.py")
+        project.git.add(".")
+
+        barrier = threading.Barrier(2, timeout=5)
+
+        class MeetingPlugin(Plugin):
+            def execute(self, **kwargs):
+                # Only returns once the other process is running at the same time
+                barrier.wait()
+                return Result(self, status=Result.SUCCESS)
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=2)
+        processes = [MeetingPlugin("first"), MeetingPlugin("second")]
+
+        with chdir(project.path):
+            results = list(r.run_processes(processes))
+
+        assert [result.process for result, message in results] == processes
+        assert all(result.is_success for result, message in results)
+
+    def test_default_jobs(self, project):
+        c = Config(project.path)
+        r = Runner(c.cwd)
+        assert r.jobs >= 1
+
+    def test_run_processes_stashes_once(self, project, monkeypatch):
+        project.write("pass.txt", "FAIL")
+        project.write("pass.py", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=2)
+
+        calls = []
+        git_call = Git.__call__
+
+        def record_call(self, *args, **kwargs):
+            calls.append(self.current[1:])
+            return git_call(self, *args, **kwargs)
+
+        monkeypatch.setattr(Git, "__call__", record_call)
+
+        lint = c.actions.get("lint")
+        other = Action("other", run=lint.config["run"], include="*.py")
+
+        with chdir(project.path):
+            results = list(r.run_processes([lint, other]))
+
+        assert all(result.is_failure for result, message in results)
+        assert calls.count(["stash"]) == 1
+        assert calls.count(["reset"]) == 1
+        assert calls.count(["stash", "pop"]) == 1
+        assert project.read("pass.txt") == "x"
+
+    def test_run_processes_restores_on_interrupt(self, project):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        class InterruptedPlugin(Plugin):
+            def execute(self, **kwargs):
+                raise KeyboardInterrupt()
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=1)
+
+        with pytest.raises(KeyboardInterrupt):
+            list(r.run_processes([c.actions.get("lint"), InterruptedPlugin("interrupted")]))
+
+        assert project.read("pass.txt") == "x"
+        out, err, code = project.git.stash.list()
+        assert out == ""
+
+    def test_run_processes_restores_on_interrupt_while_stashing(self, project, monkeypatch):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=1)
+
+        stash = r.backend.stash
+
+        def interrupted_stash():
+            stashed = stash()
+            os.kill(os.getpid(), signal.SIGINT)
+            return stashed
+
+        monkeypatch.setattr(r.backend, "stash", interrupted_stash)
+
+        with pytest.raises(KeyboardInterrupt):
+            list(r.run_processes([c.actions.get("lint")]))
+
+        assert project.read("pass.txt") == "x"
+        out, err, code = project.git.stash.list()
+        assert out == ""
+
+    def test_run_processes_restores_on_termination_while_stashing(self, project, monkeypatch):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=1)
+
+        stash = r.backend.stash
+
+        def terminated_stash():
+            stashed = stash()
+            os.kill(os.getpid(), signal.SIGTERM)
+            return stashed
+
+        monkeypatch.setattr(r.backend, "stash", terminated_stash)
+
+        # Ignore the signal if it gets past the runner rather than killing the tests
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: None)
+        try:
+            with pytest.raises(KeyboardInterrupt):
+                list(r.run_processes([c.actions.get("lint")]))
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+        assert project.read("pass.txt") == "x"
+        out, err, code = project.git.stash.list()
+        assert out == ""
+
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_run_processes_closes_backend(self, project, tmpdir, monkeypatch, engine):
+        project.write("pass.txt")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(
+            c.cwd,
+            enable_git=True,
+            engine=engine,
+            git_backend="batch",
+            cache_dir=tmpdir.join("cache").strpath,
+        )
+
+        calls = []
+        monkeypatch.setattr(r.backend, "close", lambda: calls.append("close"))
+        monkeypatch.setattr(r.cache, "prune", lambda: calls.append("prune"))
+
+        # Stopping early still releases the backend
+        results = r.run_processes([c.actions.get("lint"), c.plugins.get("simple")])
+        next(results)
+        results.close()
+        assert calls == ["prune", "close"]
+
+        class InterruptedPlugin(Plugin):
+            def execute(self, **kwargs):
+                raise KeyboardInterrupt()
+
+        with pytest.raises(KeyboardInterrupt):
+            list(r.run_processes([InterruptedPlugin("interrupted")]))
+        assert calls == ["prune", "close"] * 2
+
+    def test_run_processes_selects_files_once(self, project, monkeypatch):
+        project.write("fail.txt")
+        project.write("other.md")
+        project.git.add(".")
+
+        c = Config(project.path)
+        action = c.actions.get("lint")
+        r = Runner(c.cwd, enable_git=True)
+
+        calls = []
+        select_files = Action.select_files
+
+        def record_select_files(self, files, **kwargs):
+            calls.append(list(files))
+            return select_files(self, files, **kwargs)
+
+        monkeypatch.setattr(Action, "select_files", record_select_files)
+
+        # The runner routes the files once and the action uses them as they are
+        results = list(r.run_processes([action]))
+        assert results[0][0].is_failure
+        assert calls == []
+
+        # Executed directly, the action selects its files itself
+        result = action(files=["fail.txt", "other.md"], cwd=project.path)
+        assert result.is_failure
+        assert calls == [["fail.txt", "other.md"]]
+
+    def test_run_process_no_matching_files(self, project, monkeypatch):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True)
+
+        calls = []
+        monkeypatch.setattr(Git, "__call__", lambda self, *args, **kwargs: calls.append(args))
+
+        action = Action("js", description="JS", run="false {files}", include="*.js")
+        result, message = r.run_process(action)
+
+        assert result.is_skip
+        assert calls == []
+        assert message == (
+            "#{bright}JS .................................................................. "
+            "#{cyan}[SKIPPED]"
+        )
+
+    def test_run_processes_only_stashes_overlapping_files(self, project, monkeypatch):
+        project.write("pass.txt", "FAIL")
+        project.write("fail.py")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True)
+        assert r.unstaged_files == {"pass.txt"}
+
+        calls = []
+        git_call = Git.__call__
+
+        def record_call(self, *args, **kwargs):
+            calls.append(self.current[1:])
+            return git_call(self, *args, **kwargs)
+
+        monkeypatch.setattr(Git, "__call__", record_call)
+
+        action = Action("py", run=c.actions.get("lint").config["run"], include="*.py")
+        results = list(r.run_processes([action]))
+
+        assert results[0][0].is_failure
+        assert ["stash"] not in calls
+
+        results = list(r.run_processes([action, c.actions.get("lint")]))
+
+        assert results[1][0].is_failure
+        assert calls.count(["stash"]) == 1
+        assert project.read("pass.txt") == "x"
+
+    def test_checkout_isolation(self, project, monkeypatch):
+        project.write("pass.txt")
+        project.write("fail.py")
+        project.git.add(".")
+        project.git.commit(m="Add files.")
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+        project.write("untracked.txt", "x")
+        mtime = os.stat(project.abspath("pass.txt")).st_mtime_ns
+
+        seen = {}
+
+        class InspectingPlugin(Plugin):
+            def execute(self, files=None, cwd=None, **kwargs):
+                seen["cwd"] = cwd
+                seen["pass.txt"] = open(os.path.join(cwd, "pass.txt")).read()
+                seen["linked"] = os.path.samefile(
+                    os.path.join(cwd, "fail.py"), project.abspath("fail.py")
+                )
+                seen["untracked"] = os.path.exists(os.path.join(cwd, "untracked.txt"))
+                return Result(self, status=Result.SUCCESS)
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, isolation="checkout")
+
+        calls = []
+        git_call = Git.__call__
+
+        def record_call(self, *args, **kwargs):
+            calls.append(self.current[1:])
+            return git_call(self, *args, **kwargs)
+
+        monkeypatch.setattr(Git, "__call__", record_call)
+
+        results = list(r.run_processes([c.actions.get("lint"), InspectingPlugin("inspecting")]))
+
+        assert results[0][0].is_failure
+        assert results[1][0].is_success
+        assert ["stash"] not in calls and ["reset"] not in calls
+
+        assert seen["cwd"] != project.path
+        assert seen["pass.txt"] == "FAIL"
+        assert seen["linked"]
+        assert not seen["untracked"]
+        assert not os.path.exists(seen["cwd"])
+
+        assert project.read("pass.txt") == "x"
+        assert os.stat(project.abspath("pass.txt")).st_mtime_ns == mtime
+        out, err, code = project.git.status(porcelain=True)
+        assert "MM pass.txt" in out
+
+    def test_checkout_isolation_include_untracked(self, project):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+        project.write("new.txt", "FAIL")
+
+        seen = {}
+
+        class InspectingPlugin(Plugin):
+            def execute(self, files=None, cwd=None, **kwargs):
+                seen["new.txt"] = open(os.path.join(cwd, "new.txt")).read()
+                return Result(self, status=Result.SUCCESS)
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, isolation="checkout", include_untracked=True)
+        assert "new.txt" in r.files
+
+        results = list(r.run_processes([c.actions.get("lint"), InspectingPlugin("inspecting")]))
+
+        assert results[0][0].is_failure
+        assert seen["new.txt"] == "FAIL"
+        assert project.read("new.txt") == "FAIL"
+
+    def test_checkout_isolation_stashes_to_fix(self, project):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, isolation="checkout", fix=True)
+        results = list(r.run_processes([c.actions.get("lint")]))
+
+        assert results[0][0].is_success
+        assert results[0][0].has_modified_files
+        assert project.read("pass.txt") == "x"
+
+    def test_checkout_isolation_removed_on_interrupt(self, project):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        class InterruptedPlugin(Plugin):
+            def execute(self, **kwargs):
+                raise KeyboardInterrupt()
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, isolation="checkout", jobs=1)
+
+        with pytest.raises(KeyboardInterrupt):
+            list(r.run_processes([c.actions.get("lint"), InterruptedPlugin("interrupted")]))
+
+        assert os.listdir(os.path.join(project.path, ".git", "therapist")) == []
+        assert project.read("pass.txt") == "x"
+
+    def test_stdin_reads_staged_contents(self, project, monkeypatch):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+        mtime = os.stat(project.abspath("pass.txt")).st_mtime_ns
+
+        script = "import sys; sys.exit(sys.stdin.read() == 'FAIL')"
+        action = Action("stdin", run='python -c "{}" {{file}}'.format(script), stdin=True)
+
+        calls = []
+        git_call = Git.__call__
+
+        def record_call(self, *args, **kwargs):
+            calls.append(self.current[1:])
+            return git_call(self, *args, **kwargs)
+
+        monkeypatch.setattr(Git, "__call__", record_call)
+
+        for engine in ENGINES:
+            r = Runner(project.path, enable_git=True, engine=engine)
+            results = list(r.run_processes([action]))
+            assert results[0][0].is_failure
+
+        assert ["stash"] not in calls
+        assert os.stat(project.abspath("pass.txt")).st_mtime_ns == mtime
+
+        # The cache is keyed on the staged contents the action actually saw
+        staged = r.hash_files(["pass.txt"], staged=True)["pass.txt"]
+        assert staged == r.snapshot.blob_ids["pass.txt"]
+        assert staged != r.hash_files(["pass.txt"])["pass.txt"]
+
+        r = Runner(project.path, enable_git=True, include_unstaged_changes=True)
+        result, message = r.run_process(action)
+        assert result.is_success
+
+    def test_changed_lines(self, project):
+        project.write("pass.txt", "1\n2\n3\n")
+        project.git.add(".")
+        project.git.commit(m="Add file.")
+        project.write("pass.txt", "1\nchanged\n3\n")
+        project.git.add(".")
+        project.write("pass.txt", "1\nchanged\n3\nunstaged\n")
+
+        seen = {}
+
+        class LinesPlugin(Plugin):
+            def execute(self, files=None, changed_lines=None, **kwargs):
+                seen.update((f, changed_lines.get(f)) for f in files)
+                return Result(self, status=Result.SUCCESS)
+
+        action = Action("lines", run="echo {file_ranges}", include="*.txt")
+
+        r = Runner(project.path, enable_git=True)
+        results = list(r.run_processes([action, LinesPlugin("lines", include="*.txt")]))
+        assert results[0][0].output == "pass.txt:2-2\n"
+        assert seen == {"pass.txt": [(2, 2)]}
+
+        r = Runner(project.path, enable_git=True, include_unstaged_changes=True)
+        result, message = r.run_process(action)
+        assert result.output == "pass.txt:2-2,4-4\n"
+
+    def test_result_cache(self, project, tmpdir, monkeypatch):
+        project.write("fail.txt")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, cache_dir=tmpdir.join("cache").strpath)
+        result, message = r.run_process(c.actions.get("lint"))
+
+        assert result.is_failure
+        assert not result.cached
+
+        def fail(*args, **kwargs):
+            raise AssertionError("The action should not be run.")
+
+        monkeypatch.setattr(Action, "run_command", fail)
+
+        result, message = r.run_process(c.actions.get("lint"))
+        assert result.is_failure
+        assert result.cached
+        assert "FAIL!" in result.output
+
+        monkeypatch.undo()
+        project.write("fail.txt", "changed")
+        project.git.add(".")
+
+        result, message = r.run_process(c.actions.get("lint"))
+        assert result.is_failure
+        assert not result.cached
+
+    def test_result_cache_inputs(self, project, tmpdir):
+        project.write("pass.txt")
+        project.write("setup.cfg", "[lint]")
+        project.git.add(".")
+
+        c = Config(project.path)
+        action = c.actions.get("lint")
+        action.config["cache_inputs"] = "setup.cfg"
+
+        r = Runner(c.cwd, enable_git=True, cache_dir=tmpdir.join("cache").strpath)
+        result, message = r.run_process(action)
+        assert not result.cached
+
+        result, message = r.run_process(action)
+        assert result.cached
+
+        project.write("setup.cfg", "[lint]\nstrict = true")
+
+        result, message = r.run_process(action)
+        assert not result.cached
+
+    def test_per_file_result_cache(self, project, tmpdir, monkeypatch):
+        project.write("a.txt")
+        project.write("b.txt")
+        project.git.add(".")
+
+        c = Config(project.path)
+        action = c.actions.get("lint")
+        action.config["per_file"] = True
+
+        r = Runner(c.cwd, enable_git=True, cache_dir=tmpdir.join("cache").strpath)
+        result, message = r.run_process(action)
+        assert result.is_success
+        assert not result.cached
+
+        # All of the files have passed so the action doesn't need to run
+        result, message = r.run_process(action)
+        assert result.is_success
+        assert result.cached
+
+        project.write("b.txt", "FAIL")
+        project.git.add(".")
+
+        calls = []
+        run_command = Action.run_command
+
+        def record_run_command(self, command, cwd):
+            calls.append(command)
+            return run_command(self, command, cwd)
+
+        monkeypatch.setattr(Action, "run_command", record_run_command)
+        result, message = r.run_process(action)
+
+        assert result.is_failure
+        assert len(calls) == 1
+        assert "b.txt" in calls[0]
+        assert "a.txt" not in calls[0]
+
+    def test_hash_files(self, project):
+        project.write("a.txt", "a")
+        project.write("b.txt", "b")
+        project.git.add(".")
+        project.write("b.txt", "changed")
+        project.write("c.txt", "changed")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True)
+        hashes = r.hash_files(["a.txt", "b.txt", "c.txt", "missing.txt"])
+
+        assert hashes == {
+            "a.txt": "2e65efe2a145dda7ee51d1741299f848e5bf752e",
+            "b.txt": "21fb1eca31e64cd3914025058b21992ab76edcf9",
+            "c.txt": "21fb1eca31e64cd3914025058b21992ab76edcf9",
+            "missing.txt": None,
+        }
+
+        with r.isolate_unstaged_changes():
+            assert r.hash_files(["b.txt"]) == {"b.txt": "63d8dbd40c23542e740659a7168a0ce3138ea748"}
+
+        r = Runner(c.cwd)
+        assert r.hash_files(["a.txt", "b.txt", "c.txt", "missing.txt"]) == hashes
+
+    def test_run_processes_dependencies(self, project):
+        project.write("pass.py")
+        project.git.add(".")
+
+        events = []
+
+        class RecordingPlugin(Plugin):
+            def execute(self, **kwargs):
+                events.append(self.name)
+                result = Result(self)
+                result.mark_complete(status=Result.SUCCESS)
+                return result
+
+        a = RecordingPlugin("a", needs=["c"])
+        b = RecordingPlugin("b", needs=["a"])
+        c = RecordingPlugin("c")
+
+        c_ = Config(project.path)
+        r = Runner(c_.cwd, enable_git=True, jobs=4)
+        results = list(r.run_processes([a, b, c]))
+
+        assert events == ["c", "a", "b"]
+        assert [result.process for result, message in results] == [a, b, c]
+
+    def test_run_processes_asyncio(self, project):
+        project.write("pass.py")
+        project.write("fail.txt")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=4, engine="asyncio")
+        lint = c.actions.get("lint")
+        other = Action("other", run=lint.config["run"], include="*.py", needs="simple")
+        processes = [lint, c.plugins.get("simple"), other]
+
+        with chdir(project.path):
+            results = list(r.run_processes(processes))
+
+        assert [result.process for result, message in results] == processes
+        assert results[0][0].is_failure
+        assert "[FAILURE]" in results[0][1]
+        assert results[1][0].is_success
+        assert results[2][0].is_success
+        assert results[2][0].start_time >= results[1][0].end_time
+
+    def test_run_processes_asyncio_with_fix(self, project):
+        project.write("pass.py", "UNFIXED")
+        project.git.add(".")
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, fix=True, jobs=4, engine="asyncio")
+
+        with chdir(project.path):
+            results = list(r.run_processes([c.actions.get("lint")]))
+
+        assert results[0][0].modified_files == ["pass.py"]
+        assert project.read("pass.py") == "FIXED"
+
+    def test_run_processes_asyncio_restores_on_interrupt(self, project):
+        project.write("pass.txt", "FAIL")
+        project.git.add(".")
+        project.write("pass.txt", "x")
+
+        class InterruptedPlugin(Plugin):
+            def execute(self, **kwargs):
+                raise KeyboardInterrupt()
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, jobs=1, engine="asyncio")
+
+        with pytest.raises(KeyboardInterrupt):
+            list(r.run_processes([c.actions.get("lint"), InterruptedPlugin("interrupted")]))
+
+        assert project.read("pass.txt") == "x"
+        out, err, code = project.git.stash.list()
+        assert out == ""
+
+    def test_iterate_async_closes_generator(self):
+        closed = []
+
+        async def generate():
+            try:
+                yield 1
+                await asyncio.sleep(10)
+                yield 2
+            finally:
+                closed.append(True)
+
+        items = iterate_async(generate())
+        assert next(items) == 1
+        items.close()
+
+        assert closed == [True]
+
+    def test_files_with_special_characters(self, project):
+        project.write("dir/with space.py")
+        project.write("caf\u00e9.py")
+        project.git.add(".")
+
+        r = Runner(project.path, enable_git=True)
+        assert sorted(r.files) == ["caf\u00e9.py", "dir/with space.py"]
+
+    def test_git_status_is_read_once(self, project, monkeypatch):
+        project.write("pass.py", "UNFIXED")
+        project.write("pass.txt")
+        project.git.add(".")
+
+        calls = []
+        communicate = Git.communicate
+
+        def record_communicate(self, *args, **kwargs):
+            calls.append(self.current[-1])
+            return communicate(self, *args, **kwargs)
+
+        monkeypatch.setattr(Git, "communicate", record_communicate)
+
+        c = Config(project.path)
+        r = Runner(c.cwd, enable_git=True, fix=True)
+        lint = c.actions.get("lint")
+        other = Action("other", run=lint.config["run"], include="*.txt")
+
+        with chdir(project.path):
+            results = list(r.run_processes([lint, other]))
+
+        assert results[0][0].modified_files == ["pass.py", "pass.txt"]
+        assert results[1][0].is_success
+
+        # Once for the snapshot and once to check the files modified by the fix
+        assert calls.count("status") == 2
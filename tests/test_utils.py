@@ -1,5 +1,50 @@
+import os
+import signal
+import struct
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pathspec import PathSpec
+from pathspec.patterns import GitWildMatchPattern
+
 from therapist.utils import parse_version, version_compare
-from therapist.utils.git import Status
+from therapist.runner.cache import hash_file
+from therapist.utils.git import Git
+from therapist.utils.git import backend as backend_module
+from therapist.utils.git import snapshot as snapshot_module
+from therapist.utils.git import (
+    ChangedLines,
+    RepoSnapshot,
+    Status,
+    UnsupportedIndex,
+    check_attributes,
+    get_backend,
+    get_status,
+    hash_objects,
+    iter_ls_files,
+    iter_nul,
+    parse_diff,
+    parse_status,
+    read_index,
+    read_repo_index,
+    staged_blob_ids,
+    unstaged_paths,
+)
+from therapist.utils.git.backend import BACKENDS, BatchGitBackend, InProcessGitBackend
+from therapist.utils.git.index import read_ewah
+from therapist.utils.filesystem import list_files, walk_files
+from therapist.utils.git.store import UnsupportedObject, apply_delta
+from therapist.utils.paths import PathIndex, PathMatcher, normalize_path, split_path
+from therapist.utils.system import (
+    MAX_ARG_STRLEN,
+    cgroup_cpu_limit,
+    cpu_count,
+    deferred_signals,
+    max_command_length,
+    signals_as_interrupts,
+)
 
 
 class TestGitStatus(object):
@@ -65,6 +110,635 @@ class TestGitStatus(object):
         s = Status(text)
         assert s.__str__() == text
 
+    def test_parse_status(self):
+        data = (
+            b"1 M. N... 100644 100644 100644 abc abc test.py\0"
+            b"1 .M N... 100644 100644 100644 abc abc dir/with space.py\0"
+            b"2 R. N... 100644 100644 100644 abc abc R100 new \xc3\xa9.py\0old.py\0"
+            b"u UU N... 100644 100644 100644 100644 abc abc abc conflict.py\0"
+            b"? untracked.py\0"
+            b"! ignored.py\0"
+        )
+        statuses = parse_status(data)
+
+        assert [(s.x, s.y, s.path, s.original_path) for s in statuses] == [
+            ("M", " ", "test.py", None),
+            (" ", "M", "dir/with space.py", None),
+            ("R", " ", "new \u00e9.py", "old.py"),
+            ("U", "U", "conflict.py", None),
+            ("?", "?", "untracked.py", None),
+            ("!", "!", "ignored.py", None),
+        ]
+        assert str(statuses[2]) == "R  old.py -> new \u00e9.py"
+        assert statuses[4].is_untracked
+        assert parse_status(b"") == []
+
+    def test_get_status(self, project):
+        project.write("a.txt", "a")
+        project.write("dir/b c.txt", "b")
+        project.git.add(".")
+        project.write("dir/b c.txt", "changed")
+        project.write("\u00e9.txt", "untracked")
+
+        statuses = dict((s.path, s) for s in get_status(project.git))
+        assert (statuses["a.txt"].x, statuses["a.txt"].y) == ("A", " ")
+        assert (statuses["dir/b c.txt"].x, statuses["dir/b c.txt"].y) == ("A", "M")
+        assert statuses["\u00e9.txt"].is_untracked
+
+        statuses = get_status(project.git, untracked_files="no")
+        assert sorted(s.path for s in statuses) == ["a.txt", "dir/b c.txt"]
+
+
+class TestRepoSnapshot(object):
+    def test_sets(self, project):
+        project.write("unchanged.txt")
+        project.write("modified.txt")
+        project.write("deleted.txt")
+        project.git.add(".")
+        project.git.commit(m="Initial commit")
+
+        project.write("staged.txt")
+        project.write("modified.txt", "changed")
+        project.git.add("staged.txt")
+        project.remove("deleted.txt")
+        project.write("untracked.txt")
+
+        snapshot = RepoSnapshot(get_backend(repo_path=project.path))
+        assert snapshot.tracked.issuperset(
+            ["deleted.txt", "modified.txt", "staged.txt", "unchanged.txt"]
+        )
+        assert "untracked.txt" not in snapshot.tracked
+        assert snapshot.staged == set(["staged.txt"])
+        assert snapshot.unstaged == set(["deleted.txt", "modified.txt"])
+        assert snapshot.deleted == set(["deleted.txt"])
+        assert snapshot.untracked == set()
+        assert snapshot.get("unchanged.txt") is None
+
+        snapshot = RepoSnapshot(get_backend(repo_path=project.path), untracked_files="all")
+        assert snapshot.untracked == set(["untracked.txt"])
+
+    def test_iter_files(self, project):
+        project.write("a.txt")
+        project.write("deleted.txt")
+        project.git.add(".")
+        project.remove("deleted.txt")
+        project.write("untracked.txt")
+        project.write(".gitignore", "ignored.txt\n")
+        project.write("ignored.txt")
+
+        for name in BACKENDS:
+            snapshot = RepoSnapshot(BACKENDS[name](repo_path=project.path))
+            files = snapshot.iter_files()
+            assert next(files) == ".therapist.yml"
+
+            files = list(snapshot.iter_files())
+            assert "a.txt" in files and "deleted.txt" not in files
+            assert "untracked.txt" not in files
+            assert files == sorted(files)
+
+            files = list(snapshot.iter_files(include_untracked=True))
+            assert files[-2:] == [".gitignore", "untracked.txt"]
+
+    def test_refresh(self, project, monkeypatch):
+        project.write("a.txt")
+        project.write("b.txt")
+        project.git.add(".")
+
+        snapshot = RepoSnapshot(get_backend(repo_path=project.path))
+        blob_id = snapshot.blob_ids["a.txt"]
+        assert snapshot.unstaged == set()
+
+        project.write("a.txt", "changed")
+        project.write("b.txt", "changed")
+        snapshot.refresh(["a.txt"])
+        assert snapshot.unstaged == set(["a.txt"])
+        assert snapshot.blob_ids["a.txt"] == blob_id
+
+        project.git.add("a.txt")
+        snapshot.refresh(["a.txt"])
+        assert snapshot.unstaged == set()
+        assert snapshot.blob_ids["a.txt"] == hash_file(project.abspath("a.txt"))
+
+        # Refreshing lots of paths reloads the whole snapshot
+        monkeypatch.setattr(snapshot_module, "MAX_REFRESH_PATHS", 0)
+        snapshot.refresh(["a.txt"])
+        assert snapshot.unstaged == set(["b.txt"])
+
+
+class TestGitIndex(object):
+    def assert_matches_git(self, project, path=None):
+        git = Git(repo_path=project.abspath(path) if path else project.path)
+        out, err, code = git.ls_files.communicate(s=True, z=True, decode=False)
+        expected = [os.fsdecode(entry) for entry in out.split(b"\0") if entry]
+
+        entries = read_repo_index(git.repo_path)
+        assert [
+            "{:o} {} {}\t{}".format(entry.mode, entry.object_id, entry.stage, entry.path)
+            for entry in entries
+        ] == expected
+        return entries
+
+    def make_project(self, project):
+        for i in range(100):
+            project.write("dir/file {}.txt".format(i), str(i))
+        project.write("caf\u00e9.py")
+        project.git.add(".")
+        project.git.commit(m="Initial commit")
+
+    def test_versions(self, project):
+        self.make_project(project)
+        entries = self.assert_matches_git(project)
+
+        entry = [e for e in entries if e.path == "dir/file 1.txt"][0]
+        st = os.stat(project.abspath("dir/file 1.txt"))
+        assert entry.size == st.st_size
+        assert entry.ino == st.st_ino
+        assert entry.mtime_ns == st.st_mtime_ns
+        assert not entry.skip_worktree
+
+        for version in ("3", "4", "2"):
+            project.git.update_index(index_version=version)
+            self.assert_matches_git(project)
+
+    def test_skip_worktree(self, project):
+        self.make_project(project)
+        project.git.update_index("dir/file 1.txt", skip_worktree=True)
+
+        entries = self.assert_matches_git(project)
+        assert [e.path for e in entries if e.skip_worktree] == ["dir/file 1.txt"]
+
+    def test_split_index(self, project):
+        self.make_project(project)
+        project.git.update_index(split_index=True)
+        self.assert_matches_git(project)
+
+        # Modify, remove and add some entries so the split index has to be merged
+        project.write("dir/file 7.txt", "changed")
+        project.write("new.txt")
+        project.git.add("dir/file 7.txt", "new.txt")
+        project.git.rm("dir/file 70.txt", cached=True, quiet=True)
+        self.assert_matches_git(project)
+
+        project.git.update_index(index_version="4")
+        project.write("dir/file 8.txt", "changed")
+        project.git.add("dir/file 8.txt")
+        self.assert_matches_git(project)
+
+    def test_subdirectory(self, project):
+        self.make_project(project)
+        entries = self.assert_matches_git(project, "dir")
+        assert entries[0].path == "file 0.txt"
+
+    def test_unsupported(self, project, tmpdir):
+        self.make_project(project)
+
+        with open(project.abspath(".git/index"), "rb") as f:
+            data = f.read()
+
+        # A required extension that isn't understood
+        path = tmpdir.join("index").strpath
+        with open(path, "wb") as f:
+            f.write(data[:-20] + b"abcd\0\0\0\0" + data[-20:])
+        with pytest.raises(UnsupportedIndex):
+            read_index(path)
+
+        with open(path, "wb") as f:
+            f.write(b"")
+        with pytest.raises(UnsupportedIndex):
+            read_index(path)
+
+        with pytest.raises(UnsupportedIndex):
+            read_repo_index(tmpdir.strpath)
+
+    def test_read_ewah(self):
+        # A run of one set word, then two literal words
+        words = [1 | (1 << 1) | (2 << 33), 0b101, 1 << 63]
+        data = struct.pack(">II", 192, len(words)) + struct.pack(">3Q", *words) + b"\0" * 4
+
+        bits, offset = read_ewah(data)
+        assert bits == list(range(64)) + [64, 66, 191]
+        assert offset == len(data)
+
+    def test_snapshot_falls_back_to_git(self, project, monkeypatch):
+        self.make_project(project)
+        expected = RepoSnapshot(get_backend(repo_path=project.path)).blob_ids
+
+        def unsupported(*args, **kwargs):
+            raise UnsupportedIndex()
+
+        monkeypatch.setattr(backend_module, "read_repo_index", unsupported)
+        assert RepoSnapshot(get_backend(repo_path=project.path)).blob_ids == expected
+        assert len(expected) > 100
+
+
+class TestGitObjects(object):
+    def test_iter_nul(self):
+        assert list(iter_nul([b"a.txt\0b", b" c.t", b"xt\0", b"\0d.txt"])) == [
+            "a.txt",
+            "b c.txt",
+            "d.txt",
+        ]
+        assert list(iter_nul([])) == []
+
+    def test_stream(self, project):
+        for i in range(1000):
+            project.write("file{}.txt".format(i))
+        project.git.add(".")
+
+        chunks = project.git.ls_files.stream(z=True)
+        assert next(chunks).startswith(b".therapist.yml\0")
+        chunks.close()
+
+        paths = list(iter_ls_files(project.git))
+        assert len(paths) > 1000
+        assert paths == sorted(staged_blob_ids(project.git))
+
+    def test_check_attributes(self, project):
+        attributes = "*.pb.py linguist-generated\nvendor/** therapist-skip\n"
+        attributes += "vendor/keep.js -therapist-skip\nlib.js linguist-generated=false\n"
+        project.write(".gitattributes", attributes)
+        project.git.add(".gitattributes")
+
+        paths = ["a.py", "a.pb.py", "vendor/b.js", "vendor/keep.js", "lib.js", "dir/c d.pb.py"]
+        paths += ["file{}.txt".format(i) for i in range(5000)]
+
+        flagged = check_attributes(project.git, paths, ["linguist-generated", "therapist-skip"])
+        assert flagged == {"a.pb.py", "vendor/b.js", "dir/c d.pb.py"}
+        assert check_attributes(project.git, paths, ["linguist-vendored"]) == set()
+        assert check_attributes(project.git, paths, []) == set()
+
+        # Only the staged attributes are used with `cached`
+        project.write(".gitattributes", "*.py therapist-skip")
+        assert check_attributes(project.git, ["a.py"], ["therapist-skip"]) == {"a.py"}
+        assert check_attributes(project.git, ["a.py"], ["therapist-skip"], cached=True) == set()
+
+    def test_check_attributes_empty_value(self, project):
+        project.write(".gitattributes", "a.txt foo=\nb.txt therapist-skip\n")
+        project.git.add(".gitattributes")
+
+        # An attribute set to an empty string is still set
+        paths = ["a.txt", "b.txt", "c.txt"]
+        flagged = check_attributes(project.git, paths, ["foo", "therapist-skip"])
+        assert flagged == {"a.txt", "b.txt"}
+
+    def test_staged_blob_ids(self, project):
+        project.write("a.txt", "a")
+        project.write("dir/b c.txt", "b")
+        project.git.add(".")
+        project.write("a.txt", "changed")
+
+        blob_ids = staged_blob_ids(project.git)
+        assert blob_ids["a.txt"] == "2e65efe2a145dda7ee51d1741299f848e5bf752e"
+        assert blob_ids["dir/b c.txt"] == "63d8dbd40c23542e740659a7168a0ce3138ea748"
+        assert ".therapist.yml" in blob_ids
+
+    def test_unstaged_paths(self, project):
+        project.write("a.txt", "a")
+        project.write("b.txt", "b")
+        project.git.add(".")
+        project.write("a.txt", "changed")
+        project.write("untracked.txt", "untracked")
+
+        assert unstaged_paths(project.git) == {"a.txt"}
+
+    def test_hash_objects(self, project):
+        project.write("a.txt", "changed")
+        project.write("dir/b c.txt", "b")
+
+        assert hash_objects(project.git, ["a.txt", "dir/b c.txt", "missing.txt"]) == {
+            "a.txt": "21fb1eca31e64cd3914025058b21992ab76edcf9",
+            "dir/b c.txt": "63d8dbd40c23542e740659a7168a0ce3138ea748",
+        }
+        assert hash_objects(project.git, ["a.txt"])["a.txt"] == hash_file(project.abspath("a.txt"))
+        assert hash_objects(project.git, []) == {}
+
+
+class TestGitDiff(object):
+    def test_parse_diff(self):
+        diff = b"\n".join(
+            [
+                b"diff --git a/a.py b/a.py",
+                b"--- a/a.py",
+                b"+++ b/a.py",
+                b"@@ -1 +1 @@",
+                b"-old",
+                b"+new",
+                b"@@ -5,2 +4,0 @@",
+                b"-gone",
+                b"-gone",
+                b"@@ -10,0 +9,3 @@",
+                b"+++ not a header",
+                b"+@@ -1 +1 @@",
+                b"+x",
+                b"\\ No newline at end of file",
+                b'diff --git "a/d\\303\\251j\\303\\240 vu.py" "b/d\\303\\251j\\303\\240 vu.py"',
+                b"new file mode 100644",
+                b"--- /dev/null",
+                b'+++ "b/d\\303\\251j\\303\\240 vu.py"',
+                b"@@ -0,0 +1,2 @@",
+                b"+a",
+                b"+b",
+                b"diff --git a/dir with space/b c.py b/dir with space/b c.py",
+                b"--- a/dir with space/b c.py\t",
+                b"+++ b/dir with space/b c.py\t",
+                b"@@ -3 +3 @@",
+                b"-old",
+                b"+new",
+                b"diff --git a/deleted.py b/deleted.py",
+                b"--- a/deleted.py",
+                b"+++ /dev/null",
+                b"@@ -1 +0,0 @@",
+                b"-a",
+                b"",
+            ]
+        )
+
+        assert parse_diff(diff) == {
+            "a.py": [(1, 1), (9, 11)],
+            "d\u00e9j\u00e0 vu.py": [(1, 2)],
+            "dir with space/b c.py": [(3, 3)],
+        }
+
+    def test_changed_lines(self, project):
+        project.write("a.txt", "1\n2\n3\n4\n")
+        project.write("b.txt", "b\n")
+        project.git.add(".")
+        project.git.commit(m="Add files")
+
+        project.write("a.txt", "1\nchanged\n3\n4\nadded\n")
+        project.write("new.txt", "new\nfile\n")
+        project.write("dir with space/b c.txt", "spaced\n")
+        project.git.add(".")
+        project.write("b.txt", "unstaged\n")
+        project.write("untracked.txt", "untracked\n")
+
+        backend = get_backend(repo_path=project.path)
+        assert backend.changed_lines() == {
+            "a.txt": [(2, 2), (5, 5)],
+            "dir with space/b c.txt": [(1, 1)],
+            "new.txt": [(1, 2)],
+        }
+        assert backend.changed_lines(staged=False) == {
+            "a.txt": [(2, 2), (5, 5)],
+            "b.txt": [(1, 1)],
+            "dir with space/b c.txt": [(1, 1)],
+            "new.txt": [(1, 2)],
+        }
+
+        changed_lines = ChangedLines(RepoSnapshot(backend))
+        assert changed_lines["a.txt"] == [(2, 2), (5, 5)]
+        assert changed_lines["b.txt"] == []
+        assert changed_lines.get("untracked.txt") is None
+        assert "untracked.txt" not in changed_lines
+        assert {"a.txt", "b.txt", "new.txt", ".therapist.yml"} <= set(changed_lines)
+
+    def test_changed_lines_without_commits(self, tmpdir):
+        git = Git(repo_path=tmpdir.strpath)
+        git.init()
+        tmpdir.join("a.txt").write("a\nb\n")
+        git.add(".")
+
+        backend = get_backend(repo_path=tmpdir.strpath)
+        assert backend.changed_lines() == {"a.txt": [(1, 2)]}
+        assert backend.changed_lines(staged=False) == {"a.txt": [(1, 2)]}
+
+
+class TestGitBackends(object):
+    def populate(self, project):
+        project.write("a.txt", "a")
+        project.write("dir/b c.txt", "b\n" * 100)
+        project.git.add(".")
+        project.git.commit(m="Add files")
+        project.write("dir/b c.txt", "b\n" * 100 + "c\n")
+        project.git.add(".")
+        project.write("a.txt", "changed")
+
+    @pytest.mark.parametrize("name", sorted(BACKENDS))
+    def test_backends_agree(self, project, name):
+        self.populate(project)
+        missing = "0" * 40
+
+        with BACKENDS["subprocess"](repo_path=project.path) as expected:
+            blob_ids = expected.ls_files()
+            object_ids = list(blob_ids.values()) + [missing]
+
+            with BACKENDS[name](repo_path=project.path) as backend:
+                assert backend.ls_files() == blob_ids
+                assert backend.ls_files(paths=["a.txt"]) == {"a.txt": blob_ids["a.txt"]}
+                assert list(backend.iter_tracked()) == sorted(blob_ids)
+                assert list(backend.iter_untracked()) == list(expected.iter_untracked())
+                assert list(map(str, backend.status())) == list(map(str, expected.status()))
+                assert backend.cat_file(object_ids) == expected.cat_file(object_ids)
+                assert backend.object_info(object_ids) == expected.object_info(object_ids)
+                assert backend.cat_file([missing]) == {missing: None}
+                assert backend.cat_file([blob_ids["a.txt"]]) == {blob_ids["a.txt"]: ("blob", b"a")}
+
+    @pytest.mark.parametrize("name", sorted(BACKENDS))
+    def test_cat_file_from_threads(self, project, name):
+        for i in range(20):
+            project.write("file{}.txt".format(i), "contents {}".format(i))
+        project.git.add(".")
+        project.git.commit(m="Add files")
+        project.git.gc()
+
+        with BACKENDS[name](repo_path=project.path) as backend:
+            blob_ids = backend.ls_files()
+
+            def read(path):
+                object_id = blob_ids[path]
+                return backend.cat_file([object_id])[object_id][1]
+
+            paths = sorted(p for p in blob_ids if p.startswith("file")) * 10
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                contents = list(executor.map(read, paths))
+
+        assert contents == [project.read(path).encode("utf-8") for path in paths]
+
+    @pytest.mark.parametrize("name", sorted(BACKENDS))
+    def test_iter_tracked_unmerged(self, project, name):
+        project.write("a.txt", "a")
+        project.git.add(".")
+        project.git.commit(m="Add a")
+        project.git.checkout(b="other")
+        project.write("a.txt", "other")
+        project.git.commit(a=True, m="Change a")
+        project.git.checkout("-")
+        project.write("a.txt", "conflict")
+        project.git.commit(a=True, m="Conflict")
+        project.git.merge("other")
+
+        with BACKENDS[name](repo_path=project.path) as backend:
+            assert list(backend.iter_tracked()).count("a.txt") == 1
+
+    def test_checkout_index_non_utf8_path(self, project, tmpdir):
+        with open(os.path.join(os.fsencode(project.path), b"caf\xe9.txt"), "wb") as f:
+            f.write(b"staged")
+        project.git.add(".")
+
+        with BACKENDS["subprocess"](repo_path=project.path) as backend:
+            path = os.fsdecode(b"caf\xe9.txt")
+            assert path in backend.ls_files()
+            backend.checkout_index([path], tmpdir.strpath)
+
+        with open(os.path.join(os.fsencode(tmpdir.strpath), b"caf\xe9.txt"), "rb") as f:
+            assert f.read() == b"staged"
+
+    def test_batch_restarts(self, project):
+        self.populate(project)
+        blob_id = staged_blob_ids(project.git)["a.txt"]
+
+        backend = BatchGitBackend(repo_path=project.path)
+        assert backend.cat_file([blob_id]) == {blob_id: ("blob", b"a")}
+        backend.close()
+        assert backend.object_info([blob_id]) == {blob_id: ("blob", 1)}
+        backend.close()
+
+    def test_inprocess_reads_packs(self, project, monkeypatch):
+        self.populate(project)
+        project.git.commit(m="Change files")
+        project.git.gc(aggressive=True, quiet=True)
+
+        with BACKENDS["subprocess"](repo_path=project.path) as expected:
+            object_ids = list(expected.ls_files().values())
+            objects = expected.cat_file(object_ids)
+
+        # Everything should be read without asking git
+        monkeypatch.setattr(BatchGitBackend, "cat_file", None)
+        with InProcessGitBackend(repo_path=project.path) as backend:
+            assert backend.store.packs
+            assert backend.cat_file(object_ids) == objects
+
+    def test_apply_delta(self):
+        # Copy 5 bytes from offset 6 of the base, then insert 2 new bytes
+        delta = bytes([11, 7, 0x91, 6, 5, 2]) + b", "
+        assert apply_delta(b"hello world", delta) == b"world, "
+
+        with pytest.raises(UnsupportedObject):
+            apply_delta(b"hello", delta)
+
+    def test_get_backend(self):
+        assert isinstance(get_backend(), InProcessGitBackend)
+        assert isinstance(get_backend("batch"), BatchGitBackend)
+
+        with pytest.raises(ValueError):
+            get_backend("notabackend")
+
+
+class TestPathMatcher(object):
+    PATHS = [
+        "a.py",
+        "./b.py",
+        "/c.py",
+        "src/d.py",
+        "src/e.js",
+        "docs/f.py",
+        "docs/sub/g.py",
+        "scripts/h.sh",
+        "migrations/0001.py",
+        ".ignore.txt",
+        "src/keep.py",
+    ]
+
+    @pytest.mark.parametrize(
+        "patterns",
+        [
+            ["*.py"],
+            ["*.py", "*.js"],
+            ["docs/", "scripts/"],
+            ["/docs/**/*.py"],
+            ["migrations/*.py", ".ignore*"],
+            ["*.py", "!src/keep.py"],
+            ["# comment", ""],
+        ],
+    )
+    def test_matches_like_pathspec(self, patterns):
+        spec = PathSpec(map(GitWildMatchPattern, patterns))
+        matcher = PathMatcher(patterns)
+
+        for path in self.PATHS:
+            assert matcher.match(path) == spec.match_file(path), path
+
+    def test_normalize_path(self):
+        assert normalize_path("./a/b.py") == "a/b.py"
+        assert normalize_path("/a/b.py") == "a/b.py"
+        assert normalize_path("a/b.py") == "a/b.py"
+
+
+class TestPathIndex(object):
+    def test_components(self, tmpdir):
+        index = PathIndex()
+        cwd = tmpdir.strpath
+
+        parts = index.components("a/./b/../c.py", cwd)
+        assert parts == split_path(os.path.join(cwd, "a", "c.py"))
+        assert index.components("a/./b/../c.py", cwd) is parts
+        assert index.components("a/c.py", cwd)[-1] is parts[-1]
+
+    def test_is_within(self, tmpdir):
+        index = PathIndex()
+        cwd = tmpdir.strpath
+        root = split_path(os.path.join(cwd, "src"))
+
+        assert index.is_within("src/a.py", root, cwd)
+        assert index.is_within("./src/sub/a.py", root, cwd)
+        assert not index.is_within("src-old/a.py", root, cwd)
+        assert not index.is_within("a.py", root, cwd)
+        assert index.is_within("../a.py", split_path(os.path.dirname(cwd)), cwd)
+
+    def test_relative_paths(self, tmpdir):
+        index = PathIndex()
+        cwd = tmpdir.strpath
+        working_dir = os.path.join(cwd, "src")
+
+        paths = index.relative_paths(["src/a.py", "b.py"], cwd, working_dir)
+        assert paths == ["a.py", os.path.join("..", "b.py")]
+        assert index.relative_paths(["src/a.py"], cwd, working_dir)[0] is paths[0]
+        assert index.relative_paths(["src/a.py"], cwd, cwd) == ["src/a.py"]
+
+
+class TestListFiles(object):
+    def write(self, root, *paths):
+        for path in paths:
+            path = os.path.join(root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write("")
+
+    def test_walk_files(self, tmpdir):
+        root = tmpdir.strpath
+        self.write(root, "a.py", "b.log", "src/c.py", "src/d.log", "src/keep.log", "build/e.py")
+        self.write(root, ".git/config", "src/vendor/f.py", "src/sub/g.py")
+        with open(os.path.join(root, ".gitignore"), "w") as f:
+            f.write("*.log\nbuild/\n")
+        with open(os.path.join(root, "src", ".gitignore"), "w") as f:
+            f.write("!keep.log\n")
+
+        expected = [".gitignore", "a.py", "src/.gitignore", "src/c.py", "src/keep.log"]
+        expected += ["src/sub/g.py", "src/vendor/f.py"]
+        assert walk_files(root) == [os.path.join(root, *p.split("/")) for p in expected]
+
+        skipped = os.path.join(root, "src", "vendor")
+        files = walk_files(root, skip_dir=lambda d: d == skipped, jobs=1)
+        assert os.path.join(skipped, "f.py") not in files
+        assert os.path.join(root, "src", "sub", "g.py") in files
+
+    def test_list_files(self, project):
+        project.write(".gitignore", "*.log")
+        project.write("dir/tracked.py")
+        project.write("dir/deleted.py")
+        project.git.add(".")
+        project.remove("dir/deleted.py")
+        project.write("dir/untracked.py")
+        project.write("dir/ignored.log")
+
+        path = os.path.join(project.path, "dir")
+        expected = [os.path.join(path, f) for f in ("tracked.py", "untracked.py")]
+        assert sorted(list_files(path, use_git=True)) == expected
+        assert list_files(path) == expected
+        assert list_files(expected[0]) == expected[:1]
+        assert list_files(os.path.join(path, "missing")) == []
+
 
 class TestVersionComparator(object):
     def test_parse_version(self):
@@ -81,3 +755,56 @@ class TestVersionComparator(object):
         assert version_compare("1.1.0", "1.5.5") == -1
         assert version_compare("1.5.6", "1.5.5") == 1
         assert version_compare("1.5.1", "1.5.5") == -1
+
+
+class TestCpuCount(object):
+    def test_cpu_count(self):
+        assert cpu_count() >= 1
+
+    def test_cgroup_v2(self, tmpdir):
+        tmpdir.join("cpu.max").write("250000 100000\n")
+        assert cgroup_cpu_limit(tmpdir.strpath) == 3
+
+        tmpdir.join("cpu.max").write("max 100000\n")
+        assert cgroup_cpu_limit(tmpdir.strpath) is None
+
+    def test_cgroup_v1(self, tmpdir):
+        tmpdir.mkdir("cpu")
+        tmpdir.join("cpu", "cpu.cfs_quota_us").write("50000\n")
+        tmpdir.join("cpu", "cpu.cfs_period_us").write("100000\n")
+        assert cgroup_cpu_limit(tmpdir.strpath) == 1
+
+        tmpdir.join("cpu", "cpu.cfs_quota_us").write("-1\n")
+        assert cgroup_cpu_limit(tmpdir.strpath) is None
+
+    def test_no_cgroup(self, tmpdir):
+        assert cgroup_cpu_limit(tmpdir.strpath) is None
+
+
+class TestMaxCommandLength(object):
+    def test_max_command_length(self):
+        assert 0 < max_command_length() <= MAX_ARG_STRLEN
+
+
+class TestSignals(object):
+    def test_deferred_signals(self):
+        received = []
+        previous = signal.signal(signal.SIGUSR1, lambda signum, frame: received.append(signum))
+
+        try:
+            with deferred_signals(signals=(signal.SIGUSR1,)):
+                os.kill(os.getpid(), signal.SIGUSR1)
+                os.kill(os.getpid(), signal.SIGUSR1)
+                assert received == []
+            assert received == [signal.SIGUSR1]
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+    def test_signals_as_interrupts(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+
+        with pytest.raises(KeyboardInterrupt):
+            with signals_as_interrupts(signals=(signal.SIGUSR1,)):
+                os.kill(os.getpid(), signal.SIGUSR1)
+
+        assert signal.getsignal(signal.SIGUSR1) == previous
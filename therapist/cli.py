@@ -38,10 +38,12 @@ from therapist.messages import (
 )
 from therapist.plugins.loader import list_plugins
 from therapist.runner import Runner
+from therapist.runner.runner import ENGINES, ISOLATION_MODES
 from therapist.runner.result import ResultCollection
+from therapist.runner.router import Router
 from therapist.utils.filesystem import current_git_dir, current_root, list_files
 from therapist.utils.hook import calculate_hook_hash, read_hook_hash, read_hook_version
-from therapist.utils.git import Git
+from therapist.utils.git import Git, RepoSnapshot, get_backend
 
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -95,6 +97,15 @@ def get_config(disable_git=False):
         if not disable_git and git_root == root_dir:
             extra_kw["enable_git"] = True
 
+        if config.git_backend:
+            extra_kw["git_backend"] = config.git_backend
+
+        if config.isolation:
+            extra_kw["isolation"] = config.isolation
+
+        if config.skip_attributes:
+            extra_kw["skip_attributes"] = config.skip_attributes
+
     return config, extra_kw
 
 
@@ -254,17 +265,53 @@ def uninstall(**kwargs):
 @click.option("--action", "-a", default=None, help="A name of a specific action to be run.")
 @click.option("--disable-git", is_flag=True, help="Disable git-aware features.")
 @click.option("--enable-git", is_flag=True, help="Enable git-aware features.")
+@click.option(
+    "--engine",
+    default=None,
+    type=click.Choice(ENGINES),
+    help="How commands are run in parallel: on threads (the default) or on an asyncio loop.",
+)
 @click.option("--fix", is_flag=True, help="Automatically fixes problems where possible.")
 @click.option("--include-unstaged", is_flag=True, help="Include unstaged files.")
 @click.option(
     "--include-unstaged-changes", is_flag=True, help="Include unstaged changes to staged files."
 )
 @click.option("--include-untracked", is_flag=True, help="Include untracked files.")
+@click.option(
+    "--isolation",
+    default=None,
+    type=click.Choice(ISOLATION_MODES),
+    help=(
+        "How unstaged changes are kept from actions: by stashing them (the default) or by "
+        "running actions in a checkout of the staged files."
+    ),
+)
+@click.option(
+    "--jobs",
+    "-j",
+    default=None,
+    type=click.IntRange(min=1),
+    help="The number of processes to run in parallel. Defaults to the number of available CPUs.",
+)
 @click.option(
     "--junit-xml", default=None, help="Create a junit-xml style report file at the given path."
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help=(
+        "Disables the cache of action results. Cached results don't notice changes to a tool or "
+        "its configuration unless the files are listed in the action's `cache_inputs`."
+    ),
+)
 @click.option("--no-color", is_flag=True, help="Disables colors and other rich output.")
 @click.option("--plugin", "-p", default=None, help="A name of a specific plugin to be run.")
+@click.option(
+    "--shard",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Split the files for each action into this many chunks that are run in parallel.",
+)
 @click.option(
     "--stage-modified-files",
     is_flag=True,
@@ -281,6 +328,8 @@ def run(**kwargs):
     use_tracked_files = kwargs.pop("use_tracked_files")
     quiet = kwargs.pop("quiet")
     disable_git = kwargs.pop("disable_git")
+    no_cache = kwargs.pop("no_cache")
+    isolation = kwargs.pop("isolation")
 
     colorama.init(strip=kwargs.pop("no_color"))
 
@@ -289,6 +338,10 @@ def run(**kwargs):
     config, extra_kw = get_config(disable_git=disable_git)
     kwargs.update(extra_kw)
 
+    # The command line takes precedence over the configuration file
+    if isolation:
+        kwargs["isolation"] = isolation
+
     # Validate any installed hook is the minimum required version
     if git_dir:
         hook_path = os.path.join(git_dir, "hooks", "pre-commit")
@@ -298,41 +351,6 @@ def run(**kwargs):
                 output(UPGRADE_HOOK_MSG)
                 exit(1)
 
-    files = []
-    if paths:
-        # We want to look at files in their current state if paths are passed through
-        kwargs["include_unstaged_changes"] = True
-
-        # If paths were provided get all the files for each path
-        for path in paths:
-            for f in list_files(path):
-                f = os.path.relpath(f, root_dir)
-                if not f.startswith(".."):  # Don't include files outside the repo root.
-                    files.append(f)
-    elif use_tracked_files:
-        # If the use tracked files flag was passed, get a list of all the tracked files
-        out, err, code = git.ls_files()
-        files = out.splitlines()
-
-        # Filter out any files that have been deleted
-        out, err, code = git.status(porcelain=True)
-        for line in out.splitlines():
-            if line[0] == "D" or line[1] == "D":
-                files.remove(line[3:])
-
-        if kwargs.get("include_untracked"):
-            out, err, code = git.ls_files(o=True, exclude_standard=True)
-            files += out.splitlines()
-
-    if files or paths:
-        kwargs["files"] = files
-
-    runner = Runner(config.cwd, **kwargs)
-    results = ResultCollection()
-
-    if runner.unstaged_changes and not quiet:
-        output(UNSTAGED_CHANGES_MSG, end="\n\n")
-
     processes = list(config.actions) + list(config.plugins)
     processes.sort(key=lambda x: x.name)  # Sort the list of processes for consistent results
 
@@ -356,8 +374,54 @@ def run(**kwargs):
                 output(a.name)
             exit(1)
 
-    for process in processes:
-        result, message = runner.run_process(process)
+    files = []
+    if paths:
+        # We want to look at files in their current state if paths are passed through
+        kwargs["include_unstaged_changes"] = True
+
+        # Directories none of the processes could act on any files in aren't listed
+        router = Router(processes, cwd=config.cwd)
+
+        def skip_dir(directory):
+            return not router.could_match_within(os.path.relpath(directory, root_dir))
+
+        # If paths were provided get all the files for each path
+        for path in paths:
+            for f in list_files(path, use_git=kwargs.get("enable_git"), skip_dir=skip_dir):
+                f = os.path.relpath(f, root_dir)
+                if not f.startswith(".."):  # Don't include files outside the repo root.
+                    files.append(f)
+    elif use_tracked_files:
+        include_untracked = kwargs.get("include_untracked")
+        backend = get_backend(kwargs.get("git_backend"), repo_path=config.cwd)
+
+        if kwargs.get("enable_git"):
+            # Stream all the tracked files, other than any that have been deleted, to the runner
+            # as git lists them. The snapshot of the repo is shared with the runner, which closes
+            # its backend.
+            snapshot = RepoSnapshot(backend)
+            kwargs["snapshot"] = snapshot
+            files = snapshot.iter_files(include_untracked=include_untracked)
+        else:
+            # The runner doesn't use git, so the files are listed up front
+            try:
+                files = list(RepoSnapshot(backend).iter_files(include_untracked=include_untracked))
+            finally:
+                backend.close()
+
+    if files or paths:
+        kwargs["files"] = files
+
+    if git_dir and not no_cache:
+        kwargs["cache_dir"] = os.path.join(git_dir, "therapist", "cache")
+
+    runner = Runner(config.cwd, **kwargs)
+    results = ResultCollection()
+
+    if runner.unstaged_changes and not quiet:
+        output(UNSTAGED_CHANGES_MSG, end="\n\n")
+
+    for result, message in runner.run_processes(processes):
         results.append(result)
 
         if not quiet:
@@ -7,8 +7,11 @@ from therapist.plugins.exc import InvalidPlugin, PluginNotInstalled
 from therapist.plugins.loader import load_plugin
 from therapist.plugins.plugin import PluginCollection
 from therapist.runner.action import Action, ActionCollection
+from therapist.runner.runner import ISOLATION_MODES
+from therapist.runner.scheduler import find_cycle
 from therapist.runner.shortcut import Shortcut, ShortcutCollection
 from therapist.utils import parse_version, version_compare
+from therapist.utils.git.backend import BACKENDS
 
 
 class Config(object):
@@ -23,6 +26,12 @@ class Config(object):
         SHORTCUTS_WRONGLY_CONFIGURED = 8
         VERSION_MISMATCH = 9
         REQUIRES_WRONGLY_CONFIGURED = 10
+        DEPENDENCIES_WRONGLY_CONFIGURED = 11
+        GIT_BACKEND_WRONGLY_CONFIGURED = 12
+        ISOLATION_WRONGLY_CONFIGURED = 13
+        SKIP_ATTRIBUTES_WRONGLY_CONFIGURED = 14
+        SHARD_WRONGLY_CONFIGURED = 15
+        TIMEOUT_WRONGLY_CONFIGURED = 16
 
         def __init__(self, *args, **kwargs):
             self.code = kwargs.pop("code", None)
@@ -34,6 +43,9 @@ class Config(object):
         self.plugins = PluginCollection()
         self.shortcuts = ShortcutCollection()
         self.requires = None
+        self.git_backend = None
+        self.isolation = None
+        self.skip_attributes = None
 
         # Try and load the config file
         try:
@@ -68,6 +80,21 @@ class Config(object):
                         settings = actions[action_name]
                         if settings is None:
                             settings = {}
+
+                        shard = settings.get("shard")
+                        if shard is not None and not _is_positive(shard, int):
+                            raise self.Misconfigured(
+                                "`shard` for `{}` must be a positive integer.".format(action_name),
+                                code=self.Misconfigured.SHARD_WRONGLY_CONFIGURED,
+                            )
+
+                        timeout = settings.get("timeout")
+                        if timeout is not None and not _is_positive(timeout, (int, float)):
+                            raise self.Misconfigured(
+                                "`timeout` for `{}` must be a positive number.".format(action_name),
+                                code=self.Misconfigured.TIMEOUT_WRONGLY_CONFIGURED,
+                            )
+
                         self.actions.append(Action(action_name, **settings))
 
             if "plugins" in config:
@@ -175,8 +202,67 @@ class Config(object):
                         code=self.Misconfigured.VERSION_MISMATCH,
                     )
 
+            if "git_backend" in config:
+                self.git_backend = config["git_backend"]
+
+                if self.git_backend not in BACKENDS:
+                    raise self.Misconfigured(
+                        "`git_backend` must be one of: {}.".format(", ".join(sorted(BACKENDS))),
+                        code=self.Misconfigured.GIT_BACKEND_WRONGLY_CONFIGURED,
+                    )
+
+            if "isolation" in config:
+                self.isolation = config["isolation"]
+
+                if self.isolation not in ISOLATION_MODES:
+                    raise self.Misconfigured(
+                        "`isolation` must be one of: {}.".format(", ".join(ISOLATION_MODES)),
+                        code=self.Misconfigured.ISOLATION_WRONGLY_CONFIGURED,
+                    )
+
+            if "skip_attributes" in config:
+                skip_attributes = config["skip_attributes"]
+                if isinstance(skip_attributes, str):
+                    skip_attributes = [skip_attributes]
+
+                if not isinstance(skip_attributes, list) or not all(
+                    isinstance(attribute, str) and attribute for attribute in skip_attributes
+                ):
+                    raise self.Misconfigured(
+                        "`skip_attributes` must be an attribute name or a list of them.",
+                        code=self.Misconfigured.SKIP_ATTRIBUTES_WRONGLY_CONFIGURED,
+                    )
+
+                self.skip_attributes = skip_attributes
+
             if not (self.actions or self.plugins):
                 raise self.Misconfigured(
                     "`actions` or `plugins` must be specified in the configuration file.",
                     code=self.Misconfigured.NO_ACTIONS_OR_PLUGINS,
                 )
+
+            processes = list(self.actions) + list(self.plugins)
+            names = set(process.name for process in processes)
+            for process in processes:
+                for name in process.needs:
+                    if name not in names:
+                        raise self.Misconfigured(
+                            "`{}` needs `{}` which is not an action or plugin.".format(
+                                process.name, name
+                            ),
+                            code=self.Misconfigured.DEPENDENCIES_WRONGLY_CONFIGURED,
+                        )
+
+            cycle = find_cycle(processes)
+            if cycle:
+                raise self.Misconfigured(
+                    "Circular dependency between {}.".format(
+                        " -> ".join("`{}`".format(process.name) for process in cycle)
+                    ),
+                    code=self.Misconfigured.DEPENDENCIES_WRONGLY_CONFIGURED,
+                )
+
+
+def _is_positive(value, types):
+    """Checks if a configured value is a number of the given types greater than zero."""
+    return isinstance(value, types) and not isinstance(value, bool) and value > 0
@@ -1,5 +1,7 @@
-from pathspec import PathSpec
-from pathspec.patterns import GitWildMatchPattern
+import asyncio
+import functools
+
+from therapist.utils.paths import PathMatcher, normalize_path
 
 
 class Process(object):
@@ -8,11 +10,19 @@ class Process(object):
         self.description = kwargs.pop("description", None)
 
         self._include = None
+        self._include_matcher = None
         self.include = kwargs.pop("include", None)
 
         self._exclude = None
+        self._exclude_matcher = None
         self.exclude = kwargs.pop("exclude", None)
 
+        self._needs = None
+        self.needs = kwargs.pop("needs", None)
+
+        self.exclusive = bool(kwargs.pop("exclusive", False))
+        self.concurrency_group = kwargs.pop("concurrency_group", None)
+
         self.config = kwargs
 
     def __call__(self, **kwargs):
@@ -35,6 +45,9 @@ class Process(object):
         else:
             self._include = value if isinstance(value, list) else [value]
 
+        # Compile the patterns once rather than every time files are filtered
+        self._include_matcher = PathMatcher(self._include) if self._include else None
+
     @property
     def exclude(self):
         return self._exclude
@@ -46,17 +59,78 @@ class Process(object):
         else:
             self._exclude = value if isinstance(value, list) else [value]
 
-    def filter_files(self, files):
-        if self.include:
-            spec = PathSpec(map(GitWildMatchPattern, self.include))
-            files = list(spec.match_files(files))
+        self._exclude_matcher = PathMatcher(self._exclude) if self._exclude else None
 
-        if self.exclude:
-            spec = PathSpec(map(GitWildMatchPattern, self.exclude))
-            exclude = list(spec.match_files(files))
-            files = list(filter(lambda f: f not in exclude, files))
+    @property
+    def needs(self):
+        return self._needs
 
-        return files
+    @needs.setter
+    def needs(self, value):
+        if value is None:
+            self._needs = []
+        else:
+            self._needs = value if isinstance(value, list) else [value]
+
+    def match_files(self, files):
+        """Yields the files that are included and not excluded as they are iterated over."""
+        include = self._include_matcher.match_normalized if self._include_matcher else None
+        exclude = self._exclude_matcher.match_normalized if self._exclude_matcher else None
+
+        for f in files:
+            path = normalize_path(f)
+            if include is not None and not include(path):
+                continue
+            if exclude is not None and exclude(path):
+                continue
+            yield f
+
+    def filter_files(self, files):
+        return list(self.match_files(files))
+
+    def select_files(self, files, **kwargs):
+        """Returns the subset of files, relative to the project root, the process acts on."""
+        return self.filter_files(files)
+
+    def get_route(self, cwd=None):
+        """Returns what a `Router` needs to select the process's files for it.
+
+        That is a tuple of the include and exclude `PathMatcher`s, either of which may be None,
+        and the components of the directory files have to be within, as split by `split_path`,
+        or None. Processes that select their files some other way return None to have
+        `select_files` used instead.
+        """
+        if type(self).select_files is not Process.select_files:
+            return None
+        return self._include_matcher, self._exclude_matcher, None
+
+    def is_read_only(self, fix=False):
+        """Whether the process can safely run at the same time as other processes."""
+        return not fix
+
+    def uses_stdin(self, fix=False):
+        """Whether the process reads the contents of its files through a `read_file` function
+        rather than from the working tree, so unstaged changes don't need to be stashed.
+        """
+        return False
+
+    def get_cache_signature(self, fix=False):
+        """Returns data identifying the process's behaviour, or None if it can't be cached.
+
+        The result of a process is cached against this signature and the contents of its files.
+        """
+        return None
+
+    def get_cache_inputs(self):
+        """Returns the paths of any other files, such as tool configuration, whose contents the
+        process's cached results depend on.
+        """
+        return []
 
     def execute(self, **kwargs):
         raise NotImplementedError()  # pragma: no cover
+
+    async def execute_async(self, **kwargs):
+        """Runs the process from an event loop. By default `execute` is run on a thread."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(self.execute, **kwargs))
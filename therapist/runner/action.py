@@ -1,68 +1,507 @@
+import asyncio
+import functools
+import heapq
 import os
 import subprocess
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from therapist.collection import Collection
 from therapist.exc import Error
 from therapist.process import Process
+from therapist.runner.output import READ_SIZE, OutputBuffer
 from therapist.runner.result import Result
+from therapist.utils.paths import PathIndex, split_path
+from therapist.utils.system import cpu_count, kill_process_group, max_command_length
+
+
+# Placeholders that make a command run once for each file
+FILE_PLACEHOLDERS = ("{file}", "{lines}")
+
+# Placeholders that are filled in with the lines changed in each file
+LINES_PLACEHOLDERS = ("{lines}", "{file_ranges}")
+
+
+def format_ranges(ranges):
+    """Formats line ranges like `1-3,10-12`."""
+    return ",".join("{}-{}".format(start, end) for start, end in ranges)
+
+
+def count_lines(data):
+    lines = data.count(b"\n")
+    if data and not data.endswith(b"\n"):
+        lines += 1
+    return lines
+
+
+def format_command(command, files, ranges=None):
+    """Fills in a command's placeholders for some files.
+
+    `ranges` maps files to their formatted line ranges. `{file}` and `{lines}` are only
+    meaningful when there is a single file.
+    """
+    ranges = ranges or {}
+    return command.format(
+        files=" ".join(files),
+        file=files[0] if files else "",
+        lines=ranges.get(files[0], "") if files else "",
+        file_ranges=" ".join("{}:{}".format(f, ranges.get(f, "")) for f in files),
+    )
+
+
+def split_files(files, count, cwd):
+    """Splits a list of files into at most `count` chunks of roughly equal total size."""
+    count = min(count, len(files))
+    if count <= 1:
+        return [list(files)] if files else []
+
+    sizes = []
+    for f in files:
+        try:
+            sizes.append(os.path.getsize(os.path.join(cwd, f)))
+        except OSError:
+            sizes.append(0)
+
+    # Assign the largest remaining file to the lightest chunk, preferring the chunk with the
+    # fewest files when sizes are equal
+    chunks = [[] for _ in range(count)]
+    heap = [(0, 0, i) for i in range(count)]
+    for index in sorted(range(len(files)), key=lambda i: sizes[i], reverse=True):
+        total, length, i = heapq.heappop(heap)
+        chunks[i].append(index)
+        heapq.heappush(heap, (total + sizes[index], length + 1, i))
+
+    # Preserve the original ordering of the files within each chunk
+    return [[files[index] for index in sorted(chunk)] for chunk in chunks]
+
+
+def batch_files(command, files, limit, ranges=None):
+    """Splits a list of files into batches that each fit in a command line of `limit` bytes.
+
+    `ranges` maps files to their formatted line ranges, for commands with `{file_ranges}`.
+    """
+    placeholders = command.count("{files}")
+    range_placeholders = command.count("{file_ranges}")
+    if not (placeholders or range_placeholders):
+        return [list(files)] if files else []
+
+    ranges = ranges or {}
+    base_size = len(os.fsencode(format_command(command, [])))
+
+    batches = []
+    batch = []
+    size = base_size
+    for f in files:
+        cost = (len(os.fsencode(f)) + 1) * placeholders
+        cost += (len(os.fsencode(f)) + len(ranges.get(f, "")) + 2) * range_placeholders
+        if batch and size + cost > limit:
+            batches.append(batch)
+            batch = []
+            size = base_size
+        batch.append(f)
+        size += cost
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def timed_out_message(timeout):
+    return "Timed out after {} seconds.".format(timeout)
+
+
+def read_pipe(pipe, buffer):
+    """Reads a pipe of process output into a buffer until it is closed."""
+    for chunk in iter(lambda: os.read(pipe.fileno(), READ_SIZE), b""):
+        buffer.write(chunk)
+    buffer.close()
+
+
+def write_pipe(pipe, data):
+    """Writes data to a process's input and closes it, even if the process stops reading."""
+    try:
+        pipe.write(data)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        try:
+            pipe.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+async def write_stream(stream, data):
+    """Writes data to a process's input from an event loop and closes it, like `write_pipe`."""
+    try:
+        stream.write(data)
+        await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stream.close()
+
+
+def read_file(cwd, path):
+    """Returns the contents of a file in the working tree."""
+    with open(os.path.join(cwd, path), "rb") as f:
+        return f.read()
+
+
+async def read_stream(stream, buffer):
+    """Reads a stream of process output into a buffer until it is closed."""
+    while True:
+        chunk = await stream.read(READ_SIZE)
+        if not chunk:
+            break
+        buffer.write(chunk)
+    buffer.close()
+
+
+def merge_outputs(outputs):
+    outputs = [o for o in outputs if o is not None]
+    if len(outputs) == 1:
+        return outputs[0]
+    return OutputBuffer.join(outputs) if outputs else None
 
 
 class Action(Process):
     def get_working_directory(self, cwd):
         return os.path.join(cwd, self.config.get("working_dir", ""))
 
-    def filter_files(self, files, **kwargs):
+    def select_files(self, files, **kwargs):
         files = super().filter_files(files)
 
         cwd = kwargs.get("cwd")
+        index = kwargs.get("path_index") or PathIndex()
 
         # Filter by files root
-        files_root = os.path.abspath(os.path.join(cwd, self.config.get("files_root", "")))
-        if files_root:
+        files_root = split_path(self.get_files_root(cwd))
+        return [f for f in files if index.is_within(f, files_root, cwd)]
+
+    def get_files_root(self, cwd):
+        return os.path.abspath(os.path.join(cwd, self.config.get("files_root", "")))
 
-            def files_root_matches(f):
-                return os.path.abspath(os.path.join(cwd, f)).startswith(files_root)
+    def get_route(self, cwd=None):
+        if type(self).select_files is not Action.select_files:
+            return None
+        files_root = split_path(self.get_files_root(cwd))
+        return self._include_matcher, self._exclude_matcher, files_root
 
-            files = [f for f in files if files_root_matches(f)]
+    def filter_files(self, files, **kwargs):
+        files = self.select_files(files, **kwargs)
+        return self.get_relative_paths(files, kwargs.get("cwd"), kwargs.get("path_index"))
 
-        # Rewrite the file paths relative to the working directory
+    def get_relative_paths(self, files, cwd, path_index=None):
+        """Rewrites file paths relative to the working directory."""
         working_dir = self.get_working_directory(cwd)
         if working_dir != cwd:
-            files = [os.path.relpath(os.path.join(cwd, f), working_dir) for f in files]
-
+            files = (path_index or PathIndex()).relative_paths(files, cwd, working_dir)
         return files
 
+    def is_read_only(self, fix=False):
+        return not (fix and "fix" in self.config)
+
+    def uses_stdin(self, fix=False):
+        # Fixes are made to the files themselves, so `fix` commands are always given paths
+        return bool(self.config.get("stdin")) and not (fix and "fix" in self.config)
+
+    def runs_per_file(self, fix=False):
+        command = self.get_command(fix) or ""
+        return self.uses_stdin(fix) or any(p in command for p in FILE_PLACEHOLDERS)
+
+    def uses_changed_lines(self, fix=False):
+        command = self.get_command(fix) or ""
+        return any(p in command for p in LINES_PLACEHOLDERS)
+
+    def get_command(self, fix=False):
+        if fix and "fix" in self.config:
+            return self.config.get("fix")
+        return self.config.get("run")
+
+    def get_cache_signature(self, fix=False):
+        # Which lines changed depends on more than the contents of the files
+        if self.uses_changed_lines(fix):
+            return None
+
+        return {
+            "command": self.get_command(fix),
+            "include": self.include,
+            "exclude": self.exclude,
+            "files_root": self.config.get("files_root"),
+            "working_dir": self.config.get("working_dir"),
+            "stdin": self.uses_stdin(fix),
+        }
+
+    def get_cache_inputs(self):
+        inputs = self.config.get("cache_inputs") or []
+        return [inputs] if isinstance(inputs, str) else list(inputs)
+
+    def get_shard_count(self, shard=None):
+        return int(shard or self.config.get("shard") or 1)
+
+    def get_timeout(self):
+        timeout = self.config.get("timeout")
+        return float(timeout) if timeout else None
+
+    def get_line_ranges(self, files, changed_lines, read):
+        """Returns a mapping of files to their formatted changed line ranges.
+
+        The ranges come from the `changed_lines` mapping the runner passes in. Files missing from
+        it are new, so all of their lines, as read by `read`, count as changed. Files without any
+        changed lines are left out.
+        """
+        changed_lines = changed_lines or {}
+
+        ranges = {}
+        for f in files:
+            file_ranges = changed_lines.get(f)
+            if file_ranges is None:
+                try:
+                    count = count_lines(read(f))
+                except (IOError, OSError):
+                    count = 0
+                file_ranges = [(1, count)] if count else []
+            if file_ranges:
+                ranges[f] = format_ranges(file_ranges)
+        return ranges
+
+    def _prepare_commands(self, **kwargs):
+        """Returns the working directory, the command, the files it acts on and the paths and
+        line ranges to fill in for them.
+        """
+        cwd = kwargs.get("cwd")
+        path_index = kwargs.get("path_index")
+
+        # The runner passes the files it already selected for the action
+        files = kwargs.get("files")
+        if kwargs.get("files_selected"):
+            files = list(files)
+        else:
+            files = self.select_files(files, cwd=cwd, path_index=path_index)
+        command = self.get_command(kwargs.get("fix"))
+        working_dir = self.get_working_directory(cwd)
+
+        ranges = {}
+        if command and files and self.uses_changed_lines(kwargs.get("fix")):
+            read = self.get_file_reader(**kwargs)
+            ranges = self.get_line_ranges(files, kwargs.get("changed_lines"), read)
+
+            # Files without any changed lines have nothing to check
+            files = [f for f in files if f in ranges]
+
+        paths = self.get_relative_paths(files, cwd, path_index)
+        ranges = dict((path, ranges[f]) for f, path in zip(files, paths) if f in ranges)
+
+        return working_dir, command, files, paths, ranges
+
+    def get_commands(self, **kwargs):
+        """Returns the working directory, the commands to run and how many to run at once."""
+        working_dir, command, files, paths, ranges = self._prepare_commands(**kwargs)
+
+        if not (command and files):
+            return working_dir, [], 0
+
+        chunks = split_files(paths, self.get_shard_count(kwargs.get("shard")), working_dir)
+
+        # Each chunk is split further into batches that fit within the system's limit on the
+        # length of a command line, much like `xargs`.
+        limit = max_command_length()
+        commands = [
+            format_command(command, batch, ranges)
+            for chunk in chunks
+            for batch in batch_files(command, chunk, limit, ranges)
+        ]
+
+        return working_dir, commands, min(len(chunks), len(commands))
+
+    def get_file_commands(self, **kwargs):
+        """Returns the working directory, a command and the file it acts on for each file and
+        how many of the commands to run at once.
+        """
+        working_dir, command, files, paths, ranges = self._prepare_commands(**kwargs)
+
+        if not (command and files):
+            return working_dir, [], 0
+
+        commands = [(format_command(command, [path], ranges), f) for f, path in zip(files, paths)]
+
+        # Every file is a command of its own, so run as many at once as there are CPUs unless
+        # told otherwise
+        shard = kwargs.get("shard") or self.config.get("shard")
+        concurrency = int(shard) if shard else cpu_count()
+
+        return working_dir, commands, min(concurrency, len(commands))
+
+    def run_command(self, command, cwd, input=None):
+        """Runs a command and returns a tuple of the status, output and error output.
+
+        If `input` bytes are given, they are written to the command's stdin.
+        """
+        timeout = self.get_timeout()
+
+        try:
+            pipes = subprocess.Popen(
+                command,
+                shell=True,
+                cwd=cwd,
+                stdin=subprocess.PIPE if input is not None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                # Start a new session so everything the command starts can be killed on timeout
+                start_new_session=timeout is not None,
+            )
+        except OSError as err:
+            return Result.ERROR, None, "OSError {}".format(str(err))
+
+        timed_out = []
+
+        def kill():
+            timed_out.append(True)
+            kill_process_group(pipes)
+
+        timer = threading.Timer(timeout, kill) if timeout is not None else None
+        if timer:
+            timer.start()
+
+        # Read the output as it is written rather than all at once, stderr on a second thread
+        std_out, std_err = OutputBuffer(), OutputBuffer()
+        reader = threading.Thread(target=read_pipe, args=(pipes.stderr, std_err))
+        reader.start()
+
+        writer = None
+        if input is not None:
+            writer = threading.Thread(target=write_pipe, args=(pipes.stdin, input))
+            writer.start()
+
+        try:
+            with pipes:
+                read_pipe(pipes.stdout, std_out)
+                reader.join()
+                if writer:
+                    writer.join()
+        finally:
+            if timer:
+                timer.cancel()
+
+        if timed_out:
+            return Result.ERROR, None, timed_out_message(timeout)
+
+        status = Result.SUCCESS if pipes.returncode == 0 else Result.FAILURE
+        return status, std_out, std_err
+
+    async def run_command_async(self, command, cwd, input=None):
+        """Runs a command from an event loop and returns the same tuple as `run_command`.
+
+        The output is read as it is written. If the command times out or is cancelled, it is
+        killed along with anything it started.
+        """
+        timeout = self.get_timeout()
+
+        try:
+            process = await asyncio.create_subprocess_shell(
+                command,
+                cwd=cwd,
+                stdin=subprocess.PIPE if input is not None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as err:
+            return Result.ERROR, None, "OSError {}".format(str(err))
+
+        std_out, std_err = OutputBuffer(), OutputBuffer()
+        streams = [read_stream(process.stdout, std_out), read_stream(process.stderr, std_err)]
+        if input is not None:
+            streams.append(write_stream(process.stdin, input))
+        communicate = asyncio.gather(process.wait(), *streams)
+
+        try:
+            returncode = (await asyncio.wait_for(communicate, timeout))[0]
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+            await process.wait()
+            return Result.ERROR, None, timed_out_message(timeout)
+        except asyncio.CancelledError:
+            kill_process_group(process)
+            await process.wait()
+            raise
+
+        status = Result.SUCCESS if returncode == 0 else Result.FAILURE
+        return status, std_out, std_err
+
+    def complete_result(self, result, outcomes):
+        # The merged result takes on the worst status of all the commands
+        result.mark_complete(
+            status=max(status for status, _, _ in outcomes),
+            output=merge_outputs(output for _, output, _ in outcomes),
+            error=merge_outputs(error for _, _, error in outcomes),
+        )
+
+    def get_file_reader(self, **kwargs):
+        """Returns a function that reads the contents of a file to pipe to a command.
+
+        The runner passes one in as `read_file` so commands see the staged contents of files.
+        """
+        return kwargs.get("read_file") or functools.partial(read_file, kwargs.get("cwd"))
+
     def execute(self, **kwargs):
-        files = self.filter_files(kwargs.get("files"), cwd=kwargs.get("cwd"))
-        should_fix = kwargs.get("fix")
+        if self.runs_per_file(kwargs.get("fix")):
+            working_dir, commands, concurrency = self.get_file_commands(**kwargs)
+            read = self.get_file_reader(**kwargs) if self.uses_stdin(kwargs.get("fix")) else None
+
+            def run(command):
+                # Only read each file once its command is about to run to bound memory use
+                command, path = command
+                return self.run_command(command, working_dir, input=read(path) if read else None)
+
+        else:
+            working_dir, commands, concurrency = self.get_commands(**kwargs)
+
+            def run(command):
+                return self.run_command(command, working_dir)
 
         result = Result(self)
 
-        if should_fix and "fix" in self.config:
-            command = self.config.get("fix")
+        if len(commands) == 1:
+            self.complete_result(result, [run(commands[0])])
+        elif commands:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outcomes = list(executor.map(run, commands))
+            self.complete_result(result, outcomes)
+
+        return result
+
+    async def execute_async(self, **kwargs):
+        loop = asyncio.get_event_loop()
+
+        if self.runs_per_file(kwargs.get("fix")):
+            working_dir, commands, concurrency = self.get_file_commands(**kwargs)
+            read = self.get_file_reader(**kwargs) if self.uses_stdin(kwargs.get("fix")) else None
+
+            async def run_command(command):
+                command, path = command
+                data = await loop.run_in_executor(None, read, path) if read else None
+                return await self.run_command_async(command, working_dir, input=data)
+
         else:
-            command = self.config.get("run")
-
-        if command and files:
-            command_with_args = command.format(files=" ".join(files))
-
-            try:
-                pipes = subprocess.Popen(
-                    command_with_args,
-                    shell=True,
-                    cwd=self.get_working_directory(kwargs.get("cwd")),
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
-            except OSError as err:
-                result.mark_complete(status=Result.ERROR, error="OSError {}".format(str(err)))
-            else:
-                std_out, std_err = pipes.communicate()
-
-                status = Result.SUCCESS if pipes.returncode == 0 else Result.FAILURE
-                result.mark_complete(
-                    status=status, output=std_out.decode("utf-8"), error=std_err.decode("utf-8")
-                )
+            working_dir, commands, concurrency = self.get_commands(**kwargs)
+
+            async def run_command(command):
+                return await self.run_command_async(command, working_dir)
+
+        result = Result(self)
+
+        if commands:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def run(command):
+                async with semaphore:
+                    return await run_command(command)
+
+            outcomes = await asyncio.gather(*[run(command) for command in commands])
+            self.complete_result(result, outcomes)
 
         return result
 
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from therapist import __version__
+from therapist.runner.result import Result
+
+
+# The number of cached results to keep around
+MAX_ENTRIES = 1000
+
+# The number of passing files to remember for each process
+MAX_FILE_ENTRIES = 50000
+
+# Files modified this close to when they were hashed may change again without their stat
+# signature changing, so their hashes are not kept (git's "racy" files)
+RACY_INTERVAL_NS = 2 * 10 ** 9
+
+
+def hash_file(path):
+    """Returns the git blob id of a file's contents or None if the file does not exist."""
+    try:
+        with open(path, "rb") as f:
+            sha = hashlib.sha1("blob {}\0".format(os.fstat(f.fileno()).st_size).encode())
+            for chunk in iter(lambda: f.read(65536), b""):
+                sha.update(chunk)
+    except (IOError, OSError):
+        return None
+    return sha.hexdigest()
+
+
+def stat_signature(path):
+    """Returns a tuple of the inode, size and mtime of a file or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class StatCache(object):
+    """A persistent cache of file hashes keyed by the files' stat signatures, like git's index.
+
+    Only files whose stat signature has changed since they were last hashed are read again.
+    """
+
+    def __init__(self, root, path=None, jobs=None):
+        self.root = root
+        self.path = path
+        self.jobs = jobs
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if path:
+            try:
+                with open(path, "r") as f:
+                    self._entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+
+    def _hash(self, path):
+        started = int(time.time() * 10 ** 9)
+        file_hash = hash_file(os.path.join(self.root, path))
+        signature = stat_signature(os.path.join(self.root, path))
+        return file_hash, signature, started
+
+    def hashes(self, paths):
+        """Returns a mapping of paths to the git blob ids of their contents."""
+        hashes = {}
+        stale = []
+
+        with self._lock:
+            for path in paths:
+                signature = stat_signature(os.path.join(self.root, path))
+                entry = self._entries.get(path)
+
+                if signature is None:
+                    hashes[path] = None
+                    if self._entries.pop(path, None):
+                        self._dirty = True
+                elif entry and tuple(entry[:3]) == signature:
+                    hashes[path] = entry[3]
+                else:
+                    stale.append((path, signature))
+
+        if not stale:
+            return hashes
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            hashed = list(executor.map(self._hash, [path for path, signature in stale]))
+
+        with self._lock:
+            for (path, signature), (file_hash, new_signature, started) in zip(stale, hashed):
+                hashes[path] = file_hash
+
+                # Don't keep hashes of files that changed while or just before being hashed
+                if (
+                    file_hash
+                    and new_signature == signature
+                    and signature[2] < started - RACY_INTERVAL_NS
+                ):
+                    self._entries[path] = list(signature) + [file_hash]
+                    self._dirty = True
+
+        return hashes
+
+    def save(self):
+        """Writes the cache to disk if anything has changed."""
+        with self._lock:
+            if not (self.path and self._dirty):
+                return
+
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self.path)
+            except (IOError, OSError):  # pragma: no cover
+                pass
+            else:
+                self._dirty = False
+
+
+class ResultCache(object):
+    """A persistent cache of process results keyed by the process and its files' contents."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, "results", key[:2], "{}.json".format(key))
+
+    def _files_path(self, signature):
+        return os.path.join(self.path, "files", "{}.json".format(self.key(signature, {})))
+
+    def _write_json(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def key(self, signature, hashes):
+        """Returns the cache key for a process signature and a mapping of files to hashes."""
+        data = json.dumps(
+            {"version": __version__, "signature": signature, "files": sorted(hashes.items())},
+            sort_keys=True,
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key, process):
+        """Returns the cached result for the process or None if there is no cached result."""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            os.utime(path)  # Keep track of when the entry was last used for pruning
+        except (IOError, OSError, ValueError):
+            return None
+
+        result = Result(process, status=data.get("status"))
+        result.mark_complete(output=data.get("output"), error=data.get("error"))
+        result.cached = True
+        return result
+
+    def set(self, key, result):
+        """Stores a result. Only successes and failures that modified no files are cached.
+
+        Results with output too long to keep in memory aren't cached either.
+        """
+        if not (result.is_success or result.is_failure) or result.has_modified_files:
+            return
+
+        if result.is_spilled:
+            return
+
+        data = {"status": result.status, "output": result.output, "error": result.error}
+
+        try:
+            self._write_json(self._entry_path(key), data)
+        except (IOError, OSError):  # pragma: no cover
+            pass
+
+    def _read_passed_files(self, signature):
+        try:
+            with open(self._files_path(signature), "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get_passed_files(self, signature, hashes):
+        """Returns the set of files whose current contents are known to pass for a signature."""
+        with self._lock:
+            passed = self._read_passed_files(signature)
+
+        return set(
+            path
+            for path, file_hash in hashes.items()
+            if file_hash and "{}:{}".format(path, file_hash) in passed
+        )
+
+    def add_passed_files(self, signature, hashes, max_entries=MAX_FILE_ENTRIES):
+        """Records that the files passed with the given contents for a signature."""
+        with self._lock:
+            passed = self._read_passed_files(signature)
+
+            now = time.time()
+            for path, file_hash in hashes.items():
+                if file_hash:
+                    passed["{}:{}".format(path, file_hash)] = now
+
+            # Forget the files that passed the longest time ago
+            if len(passed) > max_entries:
+                newest = sorted(passed.items(), key=lambda item: item[1], reverse=True)
+                passed = dict(newest[:max_entries])
+
+            try:
+                self._write_json(self._files_path(signature), passed)
+            except (IOError, OSError):  # pragma: no cover
+                pass
+
+    def prune(self, max_entries=MAX_ENTRIES):
+        """Removes the least recently used results beyond `max_entries`."""
+        entries = []
+        for root, dirs, files in os.walk(os.path.join(self.path, "results")):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:  # pragma: no cover
+                    pass
+
+        entries.sort(reverse=True)
+        for mtime, path in entries[max_entries:]:
+            try:
+                os.remove(path)
+            except OSError:  # pragma: no cover
+                pass
@@ -0,0 +1,148 @@
+import codecs
+import collections
+import os
+import tempfile
+
+
+# The size of the chunks read from a process's output
+READ_SIZE = 65536
+
+# Output longer than this many characters is written to a temporary file instead of being held
+# in memory
+SPILL_SIZE = 1024 * 1024
+
+# How much of the start and the end of spilled output is kept in memory as a preview
+HEAD_SIZE = 32 * 1024
+TAIL_SIZE = 128 * 1024
+
+
+class OutputBuffer(object):
+    """Collects the output of a process as it is read, without holding all of it in memory.
+
+    Output is decoded as UTF-8 as it arrives, replacing any invalid bytes. Once there is more
+    than `spill_size` characters of it, the output is moved to a temporary file and only its
+    head and tail are kept in memory.
+    """
+
+    def __init__(self, spill_size=SPILL_SIZE, head_size=HEAD_SIZE, tail_size=TAIL_SIZE):
+        self.spill_size = spill_size
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.length = 0
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._chunks = []
+        self._head = ""
+        self._tail = collections.deque()
+        self._tail_length = 0
+        self._file = None
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def write(self, data):
+        """Adds a chunk of raw output."""
+        self.append(self._decoder.decode(data))
+
+    def close(self):
+        """Decodes anything left over from the last chunk of output."""
+        self.append(self._decoder.decode(b"", final=True))
+
+    def append(self, text):
+        """Adds a chunk of already decoded output."""
+        if not text:
+            return
+
+        self.length += len(text)
+
+        if self._file is None:
+            self._chunks.append(text)
+            if self.length > self.spill_size:
+                self._spill()
+            return
+
+        self._file.write(text)
+        self._add_to_tail(text)
+
+    def _spill(self):
+        text = "".join(self._chunks)
+        self._chunks = []
+
+        self._file = tempfile.TemporaryFile(mode="w+", encoding="utf-8", newline="")
+        self._file.write(text)
+
+        head_size = self.head_size
+        self._head = text[:head_size]
+        self._add_to_tail(text)
+
+    def _add_to_tail(self, text):
+        tail_size = self.tail_size
+        text = text[-tail_size:]
+        self._tail.append(text)
+        self._tail_length += len(text)
+
+        # Drop the oldest output from the tail once it is too long
+        while self._tail_length - len(self._tail[0]) >= self.tail_size:
+            self._tail_length -= len(self._tail.popleft())
+
+    def chunks(self):
+        """Yields the full output in chunks."""
+        if self._file is None:
+            for chunk in self._chunks:
+                yield chunk
+            return
+
+        self._file.flush()
+        self._file.seek(0)
+        for chunk in iter(lambda: self._file.read(READ_SIZE), ""):
+            yield chunk
+        self._file.seek(0, os.SEEK_END)
+
+    def read(self):
+        """Returns the full output."""
+        return "".join(self.chunks())
+
+    @property
+    def preview(self):
+        """Returns the full output, or just its start and end if it was too long to keep."""
+        if self._file is None:
+            return self.read()
+
+        tail_size = self.tail_size
+        tail = "".join(self._tail)[-tail_size:]
+        omitted = self.length - len(self._head) - len(tail)
+
+        if omitted <= 0:  # pragma: no cover
+            return self.read()
+
+        return "{}\n\n[... {} characters omitted ...]\n\n{}".format(self._head, omitted, tail)
+
+    @classmethod
+    def join(cls, outputs):
+        """Returns a single buffer with all of the outputs, which may be buffers or strings."""
+        joined = cls()
+        for output in outputs:
+            if isinstance(output, cls):
+                for chunk in output.chunks():
+                    joined.append(chunk)
+            else:
+                joined.append(output)
+        return joined
+
+
+def read_output(output):
+    """Returns the full text of an output that may be a buffer or a string."""
+    return output.read() if isinstance(output, OutputBuffer) else output
+
+
+def preview_output(output):
+    """Returns a preview of an output that may be a buffer or a string."""
+    return output.preview if isinstance(output, OutputBuffer) else output
+
+
+def is_spilled(output):
+    return isinstance(output, OutputBuffer) and output.spilled
@@ -4,6 +4,7 @@ from xml.etree import ElementTree
 
 from therapist.collection import Collection
 from therapist.process import Process
+from therapist.runner.output import is_spilled, preview_output, read_output
 
 
 class Result(object):
@@ -15,11 +16,12 @@ class Result(object):
         self._process = None
         self.process = process
         self.status = status
-        self.output = None
-        self.error = None
+        self._output = None
+        self._error = None
         self.start_time = time.time()
         self.end_time = self.start_time
         self.modified_files = []
+        self.cached = False
 
     def __str__(self):
         if self.is_success:
@@ -45,6 +47,36 @@ class Result(object):
 
         self._process = value
 
+    @property
+    def output(self):
+        return read_output(self._output)
+
+    @output.setter
+    def output(self, value):
+        self._output = value
+
+    @property
+    def output_preview(self):
+        """The output, shortened to its start and end if it was too long to keep in memory."""
+        return preview_output(self._output)
+
+    @property
+    def error(self):
+        return read_output(self._error)
+
+    @error.setter
+    def error(self, value):
+        self._error = value
+
+    @property
+    def error_preview(self):
+        return preview_output(self._error)
+
+    @property
+    def is_spilled(self):
+        """Whether any of the output was too long to keep in memory."""
+        return is_spilled(self._output) or is_spilled(self._error)
+
     @property
     def is_success(self):
         return self.status == self.SUCCESS
@@ -154,15 +186,19 @@ class ResultCollection(Collection):
                 text += "{}: {}\n".format(status, result.process)
                 text += "{}\n#{{reset_all}}".format("".ljust(79, "="))
 
-                if result.output:
-                    text += result.output
+                # Very long output is shortened, the full output is in the junit report
+                output = result.output_preview
+                error = result.error_preview
 
-                if result.error:
-                    if result.output:
+                if output:
+                    text += output
+
+                if error:
+                    if output:
                         text += "\n{}\n".format("".ljust(79, "-"))
                         text += "Additional error output:\n"
                         text += "{}\n".format("".ljust(79, "-"))
-                    text += result.error
+                    text += error
 
                 if not text.endswith("\n"):
                     text += "\n"
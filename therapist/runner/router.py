@@ -0,0 +1,228 @@
+import re
+
+from collections import defaultdict
+
+from therapist.utils.paths import PathIndex, normalize_path
+
+
+# Include patterns that can be looked up in a table rather than matched: `*.ext` matches any
+# path with a component ending in `.ext` and a plain name matches any path with a component of
+# that name. Anything with wildcards, slashes, escapes, negation or whitespace is matched.
+EXTENSION_PATTERN = re.compile(r"^\*\.([^*?\[\]\\/!#\s]+)$")
+NAME_PATTERN = re.compile(r"^([^*?\[\]\\/!#\s]+)$")
+
+GLOB_CHARACTERS = re.compile(r"[*?\[\\]")
+
+
+def _literal_prefix(pattern):
+    """Returns the leading components of an include pattern that have no wildcards, or None if
+    the pattern can match at any depth.
+    """
+    pattern = pattern.rstrip("/")
+    if pattern.startswith("/"):
+        pattern = pattern[1:]
+    elif "/" not in pattern or pattern.startswith("**/"):
+        return None
+
+    prefix = []
+    for component in pattern.split("/"):
+        if GLOB_CHARACTERS.search(component):
+            break
+        prefix.append(component)
+    return tuple(prefix)
+
+
+class _Route(object):
+    __slots__ = ("process", "index", "include", "exclude", "files_root", "prefixes")
+
+    def __init__(self, process, index, include, exclude, files_root):
+        self.process = process
+        self.index = index
+        self.include = include
+        self.exclude = exclude
+        self.files_root = files_root
+
+        # Where in the tree the include patterns could match, with None for anywhere
+        self.prefixes = None
+        if include is not None:
+            self.prefixes = [
+                _literal_prefix(source)
+                for source, pattern in zip(include.sources, include.patterns)
+                if pattern.include
+            ]
+            if None in self.prefixes:
+                self.prefixes = None
+
+    def could_match_within(self, directory, parts, components):
+        """Checks if the process could act on any files within a directory, given as a
+        normalized path, its components and the components of its absolute path.
+        """
+        if self.files_root is not None:
+            length = min(len(components), len(self.files_root))
+            if components[:length] != self.files_root[:length]:
+                return False
+
+        if self.exclude is not None and self.exclude.matches_within(directory):
+            return False
+
+        if self.prefixes is None:
+            return True
+
+        for prefix in self.prefixes:
+            length = min(len(parts), len(prefix))
+            if parts[:length] == prefix[:length]:
+                return True
+        return False
+
+
+class Router(object):
+    """Selects the files for several processes in a single pass over the files.
+
+    Instead of each process matching its include patterns against every file, simple `*.ext`
+    and plain name patterns are looked up in tables by the components of each path, and the
+    rest are only tried once a combined regular expression of all of them matches. Only the
+    processes a file could belong to check their exclude patterns and files root.
+
+    Processes that select their files some other way have `select_files` called as usual.
+    """
+
+    def __init__(self, processes, cwd=None, path_index=None):
+        self.processes = list(processes)
+        self.cwd = cwd
+        self.path_index = path_index or PathIndex()
+
+        self._fallback = []
+        self._routes = []
+        self._everything = []
+        self._extensions = defaultdict(list)
+        self._names = defaultdict(list)
+        self._matched = []
+
+        prefilter = []
+
+        for index, process in enumerate(self.processes):
+            spec = process.get_route(cwd)
+            if spec is None:
+                self._fallback.append(process)
+                continue
+
+            include, exclude, files_root = spec
+            route = _Route(process, index, include, exclude, files_root)
+            self._routes.append(route)
+
+            if include is None:
+                self._everything.append(route)
+                continue
+
+            active = [
+                (source, pattern)
+                for source, pattern in zip(include.sources, include.patterns)
+                if pattern.include is not None
+            ]
+
+            if any(not pattern.include for _, pattern in active):
+                # Negated patterns depend on the order of all the patterns, so the process's
+                # own matcher decides
+                self._matched.append((route, include.match_normalized))
+                prefilter.extend(pattern.regex for _, pattern in active if pattern.include)
+                continue
+
+            rest = []
+            for source, pattern in active:
+                extension = EXTENSION_PATTERN.match(source)
+                name = NAME_PATTERN.match(source)
+                if extension:
+                    self._extensions[extension.group(1)].append(route)
+                elif name:
+                    self._names[name.group(1)].append(route)
+                else:
+                    rest.append(pattern.regex)
+
+            if rest:
+                self._matched.append((route, _combine(rest)))
+                prefilter.extend(rest)
+
+        # A file that matches none of the remaining patterns can skip trying each of them
+        self._prefilter = _combine(prefilter) if prefilter else None
+
+    def _candidates(self, path):
+        """Returns the routes whose include patterns match a normalized path."""
+        routes = list(self._everything)
+
+        extensions = self._extensions
+        names = self._names
+        if extensions or names:
+            for component in path.split("/"):
+                routes.extend(names.get(component, ()))
+
+                dot = component.find(".")
+                while dot != -1:
+                    start = dot + 1
+                    routes.extend(extensions.get(component[start:], ()))
+                    dot = component.find(".", start)
+
+        if self._prefilter is not None and self._prefilter(path):
+            routes.extend(route for route, match in self._matched if match(path))
+
+        return routes
+
+    def could_match_within(self, directory):
+        """Checks if any of the processes could act on files within a directory.
+
+        Directories are relative to `cwd`, like files. Directories outside of it could contain
+        it, so they are never ruled out.
+        """
+        if self._fallback:
+            return True
+
+        path = normalize_path(directory).rstrip("/")
+        if not path or path == "." or path == ".." or path.startswith("../"):
+            return True
+
+        parts = tuple(path.split("/"))
+        components = self.path_index.components(directory, self.cwd)
+        return any(route.could_match_within(path, parts, components) for route in self._routes)
+
+    def route(self, files):
+        """Returns a mapping of each process to the files it acts on, in the order given."""
+        files = list(files)
+        selected = dict((process, []) for process in self.processes)
+
+        for f in files:
+            path = normalize_path(f)
+            seen = set()
+
+            for route in self._candidates(path):
+                if route.index in seen:
+                    continue
+                seen.add(route.index)
+
+                if route.exclude is not None and route.exclude.match_normalized(path):
+                    continue
+
+                if route.files_root is not None:
+                    if not self.path_index.is_within(f, route.files_root, self.cwd):
+                        continue
+
+                selected[route.process].append(f)
+
+        for process in self._fallback:
+            selected[process] = process.select_files(
+                files, cwd=self.cwd, path_index=self.path_index
+            )
+
+        return selected
+
+
+def _combine(regexes):
+    """Returns a function matching any of several compiled patterns."""
+    if len(regexes) == 1 or any(regex.groupindex for regex in regexes):
+        if len(regexes) == 1:
+            return regexes[0].match
+
+        def match(path):
+            return any(regex.match(path) for regex in regexes)
+
+        return match
+
+    return re.compile("|".join("(?:{})".format(regex.pattern) for regex in regexes)).match
@@ -1,12 +1,71 @@
+import asyncio
 import os
+import threading
 
-from therapist.utils.git import Git, Status
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from therapist.runner.cache import ResultCache, StatCache, stat_signature
+from therapist.runner.result import Result
+from therapist.runner.router import Router
+from therapist.runner.scheduler import Scheduler
+from therapist.utils.git import ChangedLines, RepoSnapshot, StagedTree, get_backend
+from therapist.utils.paths import PathIndex
+from therapist.utils.system import cpu_count, deferred_signals, signals_as_interrupts
+
+
+ENGINES = ("threads", "asyncio")
+
+# How unstaged changes are kept out of the files actions see: by stashing them or by checking
+# out the staged files to a separate directory
+ISOLATION_MODES = ("stash", "checkout")
+
+
+def _cancel_tasks(loop):
+    all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+    tasks = [task for task in all_tasks(loop) if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+
+def iterate_async(generator):
+    """Iterates over an asynchronous generator from synchronous code on a new event loop."""
+    loop = asyncio.new_event_loop()
+
+    # Subprocesses need the loop to be the current one on older versions of Python
+    asyncio.set_event_loop(loop)
+
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(generator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        try:
+            # Cancel anything left running, e.g. after a `KeyboardInterrupt`
+            _cancel_tasks(loop)
+            loop.run_until_complete(generator.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
 
 
 class Runner(object):
     def __init__(self, cwd, files=None, **kwargs):
         # Options from kwargs:
         fix = kwargs.get("fix", False)
+        jobs = kwargs.get("jobs")
+        shard = kwargs.get("shard")
+        cache_dir = kwargs.get("cache_dir")
+        engine = kwargs.get("engine")
+        snapshot = kwargs.get("snapshot")
+        git_backend = kwargs.get("git_backend")
+        isolation = kwargs.get("isolation")
+        skip_attributes = kwargs.get("skip_attributes")
 
         # Git related options
         enable_git = kwargs.get("enable_git", False)
@@ -17,26 +76,60 @@ class Runner(object):
 
         self.cwd = os.path.abspath(cwd)
         self.unstaged_changes = False
+        self.unstaged_files = set()
 
-        self.git = Git(repo_path=self.cwd) if enable_git else None
+        self.backend = None
+        self.snapshot = None
+        self.changed_lines = None
+        if enable_git:
+            self.backend = snapshot.backend if snapshot else get_backend(git_backend, self.cwd)
+        self.git = self.backend.git if self.backend else None
         self.include_unstaged_changes = include_unstaged_changes or include_unstaged
         self.fix = fix
         self.stage_modified_files = stage_modified_files
-        self.file_mtimes = {}
+        self.jobs = jobs if jobs else cpu_count()
+        self.shard = shard
+        self.engine = engine if engine else "threads"
+        self.isolation = isolation if isolation else "stash"
+        self.cache = ResultCache(cache_dir) if cache_dir else None
+        self.stat_cache = StatCache(
+            self.cwd,
+            path=os.path.join(cache_dir, "stat.json") if cache_dir else None,
+            jobs=self.jobs,
+        )
+        self.file_signatures = {}
+
+        # Guards `file_signatures` and the git index when processes are run in parallel
+        self._lock = threading.RLock()
+
+        # Set while unstaged changes are isolated for a whole run rather than per process
+        self._isolated = False
+
+        # The copy of the staged files that processes are run in, if there is one
+        self._staged_tree = None
+
+        # The files selected by each process, keyed by process
+        self._selected_files = {}
+        self.path_index = PathIndex()
+
+        if self.git:
+            untracked_files = "all" if include_untracked else "no"
+            self.snapshot = snapshot or RepoSnapshot(self.backend, untracked_files=untracked_files)
+
+            # The lines changed in each file, compared to what processes see
+            self.changed_lines = ChangedLines(
+                self.snapshot, staged=not self.include_unstaged_changes
+            )
 
         if files is None:
             files = []
 
             if self.git:
-                untracked_files = "all" if include_untracked else "no"
-                out, err, code = self.git.status(porcelain=True, untracked_files=untracked_files)
-
-                for line in out.splitlines():
-                    file_status = Status(line)
-
+                for file_status in self.snapshot.statuses:
                     # Check if staged files were modified since being staged
                     if file_status.is_staged and file_status.y in ("M", "D", "R", "C"):
                         self.unstaged_changes = True
+                        self.unstaged_files.add(file_status.path)
 
                     # Skip unstaged files if the `unstaged` flag is False
                     if not file_status.is_staged and not include_unstaged and not include_untracked:
@@ -48,55 +141,50 @@ class Runner(object):
 
                     files.append(file_status.path)
 
+        # Files may be a generator, so they are only iterated over once
+        self.files = []
         for path in files:
-            if os.path.exists(path):
-                self.file_mtimes[path] = os.path.getmtime(path)
+            self.file_signatures[path] = stat_signature(os.path.join(self.cwd, path))
+            self.files.append(path)
 
-        self.files = files
+        # Files with any of the attributes, such as generated or vendored files, are skipped
+        if self.backend and skip_attributes and self.files:
+            skipped = self.backend.check_attributes(
+                self.files, skip_attributes, cached=not self.include_unstaged_changes
+            )
+            if skipped:
+                self.files = [f for f in self.files if f not in skipped]
+                for path in skipped:
+                    self.file_signatures.pop(path, None)
 
     def run_process(self, process):
         """Runs a single action."""
-        message = u"#{bright}"
-        message += u"{} ".format(str(process)[:68]).ljust(69, ".")
+        files = self.get_files(process)
 
-        stashed = False
-        if self.git and self.unstaged_changes and not self.include_unstaged_changes:
-            out, err, code = self.git.stash(keep_index=True, quiet=True)
-            stashed = code == 0
+        if files:
+            with self.isolate_unstaged_changes(self.get_isolated_files(process)):
+                result = self._execute_cached(process, files)
+        else:
+            # Nothing to do so skip the process without touching git at all
+            result = Result(process)
 
-        try:
-            result = process(files=self.files, cwd=self.cwd, fix=self.fix)
+        return result, self.get_message(result)
 
-            # Check for modified files
-            if self.git:
-                out, err, code = self.git.status(porcelain=True, untracked_files="no")
-                for line in out.splitlines():
-                    file_status = Status(line)
-
-                    # Make sure the file is one of the files that was processed
-                    if file_status.path in self.files and file_status.y == "M":
-                        mtime = (
-                            os.path.getmtime(file_status.path)
-                            if os.path.exists(file_status.path)
-                            else 0
-                        )
-                        if mtime > self.file_mtimes.get(file_status.path, 0):
-                            self.file_mtimes[file_status.path] = mtime
-                            result.add_modified_file(file_status.path)
-                            if self.stage_modified_files:
-                                self.git.add(file_status.path)
-            else:
-                for path in self.files:
-                    mtime = os.path.getmtime(path) if os.path.exists(path) else 0
-                    if mtime > self.file_mtimes.get(path, 0):
-                        result.add_modified_file(path)
-
-        except:  # noqa: E722
-            raise
-        finally:
-            if stashed and self.git:
-                self.git.reset(hard=True, quiet=True)
-                self.git.stash.pop(index=True, quiet=True)
+    async def run_process_async(self, process):
+        """Runs a single action from an event loop."""
+        files = self.get_files(process)
+
+        if files:
+            with self.isolate_unstaged_changes(self.get_isolated_files(process)):
+                result = await self._execute_cached_async(process, files)
+        else:
+            result = Result(process)
+
+        return result, self.get_message(result)
+
+    def get_message(self, result):
+        message = u"#{bright}"
+        message += u"{} ".format(str(result.process)[:68]).ljust(69, ".")
 
         if result.is_success:
             message += u" #{green}[SUCCESS]"
@@ -107,4 +195,379 @@ class Runner(object):
         elif result.is_error:
             message += u" #{red}[ERROR!!]"
 
-        return result, message
+        return message
+
+    def get_files(self, process):
+        """Returns the files the process will act on."""
+        with self._lock:
+            if process not in self._selected_files:
+                self._selected_files[process] = process.select_files(
+                    self.files, cwd=self.cwd, path_index=self.path_index
+                )
+            return self._selected_files[process]
+
+    def route(self, processes):
+        """Selects the files for each of the processes that haven't had them selected yet in
+        a single pass over the files.
+        """
+        with self._lock:
+            pending = [p for p in processes if p not in self._selected_files]
+            if pending:
+                router = Router(pending, cwd=self.cwd, path_index=self.path_index)
+                self._selected_files.update(router.route(self.files))
+
+    def get_isolated_files(self, process):
+        """Returns the files the process reads from the working tree, which need any unstaged
+        changes to them kept out of the way.
+        """
+        if process.uses_stdin(self.fix):
+            return []
+        return self.get_files(process)
+
+    def read_file(self, path):
+        """Returns the contents of a file as processes should see them.
+
+        That is the staged contents, unless unstaged changes are included or the file isn't in
+        the index.
+        """
+        if self.git and not self.include_unstaged_changes:
+            with self._lock:
+                object_id = self.snapshot.blob_ids.get(path)
+
+            # The backends can be read from several threads at once
+            found = self.backend.cat_file([object_id])[object_id] if object_id else None
+            if found:
+                return found[1]
+
+        with open(os.path.join(self.cwd, path), "rb") as f:
+            return f.read()
+
+    def hash_files(self, files, staged=False):
+        """Returns a mapping of each file to the git blob id of its current contents.
+
+        If `staged` is set, files in the index are hashed by their staged contents.
+        """
+        hashes = {}
+
+        if self.git:
+            with self._lock:
+                # Files changed since they were last checked need their state read again
+                self.snapshot.refresh([path for path in files if self._has_changed(path)])
+
+                # Files that match the index can use the blob id git already has for them
+                blob_ids = self.snapshot.blob_ids
+                unstaged = self.snapshot.unstaged
+
+            # Processes run in a copy of the staged files only ever see the staged contents
+            if staged or self._staged_tree:
+                unstaged = set()
+
+            remaining = []
+            for path in files:
+                if path in blob_ids and path not in unstaged:
+                    hashes[path] = blob_ids[path]
+                else:
+                    remaining.append(path)
+
+            hashes.update(self.backend.hash_objects(remaining))
+            files = [path for path in remaining if path not in hashes]
+
+        if files:
+            hashes.update(self.stat_cache.hashes(files))
+            self.stat_cache.save()
+
+        return hashes
+
+    @property
+    def exec_cwd(self):
+        """The directory processes are run in."""
+        return self._staged_tree.path if self._staged_tree else self.cwd
+
+    def get_process_kwargs(self, process, files):
+        kwargs = dict(
+            files=files,
+            cwd=self.exec_cwd,
+            fix=self.fix,
+            shard=self.shard,
+            changed_lines=self.changed_lines,
+            path_index=self.path_index,
+            files_selected=True,
+        )
+        if process.uses_stdin(self.fix):
+            kwargs["read_file"] = self.read_file
+        return kwargs
+
+    def _execute(self, process, files):
+        result = process(**self.get_process_kwargs(process, files))
+        self._check_modified_files(result, files)
+        return result
+
+    def _lookup(self, process, files):
+        """Looks up the result of a process in the cache.
+
+        Returns a tuple of the cached result, or None, the files the process still needs to run
+        on and a function that stores the result once it has run.
+        """
+        signature = process.get_cache_signature(self.fix) if self.cache else None
+        if signature is None:
+            return None, files, lambda result: None
+
+        # Results go stale when the tool's configuration changes as much as when the files do
+        inputs = process.get_cache_inputs()
+        if inputs:
+            signature = dict(signature, inputs=sorted(self.hash_files(inputs).items()))
+
+        reads_staged = process.uses_stdin(self.fix) and not self.include_unstaged_changes
+        hashes = self.hash_files(files, staged=reads_staged)
+
+        if process.config.get("per_file"):
+            # Only run the process against files that haven't already passed as they are now
+            passed = self.cache.get_passed_files(signature, hashes)
+            remaining = [f for f in files if f not in passed]
+
+            if not remaining:
+                result = Result(process, status=Result.SUCCESS)
+                result.mark_complete()
+                result.cached = True
+                return result, remaining, None
+
+            def store(result):
+                if result.is_success and not result.has_modified_files:
+                    self.cache.add_passed_files(signature, {f: hashes[f] for f in remaining})
+
+            return None, remaining, store
+
+        key = self.cache.key(signature, hashes)
+        return self.cache.get(key, process), files, lambda result: self.cache.set(key, result)
+
+    def _execute_cached(self, process, files):
+        result, files, store = self._lookup(process, files)
+        if result is None:
+            result = self._execute(process, files)
+            store(result)
+        return result
+
+    async def _execute_cached_async(self, process, files):
+        loop = asyncio.get_event_loop()
+
+        # Git and the cache are only used briefly, so they are left to the default executor
+        result, files, store = await loop.run_in_executor(None, self._lookup, process, files)
+        if result is None:
+            result = await process.execute_async(**self.get_process_kwargs(process, files))
+            await loop.run_in_executor(None, self._check_modified_files, result, files)
+            await loop.run_in_executor(None, store, result)
+        return result
+
+    def _has_changed(self, path):
+        signature = stat_signature(os.path.join(self.cwd, path))
+        return signature is not None and signature != self.file_signatures.get(path)
+
+    def _is_modified(self, path):
+        """Checks if a file has been modified and records its new stat signature if it has."""
+        signature = stat_signature(os.path.join(self.cwd, path))
+        if signature is not None and signature != self.file_signatures.get(path):
+            self.file_signatures[path] = signature
+            return True
+        return False
+
+    def _check_modified_files(self, result, files):
+        # Guard the recorded signatures and the snapshot against processes running in parallel
+        with self._lock:
+            # Only files whose stat signature has changed can have been modified
+            modified = [path for path in sorted(set(files)) if self._is_modified(path)]
+
+            if self.git and modified:
+                # Make sure the changes are to the files' contents in the working tree
+                self.snapshot.refresh(modified)
+                modified = [
+                    path
+                    for path in modified
+                    if self.snapshot.get(path) and self.snapshot.get(path).y == "M"
+                ]
+
+            for path in modified:
+                result.add_modified_file(path)
+
+            if self.git and modified and self.stage_modified_files:
+                self.backend.add(modified)
+                self.snapshot.refresh(modified)
+
+    def needs_isolation(self, files=None):
+        """Whether unstaged changes need to be stashed before acting on the files."""
+        if not (self.git and self.unstaged_changes and not self.include_unstaged_changes):
+            return False
+        if files is None:
+            return True
+        return not self.unstaged_files.isdisjoint(files)
+
+    @contextmanager
+    def isolate_unstaged_changes(self, files=None):
+        """Stashes any unstaged changes and restores them when the context exits.
+
+        If files are given, the changes are only stashed if any of the files have unstaged
+        changes. Nested calls are no-ops so a run can isolate the changes once for all its
+        processes.
+
+        With the `checkout` isolation mode, the staged files are copied to a directory that
+        processes are run in instead, leaving the working tree alone. Fixes have to be made in
+        the working tree, so they always stash.
+        """
+        if self._isolated or not self.needs_isolation(files):
+            yield
+            return
+
+        if self.isolation == "checkout" and not self.fix:
+            with self._run_in_staged_tree():
+                yield
+            return
+
+        stashed = False
+        self._isolated = True
+        try:
+            # A signal held off while stashing is delivered once `stashed` is set, and raises
+            # `KeyboardInterrupt` here for the changes to be restored below
+            with signals_as_interrupts():
+                with deferred_signals():
+                    stashed = self.backend.stash()
+
+                yield
+        finally:
+            self._isolated = False
+
+            if stashed:
+                # Make sure an impatient Ctrl-C can't leave the changes stashed
+                with deferred_signals():
+                    self.backend.reset()
+                    self.backend.stash_pop()
+
+    @contextmanager
+    def _run_in_staged_tree(self):
+        parent_dir = os.path.join(self.backend.git_dir(), "therapist")
+
+        # Untracked files processes act on, e.g. with `include_untracked`, aren't in the index
+        blob_ids = self.snapshot.blob_ids
+        untracked = [path for path in self.files if path not in blob_ids]
+
+        # The copy is removed even if the run is interrupted while it is being made
+        tree = StagedTree(self.snapshot, parent_dir, untracked=untracked)
+        with signals_as_interrupts(), tree:
+            self._staged_tree = tree
+            self._isolated = True
+            try:
+                yield
+            finally:
+                self._isolated = False
+                self._staged_tree = None
+
+    def _get_all_files(self, processes):
+        files = set()
+        for process in processes:
+            files.update(self.get_isolated_files(process))
+        return files
+
+    def run_processes(self, processes):
+        """Runs several processes, yielding a result and message for each in the given order.
+
+        Unstaged changes are stashed once before the first process and restored after the
+        last, and only if any of the processes act on files with unstaged changes. Processes
+        are run in parallel on up to `jobs` threads, in the order allowed by the `Scheduler`.
+        With the asyncio engine, they are run by `run_all` on an event loop instead.
+        """
+        if self.engine == "asyncio":
+            for item in iterate_async(self.run_all(processes)):
+                yield item
+            return
+
+        try:
+            processes = list(processes)
+            self.route(processes)
+
+            with self.isolate_unstaged_changes(self._get_all_files(processes)):
+                for item in self._run_processes(processes):
+                    yield item
+        finally:
+            self._finish()
+
+    def _finish(self):
+        """Cleans up after a run, however it ended. Backends release the git processes and
+        files they keep open.
+        """
+        if self.cache:
+            self.cache.prune()
+
+        if self.backend:
+            self.backend.close()
+
+    def _run_processes(self, processes):
+        scheduler = Scheduler(
+            processes, fix=self.fix, files=dict((p, self.get_files(p)) for p in processes)
+        )
+
+        results = {}
+        running = {}
+        position = 0
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while position < len(processes):
+                capacity = self.jobs - len(running)
+                for process in scheduler.ready(running.values(), results, capacity):
+                    running[executor.submit(self.run_process, process)] = process
+
+                if not running:  # pragma: no cover
+                    raise RuntimeError("The remaining processes depend on each other.")
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results[running.pop(future)] = future.result()
+
+                # Yield the results that are ready in the order the processes were given
+                while position < len(processes) and processes[position] in results:
+                    yield results[processes[position]]
+                    position += 1
+
+    async def run_all(self, processes):
+        """Runs several processes on the current event loop, like `run_processes`.
+
+        Commands are run as asynchronous subprocesses so a single thread can drive up to `jobs`
+        of them at once. Any processes still running are cancelled if the generator is closed.
+        """
+        try:
+            processes = list(processes)
+            self.route(processes)
+
+            with self.isolate_unstaged_changes(self._get_all_files(processes)):
+                async for item in self._run_all(processes):
+                    yield item
+        finally:
+            self._finish()
+
+    async def _run_all(self, processes):
+        scheduler = Scheduler(
+            processes, fix=self.fix, files=dict((p, self.get_files(p)) for p in processes)
+        )
+
+        results = {}
+        running = {}
+        position = 0
+
+        try:
+            while position < len(processes):
+                capacity = self.jobs - len(running)
+                for process in scheduler.ready(running.values(), results, capacity):
+                    running[asyncio.ensure_future(self.run_process_async(process))] = process
+
+                if not running:  # pragma: no cover
+                    raise RuntimeError("The remaining processes depend on each other.")
+
+                finished, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    results[running.pop(task)] = task.result()
+
+                while position < len(processes) and processes[position] in results:
+                    yield results[processes[position]]
+                    position += 1
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
@@ -0,0 +1,108 @@
+def find_cycle(processes):
+    """Returns a list of processes that depend on each other in a cycle or None if none do."""
+    by_name = dict((process.name, process) for process in processes)
+    visiting = []
+    visited = set()
+
+    def visit(process):
+        if process in visiting:
+            start = visiting.index(process)
+            return visiting[start:] + [process]
+        if process in visited:
+            return None
+
+        visiting.append(process)
+        for name in process.needs:
+            if name in by_name:
+                cycle = visit(by_name[name])
+                if cycle:
+                    return cycle
+        visiting.pop()
+        visited.add(process)
+        return None
+
+    for process in processes:
+        cycle = visit(process)
+        if cycle:
+            return cycle
+    return None
+
+
+class Scheduler(object):
+    """Decides which processes can be started while others are running.
+
+    A process starts once every process it `needs` has finished. An `exclusive` process only
+    runs on its own and no two processes in the same `concurrency_group` run at the same time.
+    When fixing, processes that may modify files are exclusive and run before any read-only
+    processes that act on the same files.
+    """
+
+    def __init__(self, processes, fix=False, files=None):
+        self.processes = list(processes)
+        self.fix = fix
+        files = files or {}
+
+        by_name = dict((process.name, process) for process in self.processes)
+        self.dependencies = {}
+        for process in self.processes:
+            # Dependencies that aren't part of this run are ignored
+            self.dependencies[process] = set(
+                by_name[name] for name in process.needs if name in by_name
+            )
+
+        # Readers wait for any writer that acts on the same files, unless the writer already
+        # depends on the reader
+        writers = [p for p in self.processes if not p.is_read_only(fix)]
+        for reader in self.processes:
+            if reader in writers:
+                continue
+            for writer in writers:
+                overlaps = not set(files.get(writer, ())).isdisjoint(files.get(reader, ()))
+                if overlaps and reader not in self.ancestors(writer):
+                    self.dependencies[reader].add(writer)
+
+    def ancestors(self, process):
+        """Returns all the processes a process depends on, directly or indirectly."""
+        ancestors = set()
+        stack = list(self.dependencies[process])
+        while stack:
+            dependency = stack.pop()
+            if dependency not in ancestors:
+                ancestors.add(dependency)
+                stack.extend(self.dependencies[dependency])
+        return ancestors
+
+    def is_exclusive(self, process):
+        return process.exclusive or not process.is_read_only(self.fix)
+
+    def ready(self, running, done, capacity):
+        """Returns the processes that can be started now, in order."""
+        running = list(running)
+        ready = []
+
+        if any(self.is_exclusive(process) for process in running):
+            return ready
+
+        for process in self.processes:
+            if len(ready) >= capacity:
+                break
+
+            if process in done or process in running or process in ready:
+                continue
+
+            if not self.dependencies[process].issubset(done):
+                continue
+
+            if self.is_exclusive(process):
+                # Hold back everything after an exclusive process until it has run
+                if not (running or ready):
+                    ready.append(process)
+                break
+
+            group = process.concurrency_group
+            if group and any(p.concurrency_group == group for p in running + ready):
+                continue
+
+            ready.append(process)
+
+        return ready
@@ -1,5 +1,11 @@
 import os
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from therapist.utils.git import Git, iter_ls_files
+from therapist.utils.paths import PathMatcher
+from therapist.utils.system import cpu_count
+
 
 def current_root():
     """Traverse up the tree and locate the first directory with a `.therapist.yml` file."""
@@ -25,13 +31,157 @@ def current_git_dir():
         path = next_path
 
 
-def list_files(path):
-    """Recursively collects a list of files at a path."""
+def list_files(path, use_git=False, skip_dir=None, jobs=None):
+    """Recursively collects a list of files at a path.
+
+    With `use_git`, directories within a git repository have their files listed by git, which
+    leaves out any it ignores. Other directories are walked by `walk_files`.
+    """
     files = []
     if os.path.isdir(path):
-        for stats in os.walk(path):
-            for f in stats[2]:
-                files.append(os.path.join(stats[0], f))
+        files = list_git_files(path) if use_git else None
+        if files is None:
+            files = walk_files(path, skip_dir=skip_dir, jobs=jobs)
     elif os.path.isfile(path):
         files = [path]
     return files
+
+
+def list_git_files(path):
+    """Lists the tracked and untracked files in a directory that git doesn't ignore.
+
+    Returns None if the directory isn't in the working tree of a git repository.
+    """
+    git = Git(repo_path=path)
+    out, err, code = git.rev_parse("--is-inside-work-tree")
+    if code != 0 or out.strip() != "true":
+        return None
+
+    files = []
+    seen = set()
+    for f in iter_ls_files(git, cached=True, others=True, exclude_standard=True):
+        # Unmerged files are listed once for each stage. Tracked files may have been deleted
+        # from the working tree and submodules are listed as a single entry.
+        if f in seen:
+            continue
+        seen.add(f)
+
+        f = os.path.join(path, f)
+        if os.path.isfile(f):
+            files.append(f)
+    return files
+
+
+class _IgnoreRules(object):
+    """The patterns in the `.gitignore` files of a directory and its parents."""
+
+    def __init__(self, parent=None, base=None, prefix="", matcher=None):
+        self.parent = parent
+        self.base = base
+        self.prefix = prefix
+        self.matcher = matcher
+
+    def extend(self, directory, base=None, prefix=""):
+        """Returns the rules with those of a directory's `.gitignore` file, if it has one.
+
+        Paths start with `base`, the directory by default, and `prefix` is the path from the
+        directory to `base`.
+        """
+        try:
+            with open(os.path.join(directory, ".gitignore")) as f:
+                patterns = f.read().splitlines()
+        except (IOError, OSError, UnicodeDecodeError):
+            return self
+
+        base = os.path.join(base or directory, "")
+        return _IgnoreRules(self, base, prefix, PathMatcher(patterns))
+
+    def is_ignored(self, path, is_dir=False):
+        # Patterns in a subdirectory take precedence over those in the directories above it
+        rules = self
+        while rules.matcher is not None:
+            start = len(rules.base)
+            relative = rules.prefix + path[start:].replace(os.sep, "/")
+            ignored = rules.matcher.check_normalized(relative + "/" if is_dir else relative)
+            if ignored is not None:
+                return ignored
+            rules = rules.parent
+        return False
+
+
+def _parent_rules(path):
+    """Returns the rules of the `.gitignore` files above a directory, up to the root of the
+    repository it is in.
+    """
+    rules = _IgnoreRules()
+
+    root = directory = os.path.abspath(path)
+    parents = []
+    while not os.path.exists(os.path.join(directory, ".git")):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return rules
+        directory = parent
+        parents.append(directory)
+
+    for parent in reversed(parents):
+        prefix = os.path.relpath(root, parent).replace(os.sep, "/") + "/"
+        rules = rules.extend(parent, base=path, prefix=prefix)
+    return rules
+
+
+def _scan_directory(directory, rules):
+    """Lists the files and subdirectories of a directory that aren't ignored."""
+    rules = rules.extend(directory)
+
+    files = []
+    directories = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return files, directories
+
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+            is_link = is_dir and entry.is_symlink()
+        except OSError:
+            is_dir = is_link = False
+
+        if is_dir and entry.name == ".git":
+            continue
+        if rules.is_ignored(entry.path, is_dir=is_dir):
+            continue
+
+        # Like `os.walk`, links to directories are neither followed nor listed as files
+        if not is_dir:
+            files.append(entry.path)
+        elif not is_link:
+            directories.append((entry.path, rules))
+
+    return files, directories
+
+
+def walk_files(path, skip_dir=None, jobs=None):
+    """Collects a sorted list of the files in a directory and its subdirectories.
+
+    Files and directories ignored by the `.gitignore` files in the directories walked, and in
+    those above them within the same repository, are left out. So are `.git` directories and
+    any directory `skip_dir` returns True for. Directories are listed in parallel on up to
+    `jobs` threads.
+    """
+    files = []
+
+    with ThreadPoolExecutor(max_workers=jobs or cpu_count()) as executor:
+        pending = {executor.submit(_scan_directory, path, _parent_rules(path))}
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                found, directories = future.result()
+                files.extend(found)
+                for directory, rules in directories:
+                    if skip_dir is None or not skip_dir(directory):
+                        pending.add(executor.submit(_scan_directory, directory, rules))
+
+    files.sort()
+    return files
@@ -1,5 +1,46 @@
+from therapist.utils.git.attributes import check_attributes
+from therapist.utils.git.backend import (
+    BatchGitBackend,
+    GitBackend,
+    InProcessGitBackend,
+    get_backend,
+)
+from therapist.utils.git.diff import ChangedLines, parse_diff
 from therapist.utils.git.git import Git
-from therapist.utils.git.status import Status
+from therapist.utils.git.index import IndexEntry, UnsupportedIndex, read_index, read_repo_index
+from therapist.utils.git.objects import (
+    hash_objects,
+    iter_ls_files,
+    iter_nul,
+    staged_blob_ids,
+    unstaged_paths,
+)
+from therapist.utils.git.snapshot import RepoSnapshot
+from therapist.utils.git.staged import StagedTree
+from therapist.utils.git.status import Status, get_status, parse_status
 
 
-__all__ = [Git, Status]
+__all__ = [
+    BatchGitBackend,
+    ChangedLines,
+    Git,
+    GitBackend,
+    InProcessGitBackend,
+    IndexEntry,
+    RepoSnapshot,
+    StagedTree,
+    Status,
+    UnsupportedIndex,
+    check_attributes,
+    get_backend,
+    get_status,
+    hash_objects,
+    iter_ls_files,
+    iter_nul,
+    parse_diff,
+    parse_status,
+    read_index,
+    read_repo_index,
+    staged_blob_ids,
+    unstaged_paths,
+]
@@ -0,0 +1,60 @@
+import os
+
+
+# The values `git check-attr` reports for attributes that don't apply to a path
+NOT_SET = ("unspecified", "unset", "false")
+
+# How many paths are written to `git check-attr` at a time
+WRITE_BATCH = 1000
+
+
+def _encode_paths(paths):
+    batch = []
+    for path in paths:
+        batch.append(os.fsencode(path))
+        if len(batch) == WRITE_BATCH:
+            yield b"\0".join(batch) + b"\0"
+            batch = []
+    if batch:
+        yield b"\0".join(batch) + b"\0"
+
+
+def _iter_fields(chunks):
+    """Yields the NUL-terminated fields of git output as it arrives in chunks. Unlike paths,
+    fields can be empty, e.g. the value of an attribute set to an empty string.
+    """
+    remainder = b""
+    for chunk in chunks:
+        fields = (remainder + chunk).split(b"\0")
+        remainder = fields.pop()
+        for field in fields:
+            yield os.fsdecode(field)
+
+    if remainder:
+        yield os.fsdecode(remainder)
+
+
+def check_attributes(git, paths, attributes, cached=False):
+    """Returns the set of paths that have any of the attributes set.
+
+    All of the paths are checked by a single `git check-attr --stdin`, which is written to as
+    its output is read. Attributes set to `false` don't count as set. With `cached`, only the
+    `.gitattributes` files in the index are considered.
+    """
+    attributes = list(attributes)
+    if not attributes:
+        return set()
+
+    kwargs = {"z": True, "stdin": True}
+    if cached:
+        kwargs["cached"] = True
+
+    items = _iter_fields(git.check_attr.stream(*attributes, input=_encode_paths(paths), **kwargs))
+
+    # The output is a `<path> NUL <attribute> NUL <value> NUL` triple for each attribute of each
+    # path
+    flagged = set()
+    for path, attribute, value in zip(items, items, items):
+        if value not in NOT_SET:
+            flagged.add(path)
+    return flagged
@@ -0,0 +1,303 @@
+import io
+import os
+import subprocess
+import threading
+
+from therapist.utils.git.attributes import check_attributes
+from therapist.utils.git.diff import changed_lines
+from therapist.utils.git.git import Git
+from therapist.utils.git.index import UnsupportedIndex, find_git_dir, read_repo_index
+from therapist.utils.git.objects import hash_objects, iter_ls_files, staged_blob_ids
+from therapist.utils.git.status import get_status
+from therapist.utils.git.store import ObjectStore, UnsupportedObject
+
+
+def _read_batch_header(stream):
+    """Reads the header `git cat-file --batch` writes for an object."""
+    header = stream.readline().decode("ascii").split()
+    if len(header) != 3:  # `<object> missing`
+        return None
+    object_id, object_type, size = header
+    return object_type, int(size)
+
+
+def _read_batch_object(stream):
+    info = _read_batch_header(stream)
+    if info is None:
+        return None
+    object_type, size = info
+    data = stream.read(size)
+    stream.read(1)  # Each object is followed by a newline
+    return object_type, data
+
+
+def _unique(paths):
+    """Yields sorted paths once each. Unmerged paths are in the index once for each stage."""
+    previous = None
+    for path in paths:
+        if path != previous:
+            yield path
+        previous = path
+
+
+class GitBackend(object):
+    """The git operations therapist uses, answered by running a `git` command for each one.
+
+    Subclasses answer some of them more cheaply, falling back to this implementation for
+    anything they can't handle.
+    """
+
+    name = "subprocess"
+
+    def __init__(self, repo_path=None):
+        self.repo_path = repo_path
+        self.git = Git(repo_path=repo_path)
+
+        # Paths are passed to git as they are rather than as patterns
+        self.literal_git = Git(["git", "--literal-pathspecs"], repo_path=repo_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Releases anything the backend keeps open between calls."""
+
+    def status(self, untracked_files="all", paths=None):
+        """Returns the statuses of the files in the working tree and the index."""
+        return get_status(self.literal_git, untracked_files=untracked_files, paths=paths)
+
+    def ls_files(self, paths=None):
+        """Returns a mapping of the paths in the index to the ids of their staged blobs."""
+        return staged_blob_ids(self.literal_git, paths=paths)
+
+    def changed_lines(self, staged=True):
+        """Returns a mapping of changed paths to the line ranges added to them."""
+        return changed_lines(self.git, staged=staged)
+
+    def iter_tracked(self):
+        """Yields the paths in the index."""
+        return _unique(iter_ls_files(self.git))
+
+    def iter_untracked(self):
+        """Yields the paths of untracked files that aren't ignored."""
+        return iter_ls_files(self.git, others=True, exclude_standard=True)
+
+    def check_attributes(self, paths, attributes, cached=False):
+        """Returns the set of paths that have any of the attributes set."""
+        return check_attributes(self.git, paths, attributes, cached=cached)
+
+    def hash_objects(self, paths):
+        """Returns a mapping of paths to the blob ids of their contents in the working tree."""
+        return hash_objects(self.git, paths)
+
+    def cat_file(self, object_ids):
+        """Returns a mapping of object ids to their type and contents, or None if missing."""
+        object_ids = list(object_ids)
+        if not object_ids:
+            return {}
+
+        out, err, code = self.git.cat_file.communicate(
+            batch=True, input=self._batch_input(object_ids), decode=False
+        )
+        stream = io.BytesIO(out)
+        return dict((object_id, _read_batch_object(stream)) for object_id in object_ids)
+
+    def object_info(self, object_ids):
+        """Returns a mapping of object ids to their type and size, or None if missing."""
+        object_ids = list(object_ids)
+        if not object_ids:
+            return {}
+
+        out, err, code = self.git.cat_file.communicate(
+            batch_check=True, input=self._batch_input(object_ids), decode=False
+        )
+        stream = io.BytesIO(out)
+        return dict((object_id, _read_batch_header(stream)) for object_id in object_ids)
+
+    def _batch_input(self, object_ids):
+        return "".join("{}\n".format(object_id) for object_id in object_ids).encode("ascii")
+
+    def stash(self):
+        """Stashes unstaged changes, keeping the index. Returns whether anything was stashed."""
+        out, err, code = self.git.stash(keep_index=True, quiet=True)
+        return code == 0
+
+    def stash_pop(self):
+        """Restores the most recent stash, including what was staged."""
+        self.git.stash.pop(index=True, quiet=True)
+
+    def reset(self):
+        """Discards all changes in the working tree and the index."""
+        self.git.reset(hard=True, quiet=True)
+
+    def add(self, paths):
+        """Stages paths."""
+        self.literal_git.add("--", *paths)
+
+    def git_dir(self):
+        """Returns the absolute path of the repository's git directory."""
+        out, err, code = self.git.rev_parse("--git-dir")
+        return os.path.join(os.path.abspath(self.repo_path or os.curdir), out.strip())
+
+    def checkout_index(self, paths, prefix):
+        """Writes the staged contents of paths to files under a directory."""
+        if not paths:
+            return
+
+        data = b"".join(os.fsencode(path) + b"\0" for path in paths)
+        self.git.checkout_index(
+            "--stdin", "-z", "--force", prefix=os.path.join(prefix, ""), input=data
+        )
+
+
+class BatchGitBackend(GitBackend):
+    """Reads objects through long-lived `git cat-file --batch` processes.
+
+    The processes are started the first time they are needed and stopped by `close`.
+    """
+
+    name = "batch"
+
+    def __init__(self, repo_path=None):
+        super(BatchGitBackend, self).__init__(repo_path=repo_path)
+        self._processes = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            for process in self._processes.values():
+                process.stdin.close()
+                process.wait()
+                process.stdout.close()
+            self._processes = {}
+
+    def _process(self, option):
+        process = self._processes.get(option)
+        if process is None or process.poll() is not None:
+            process = subprocess.Popen(
+                self.git.current + ["cat-file", option],
+                cwd=self.repo_path,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            self._processes[option] = process
+        return process
+
+    def _query(self, option, object_ids, read):
+        results = {}
+        with self._lock:
+            process = self._process(option)
+            # One object at a time so neither side of the pipes can fill up
+            for object_id in object_ids:
+                process.stdin.write("{}\n".format(object_id).encode("ascii"))
+                process.stdin.flush()
+                results[object_id] = read(process.stdout)
+        return results
+
+    def cat_file(self, object_ids):
+        return self._query("--batch", object_ids, _read_batch_object)
+
+    def object_info(self, object_ids):
+        return self._query("--batch-check", object_ids, _read_batch_header)
+
+
+class InProcessGitBackend(BatchGitBackend):
+    """Reads the index and objects straight from the repository's files.
+
+    Anything that can't be read directly, such as an index with extensions it doesn't
+    understand, is left to git. Working tree status and changes always go through git.
+    """
+
+    name = "inprocess"
+
+    def __init__(self, repo_path=None):
+        super(InProcessGitBackend, self).__init__(repo_path=repo_path)
+        self._store = None
+
+        # Objects are read from the store on several threads at once
+        self._store_lock = threading.Lock()
+
+    @property
+    def store(self):
+        with self._store_lock:
+            if self._store is None:
+                git_dir, root = find_git_dir(self.repo_path or os.curdir)
+
+                # Worktrees share the objects of the main repository
+                common_dir_file = os.path.join(git_dir, "commondir")
+                if os.path.isfile(common_dir_file):
+                    with open(common_dir_file, "r") as f:
+                        git_dir = os.path.join(git_dir, f.read().strip())
+
+                self._store = ObjectStore(os.path.join(git_dir, "objects"))
+                self._store.packs  # Opened while the lock is held
+            return self._store
+
+    def close(self):
+        super(InProcessGitBackend, self).close()
+        with self._store_lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+
+    def ls_files(self, paths=None):
+        try:
+            entries = read_repo_index(self.repo_path)
+        except UnsupportedIndex:
+            return super(InProcessGitBackend, self).ls_files(paths=paths)
+
+        paths = set(paths) if paths is not None else None
+        return dict(
+            (entry.path, entry.object_id)
+            for entry in entries
+            if entry.stage == 0 and (paths is None or entry.path in paths)
+        )
+
+    def iter_tracked(self):
+        try:
+            entries = read_repo_index(self.repo_path)
+        except UnsupportedIndex:
+            return super(InProcessGitBackend, self).iter_tracked()
+
+        return _unique(entry.path for entry in entries)
+
+    def cat_file(self, object_ids):
+        results = {}
+        remaining = []
+
+        for object_id in object_ids:
+            try:
+                results[object_id] = self.store.read(object_id)
+            except (UnsupportedIndex, UnsupportedObject, IOError, OSError, ValueError):
+                results[object_id] = None
+            if results[object_id] is None:
+                remaining.append(object_id)
+
+        if remaining:
+            results.update(super(InProcessGitBackend, self).cat_file(remaining))
+        return results
+
+    def object_info(self, object_ids):
+        return dict(
+            (object_id, (found[0], len(found[1])) if found else None)
+            for object_id, found in self.cat_file(object_ids).items()
+        )
+
+
+BACKENDS = dict(
+    (backend.name, backend) for backend in (GitBackend, BatchGitBackend, InProcessGitBackend)
+)
+
+DEFAULT_BACKEND = InProcessGitBackend.name
+
+
+def get_backend(name=None, repo_path=None):
+    """Returns a new git backend by name."""
+    try:
+        backend = BACKENDS[name or DEFAULT_BACKEND]
+    except KeyError:
+        raise ValueError("Unknown git backend: {}".format(name))
+    return backend(repo_path=repo_path)
@@ -0,0 +1,149 @@
+import os
+import re
+import threading
+
+from collections.abc import Mapping
+
+
+HUNK_HEADER = re.compile(rb"^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# The escapes git uses in quoted paths, other than octal escapes
+ESCAPES = {
+    ord("a"): 7,
+    ord("b"): 8,
+    ord("t"): 9,
+    ord("n"): 10,
+    ord("v"): 11,
+    ord("f"): 12,
+    ord("r"): 13,
+}
+
+
+def unquote_path(path):
+    """Decodes a path that git may have quoted because of unusual characters."""
+    if not path.startswith(b'"'):
+        return os.fsdecode(path)
+
+    quoted = path[1:-1]
+    unquoted = bytearray()
+    i = 0
+    while i < len(quoted):
+        byte = quoted[i]
+        if byte != ord("\\"):
+            unquoted.append(byte)
+            i += 1
+            continue
+
+        escaped = quoted[i + 1]
+        if ord("0") <= escaped <= ord("7"):
+            start = i + 1
+            end = i + 4
+            unquoted.append(int(quoted[start:end], 8))
+            i = end
+        else:
+            unquoted.append(ESCAPES.get(escaped, escaped))
+            i += 2
+
+    return os.fsdecode(bytes(unquoted))
+
+
+def parse_diff(data):
+    """Parses a diff made with `-U0` into a mapping of each path to its added line ranges.
+
+    Ranges are `(start, end)` tuples of line numbers in the new version of the file, counting
+    from one and including the end.
+    """
+    ranges = {}
+    path = None
+    old_remaining = new_remaining = 0
+
+    for line in data.split(b"\n"):
+        # Lines within a hunk are counted so added lines that look like headers are skipped
+        if old_remaining or new_remaining:
+            if line.startswith(b"-"):
+                old_remaining -= 1
+            elif line.startswith(b"+"):
+                new_remaining -= 1
+            continue
+
+        if line.startswith(b"+++ "):
+            new_path = line[4:]
+            path = None
+            if new_path != b"/dev/null":
+                # Git ends the header with a tab when a path it didn't quote has a space in it
+                if not new_path.startswith(b'"') and new_path.endswith(b"\t"):
+                    new_path = new_path[:-1]
+                path = unquote_path(new_path)[2:]  # Skip the `b/` prefix
+                ranges.setdefault(path, [])
+            continue
+
+        match = HUNK_HEADER.match(line)
+        if match and path is not None:
+            old_count, start, new_count = match.groups()
+            old_remaining = int(old_count) if old_count is not None else 1
+            new_remaining = int(new_count) if new_count is not None else 1
+
+            # Hunks that only remove lines don't add any
+            if new_remaining:
+                start = int(start)
+                ranges[path].append((start, start + new_remaining - 1))
+
+    return ranges
+
+
+def changed_lines(git, staged=True):
+    """Returns the line ranges added to each changed file, as parsed by `parse_diff`.
+
+    With `staged`, the index is compared to `HEAD`; otherwise the working tree is.
+    """
+    args = ["-U0", "--no-color", "--no-ext-diff", "--no-textconv", "--ignore-submodules"]
+    args += ["--src-prefix=a/", "--dst-prefix=b/"]
+
+    if staged:
+        args.append("--cached")
+    else:
+        out, err, code = git.rev_parse("--verify", "--quiet", "HEAD")
+        if code == 0:
+            args.append("HEAD")
+        else:
+            # Without any commits, everything is compared to an empty tree
+            out, err, code = git.hash_object("-t", "tree", "--stdin", input=b"")
+            args.append(out.strip())
+
+    out, err, code = git.diff.communicate(*args, decode=False)
+    return parse_diff(out)
+
+
+class ChangedLines(Mapping):
+    """The line ranges changed in each file, read from git the first time they are needed.
+
+    Unchanged files in the index map to an empty list. Files git doesn't track are missing, as
+    the whole of them is new.
+    """
+
+    def __init__(self, snapshot, staged=True):
+        self.snapshot = snapshot
+        self.staged = staged
+        self._ranges = None
+        self._lock = threading.Lock()
+
+    @property
+    def ranges(self):
+        with self._lock:
+            if self._ranges is None:
+                self._ranges = self.snapshot.backend.changed_lines(staged=self.staged)
+            return self._ranges
+
+    def __getitem__(self, path):
+        ranges = self.ranges.get(path)
+        if ranges is not None:
+            return ranges
+        if path in self.snapshot.blob_ids:
+            return []
+        raise KeyError(path)
+
+    def __iter__(self):
+        return iter(set(self.ranges).union(self.snapshot.blob_ids))
+
+    def __len__(self):
+        return len(set(self.ranges).union(self.snapshot.blob_ids))
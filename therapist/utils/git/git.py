@@ -1,4 +1,10 @@
+import os
 import subprocess
+import threading
+
+
+# The size of the chunks output is streamed in
+READ_SIZE = 65536
 
 
 def to_cli_args(*args, **kwargs):
@@ -20,26 +26,89 @@ def to_cli_args(*args, **kwargs):
     return cmd
 
 
+def _write_chunks(stream, chunks):
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # The command exited, or was stopped, before reading all of its input
+        pass
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+
 class Git(object):
     def __init__(self, cmd=None, repo_path=None):
         self.repo_path = repo_path
         self.current = list(cmd) if cmd else ["git"]
 
     def __call__(self, *args, **kwargs):
+        return self.communicate(*args, **kwargs)
+
+    def communicate(self, *args, input=None, decode=True, **kwargs):
+        """Runs the command, optionally sending `input` bytes to stdin.
+
+        Returns the output, error output and return code. The output is returned as bytes
+        unless `decode` is set.
+        """
         cmd = self.current + to_cli_args(*args, **kwargs)
 
         subprocess_kwargs = {"stdout": subprocess.PIPE, "stderr": subprocess.PIPE}
 
+        if input is not None:
+            subprocess_kwargs["stdin"] = subprocess.PIPE
+
         if self.repo_path:
             subprocess_kwargs["cwd"] = self.repo_path
 
         pipes = subprocess.Popen(cmd, **subprocess_kwargs)
-        out, err = pipes.communicate()
-        return out.decode("utf-8"), err.decode("utf-8"), pipes.returncode
+        out, err = pipes.communicate(input)
+        if decode:
+            out, err = out.decode("utf-8"), err.decode("utf-8")
+        return out, err, pipes.returncode
+
+    def stream(self, *args, input=None, **kwargs):
+        """Runs the command and yields its output in chunks of bytes as it is written.
+
+        `input` is an iterable of chunks of bytes that are written to stdin from another thread
+        while the output is read. The command is stopped if the generator is closed before all
+        of the output is read.
+        """
+        cmd = self.current + to_cli_args(*args, **kwargs)
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.repo_path or None,
+        )
+
+        writer = None
+        if input is not None:
+            writer = threading.Thread(target=_write_chunks, args=(process.stdin, input))
+            writer.daemon = True
+            writer.start()
+
+        try:
+            for chunk in iter(lambda: os.read(process.stdout.fileno(), READ_SIZE), b""):
+                yield chunk
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            if writer is not None:
+                writer.join()
 
     def __getattr__(self, name):
-        name = name.replace("_", "-")
-        return Git(self.current + [name], repo_path=self.repo_path)
+        command = Git(self.current + [name.replace("_", "-")], repo_path=self.repo_path)
+
+        # Keep the subcommand around so chaining it again doesn't build another object
+        self.__dict__[name] = command
+        return command
 
     def __str__(self):  # pragma: no cover
         return str(self.current)
@@ -0,0 +1,320 @@
+import mmap
+import os
+import re
+import struct
+
+from therapist.exc import Error
+
+
+HEADER = struct.Struct(">4sII")
+ENTRY = struct.Struct(">10I20sH")
+EXTENDED_FLAGS = struct.Struct(">H")
+EXTENSION = struct.Struct(">4sI")
+EWAH_HEADER = struct.Struct(">II")
+
+CHECKSUM_SIZE = 20
+
+# Entry flags
+ASSUME_VALID = 0x8000
+EXTENDED = 0x4000
+STAGE_MASK = 0x3000
+NAME_MASK = 0x0FFF
+
+# Extended entry flags
+SKIP_WORKTREE = 0x4000
+INTENT_TO_ADD = 0x2000
+
+# Extensions starting with an uppercase letter are optional and can safely be ignored. Of the
+# required extensions, only the split index is understood.
+SPLIT_INDEX = b"link"
+
+
+class UnsupportedIndex(Error):
+    pass
+
+
+class IndexEntry(object):
+    """An entry in the git index."""
+
+    __slots__ = (
+        "path",
+        "mode",
+        "object_id",
+        "stage",
+        "ctime",
+        "mtime",
+        "dev",
+        "ino",
+        "uid",
+        "gid",
+        "size",
+        "flags",
+        "extended_flags",
+    )
+
+    def __init__(self, path, fields, extended_flags=0):
+        (
+            ctime_s,
+            ctime_ns,
+            mtime_s,
+            mtime_ns,
+            self.dev,
+            self.ino,
+            self.mode,
+            self.uid,
+            self.gid,
+            self.size,
+            object_id,
+            self.flags,
+        ) = fields
+
+        self.path = path
+        self.object_id = object_id.hex()
+        self.stage = (self.flags & STAGE_MASK) >> 12
+        self.ctime = (ctime_s, ctime_ns)
+        self.mtime = (mtime_s, mtime_ns)
+        self.extended_flags = extended_flags
+
+    def __repr__(self):  # pragma: no cover
+        return "<IndexEntry {}>".format(self.path)
+
+    @property
+    def mtime_ns(self):
+        return self.mtime[0] * 10 ** 9 + self.mtime[1]
+
+    @property
+    def assume_valid(self):
+        return bool(self.flags & ASSUME_VALID)
+
+    @property
+    def skip_worktree(self):
+        return bool(self.extended_flags & SKIP_WORKTREE)
+
+    @property
+    def intent_to_add(self):
+        return bool(self.extended_flags & INTENT_TO_ADD)
+
+
+def _read_varint(data, offset):
+    """Reads one of the variable length integers used to compress paths in version 4."""
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, offset
+
+
+def _parse(data):
+    """Parses the raw entries and extensions of an index file."""
+    if len(data) < HEADER.size + CHECKSUM_SIZE:
+        raise UnsupportedIndex("The index is too short.")
+
+    signature, version, count = HEADER.unpack_from(data, 0)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise UnsupportedIndex("Unsupported index version: {}".format(version))
+
+    entries = []
+    offset = HEADER.size
+    previous = b""
+
+    for _ in range(count):
+        start = offset
+        fields = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+
+        flags = fields[-1]
+        extended_flags = 0
+        if flags & EXTENDED:
+            (extended_flags,) = EXTENDED_FLAGS.unpack_from(data, offset)
+            offset += EXTENDED_FLAGS.size
+
+        if version == 4:
+            # Paths are stored as the number of bytes to remove from the end of the previous
+            # path followed by the bytes to add to what remains
+            strip, offset = _read_varint(data, offset)
+            end = data.find(b"\0", offset)
+            keep = len(previous) - strip
+            path = previous[:keep] + data[offset:end]
+            offset = end + 1
+        else:
+            length = flags & NAME_MASK
+            end = offset + length if length < NAME_MASK else data.find(b"\0", offset)
+            path = data[offset:end]
+
+            # Entries are padded with NULs to a multiple of eight bytes
+            offset = start + ((end - start) // 8 + 1) * 8
+
+        previous = path
+        entries.append((path, fields, extended_flags))
+
+    extensions = {}
+    while offset + EXTENSION.size <= len(data) - CHECKSUM_SIZE:
+        name, size = EXTENSION.unpack_from(data, offset)
+        offset += EXTENSION.size
+        end = offset + size
+        extensions[name] = data[offset:end]
+        offset = end
+
+    for name in extensions:
+        if not name[:1].isupper() and name != SPLIT_INDEX:
+            raise UnsupportedIndex("Unsupported index extension: {}".format(name))
+
+    return entries, extensions
+
+
+def read_ewah(data, offset=0):
+    """Returns the positions of the set bits in an EWAH compressed bitmap and where it ends."""
+    bit_size, word_count = EWAH_HEADER.unpack_from(data, offset)
+    offset += EWAH_HEADER.size
+    words = struct.unpack_from(">{}Q".format(word_count), data, offset)
+    offset += word_count * 8 + 4  # The last word is the position of the last marker word
+
+    bits = []
+    position = 0
+    index = 0
+    while index < word_count:
+        # A marker word has a run of identical words followed by a number of literal words
+        marker = words[index]
+        index += 1
+
+        run_length = (marker >> 1) & 0xFFFFFFFF
+        literal_count = marker >> 33
+        if marker & 1:
+            bits.extend(range(position, position + run_length * 64))
+        position += run_length * 64
+
+        for word in words[index:][:literal_count]:
+            bits.extend(position + bit for bit in range(64) if word >> bit & 1)
+            position += 64
+        index += literal_count
+
+    return [bit for bit in bits if bit < bit_size], offset
+
+
+def _read_file(path):
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _parse(data)
+    except (IOError, OSError, ValueError) as err:
+        raise UnsupportedIndex("Could not read the index: {}".format(err))
+
+
+def read_index(path, git_dir=None):
+    """Reads the entries of an index file, sorted by path and stage.
+
+    A split index is merged with its shared index, which is looked for in `git_dir` or in the
+    same directory as the index.
+    """
+    entries, extensions = _read_file(path)
+
+    link = extensions.get(SPLIT_INDEX)
+    if link is None or link[:20] == b"\0" * 20:
+        return [IndexEntry(os.fsdecode(p), f, e) for p, f, e in entries]
+
+    shared_path = os.path.join(
+        git_dir or os.path.dirname(path), "sharedindex.{}".format(link[:20].hex())
+    )
+    shared, _ = _read_file(shared_path)
+
+    deleted, offset = read_ewah(link, 20)
+    replaced, offset = read_ewah(link, offset)
+
+    # Replacements are the first entries of the split index, without paths of their own
+    for position, (_, fields, extended_flags) in zip(replaced, entries):
+        shared[position] = (shared[position][0], fields, extended_flags)
+
+    def key(entry):
+        return entry[0], entry[1][-1] & STAGE_MASK
+
+    merged = dict((key(entry), entry) for entry in shared)
+    for position in deleted:
+        merged.pop(key(shared[position]), None)
+
+    # The rest are added, replacing any entries with the same path and stage
+    replacements = len(replaced)
+    for entry in entries[replacements:]:
+        merged[key(entry)] = entry
+
+    return [IndexEntry(os.fsdecode(p), f, e) for _, (p, f, e) in sorted(merged.items())]
+
+
+def find_git_dir(path):
+    """Returns the git directory and the root of the working tree that contains a path."""
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return dot_git, path
+        if os.path.isfile(dot_git):
+            # Worktrees and submodules point to their git directory
+            with open(dot_git, "r") as f:
+                match = re.match(r"gitdir: (.+)", f.read().strip())
+            if not match:
+                raise UnsupportedIndex("Could not find the git directory.")
+            return os.path.join(path, match.group(1)), path
+
+        next_path = os.path.dirname(path)
+        if next_path == path:
+            raise UnsupportedIndex("Could not find the git directory.")
+        path = next_path
+
+
+def _uses_sha1(git_dir):
+    config_dirs = [git_dir]
+
+    common_dir_file = os.path.join(git_dir, "commondir")
+    if os.path.isfile(common_dir_file):
+        with open(common_dir_file, "r") as f:
+            config_dirs.append(os.path.join(git_dir, f.read().strip()))
+
+    for config_dir in config_dirs:
+        try:
+            with open(os.path.join(config_dir, "config"), "r") as f:
+                if re.search(r"objectformat\s*=\s*sha256", f.read(), flags=re.IGNORECASE):
+                    return False
+        except IOError:
+            pass
+    return True
+
+
+def read_repo_index(repo_path=None):
+    """Reads the index of the repository at a path, like `git ls-files --stage`.
+
+    Only entries within `repo_path` are returned, with paths relative to it. Raises
+    `UnsupportedIndex` when the index can't be read without git.
+    """
+    repo_path = os.path.abspath(repo_path or os.curdir)
+
+    # Leave repositories configured through the environment to git
+    if os.environ.get("GIT_DIR") or os.environ.get("GIT_WORK_TREE"):
+        raise UnsupportedIndex("The repository is configured through the environment.")
+
+    git_dir, root = find_git_dir(repo_path)
+    if not _uses_sha1(git_dir):
+        raise UnsupportedIndex("Only SHA-1 repositories are supported.")
+
+    # Hooks run by `git commit` may be given a temporary index, relative to the working tree
+    index_path = os.environ.get("GIT_INDEX_FILE")
+    index_path = os.path.join(root, index_path) if index_path else os.path.join(git_dir, "index")
+
+    if not os.path.exists(index_path):
+        return []
+
+    entries = read_index(index_path, git_dir=git_dir)
+
+    prefix = os.path.relpath(repo_path, root).replace(os.sep, "/")
+    if prefix == ".":
+        return entries
+
+    prefix += "/"
+    length = len(prefix)
+    results = []
+    for entry in entries:
+        if entry.path.startswith(prefix):
+            entry.path = entry.path[length:]
+            results.append(entry)
+    return results
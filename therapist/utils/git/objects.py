@@ -0,0 +1,80 @@
+import os
+
+
+def split_nul(data):
+    """Splits NUL-delimited git output into a list of paths."""
+    return [os.fsdecode(item) for item in data.split(b"\0") if item]
+
+
+def iter_nul(chunks):
+    """Yields the paths in NUL-delimited git output as it arrives in chunks."""
+    remainder = b""
+    for chunk in chunks:
+        items = (remainder + chunk).split(b"\0")
+        remainder = items.pop()
+        for item in items:
+            if item:
+                yield os.fsdecode(item)
+
+    if remainder:
+        yield os.fsdecode(remainder)
+
+
+def iter_ls_files(git, *args, **kwargs):
+    """Yields the paths listed by `git ls-files` as git writes them."""
+    return iter_nul(git.ls_files.stream(*args, z=True, **kwargs))
+
+
+def staged_blob_ids(git, paths=None):
+    """Returns a mapping of each path in the index to the id of its staged blob.
+
+    If paths are given, only the entries for those paths are returned.
+    """
+    args = ["--"] + list(paths) if paths is not None else []
+    out, err, code = git.ls_files.communicate(*args, s=True, z=True, decode=False)
+
+    blob_ids = {}
+    for entry in out.split(b"\0"):
+        if not entry:
+            continue
+
+        # Each entry is in the form `<mode> <object> <stage>\t<path>`
+        meta, path = entry.split(b"\t", 1)
+        mode, object_id, stage = meta.split(b" ")
+
+        # Skip unmerged entries
+        if stage == b"0":
+            blob_ids[os.fsdecode(path)] = object_id.decode("ascii")
+
+    return blob_ids
+
+
+def unstaged_paths(git):
+    """Returns the set of tracked paths whose working tree contents differ from the index."""
+    out, err, code = git.diff.communicate(name_only=True, z=True, no_renames=True, decode=False)
+    return set(split_nul(out))
+
+
+def hash_objects(git, paths):
+    """Returns a mapping of paths to the blob ids of their current contents in the working tree.
+
+    Paths that are not regular files are left out.
+    """
+    root = git.repo_path or os.curdir
+    paths = [
+        path
+        for path in paths
+        if "\n" not in path
+        and os.path.isfile(os.path.join(root, path))
+        and not os.path.islink(os.path.join(root, path))
+    ]
+
+    if not paths:
+        return {}
+
+    data = b"\n".join(os.fsencode(path) for path in paths)
+    out, err, code = git.hash_object.communicate(stdin_paths=True, input=data, decode=False)
+    if code != 0:
+        return {}
+
+    return dict(zip(paths, out.decode("ascii").split()))
@@ -0,0 +1,98 @@
+# Refreshing more paths than this at once reloads the whole snapshot instead, so the paths
+# don't need to fit on a single command line
+MAX_REFRESH_PATHS = 1000
+
+
+class RepoSnapshot(object):
+    """The state of the files in a repository, read from git once and shared across a run.
+
+    The statuses come from a single `git status` call. The index is only read the first time
+    the tracked files or their blob ids are needed. Git is queried through a `GitBackend`.
+    """
+
+    def __init__(self, backend, untracked_files="no"):
+        self.backend = backend
+        self.untracked_files = untracked_files
+        self._statuses = {}
+        self._blob_ids = None
+        self.reload()
+
+    def reload(self):
+        """Reads the state of every file from git again."""
+        self._statuses = dict(
+            (status.path, status)
+            for status in self.backend.status(untracked_files=self.untracked_files)
+        )
+        self._blob_ids = None
+
+    def refresh(self, paths):
+        """Reads the state of some files from git again, e.g. after they were modified."""
+        paths = list(paths)
+        if not paths:
+            return
+
+        if len(paths) > MAX_REFRESH_PATHS:
+            self.reload()
+            return
+
+        for path in paths:
+            self._statuses.pop(path, None)
+        for status in self.backend.status(untracked_files=self.untracked_files, paths=paths):
+            self._statuses[status.path] = status
+
+        if self._blob_ids is not None:
+            for path in paths:
+                self._blob_ids.pop(path, None)
+            self._blob_ids.update(self.backend.ls_files(paths=paths))
+
+    def get(self, path):
+        """Returns the status of a file or None if it is tracked and unchanged."""
+        return self._statuses.get(path)
+
+    @property
+    def statuses(self):
+        """The statuses of all the files that are changed, untracked or ignored."""
+        return list(self._statuses.values())
+
+    @property
+    def blob_ids(self):
+        """A mapping of each path in the index to the id of its staged blob."""
+        if self._blob_ids is None:
+            self._blob_ids = self.backend.ls_files()
+        return self._blob_ids
+
+    @property
+    def tracked(self):
+        return set(self.blob_ids)
+
+    @property
+    def staged(self):
+        return set(path for path, status in self._statuses.items() if status.is_staged)
+
+    @property
+    def unstaged(self):
+        """Tracked files whose contents in the working tree differ from the index."""
+        return set(
+            path for path, status in self._statuses.items() if status.y not in (" ", "?", "!")
+        )
+
+    @property
+    def untracked(self):
+        return set(path for path, status in self._statuses.items() if status.is_untracked)
+
+    def iter_files(self, include_untracked=False):
+        """Yields the tracked files that haven't been deleted as git lists them, followed by any
+        untracked files if asked for.
+        """
+        deleted = self.deleted
+        for path in self.backend.iter_tracked():
+            if path not in deleted:
+                yield path
+
+        if include_untracked:
+            for path in self.backend.iter_untracked():
+                yield path
+
+    @property
+    def deleted(self):
+        return set(path for path, status in self._statuses.items() if "D" in (status.x, status.y))
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+
+class StagedTree(object):
+    """A copy of the staged contents of a repository, built outside of its working tree.
+
+    Files whose staged contents match the working tree are hard links to the files in the
+    working tree, so building the copy leaves the working tree untouched and doesn't need to
+    write their contents. The rest are checked out from the index. Of the files git doesn't
+    track, only the `untracked` paths given are part of the copy, linked or copied from the
+    working tree.
+    """
+
+    def __init__(self, snapshot, parent_dir, untracked=()):
+        self.snapshot = snapshot
+        self.parent_dir = parent_dir
+        self.untracked = list(untracked)
+        self.path = None
+
+    def __enter__(self):
+        try:
+            self.create()
+        except BaseException:
+            self.remove()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        self.remove()
+
+    def create(self):
+        if not os.path.isdir(self.parent_dir):
+            os.makedirs(self.parent_dir)
+        self.path = tempfile.mkdtemp(prefix="staged-", dir=self.parent_dir)
+
+        root = self.snapshot.backend.repo_path or os.curdir
+        unstaged = self.snapshot.unstaged
+        checkout = []
+
+        for path in self.snapshot.blob_ids:
+            if path in unstaged:
+                checkout.append(path)
+                continue
+
+            destination = os.path.join(self.path, path)
+            try:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.link(os.path.join(root, path), destination, follow_symlinks=False)
+            except OSError:
+                # e.g. across filesystems, or for files missing from the working tree
+                checkout.append(path)
+
+        self.snapshot.backend.checkout_index(checkout, prefix=self.path)
+
+        for path in self.untracked:
+            source = os.path.join(root, path)
+            destination = os.path.join(self.path, path)
+            try:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                try:
+                    os.link(source, destination, follow_symlinks=False)
+                except OSError:
+                    shutil.copy2(source, destination, follow_symlinks=False)
+            except OSError:
+                # Files deleted since they were listed are as missing as they are in the working
+                # tree
+                pass
+
+        return self.path
+
+    def remove(self):
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
@@ -1,7 +1,14 @@
+import os
 import re
 
 
+# The number of space separated fields before the path for each type of porcelain v2 entry
+V2_FIELDS = {b"1": 8, b"2": 9, b"u": 10}
+
+
 class Status(object):
+    __slots__ = ("x", "y", "path", "original_path")
+
     def __init__(self, status):
         matches = re.search(r"^([MADRCU ?!]{2}) (.+?)(?: -> (.+?))?$", status)
         self.x = matches[1][0]
@@ -9,6 +16,16 @@ class Status(object):
         self.path = matches[3] if matches[3] else matches[2]
         self.original_path = matches[2] if matches[3] else None
 
+    @classmethod
+    def from_fields(cls, x, y, path, original_path=None):
+        """Creates a status without parsing a line of `git status` output."""
+        status = cls.__new__(cls)
+        status.x = x
+        status.y = y
+        status.path = path
+        status.original_path = original_path
+        return status
+
     def __str__(self):
         status = "{}{}".format(self.x, self.y)
         if self.original_path:
@@ -31,3 +48,53 @@ class Status(object):
     @property
     def is_ignored(self):
         return self.x == "!"
+
+
+def parse_status(data):
+    """Parses the bytes output of `git status --porcelain=v2 -z` into a list of statuses.
+
+    Unlike the v1 format, paths are never quoted, so they can contain any characters.
+    """
+    statuses = []
+    entries = data.split(b"\0")
+    index = 0
+
+    while index < len(entries):
+        entry = entries[index]
+        index += 1
+
+        kind = entry[:1]
+        if kind in (b"?", b"!"):
+            xy = kind.decode("ascii") * 2
+            statuses.append(Status.from_fields(xy[0], xy[1], os.fsdecode(entry[2:])))
+            continue
+
+        fields = V2_FIELDS.get(kind)
+        if fields is None:  # Headers and the empty entry after the last NUL
+            continue
+
+        parts = entry.split(b" ", fields)
+
+        # Unmodified is `.` rather than a space in v2
+        x, y = parts[1].decode("ascii").replace(".", " ")
+        original_path = None
+        if kind == b"2":
+            # The original path of a rename or copy is the next entry
+            original_path = os.fsdecode(entries[index])
+            index += 1
+
+        statuses.append(Status.from_fields(x, y, os.fsdecode(parts[fields]), original_path))
+
+    return statuses
+
+
+def get_status(git, untracked_files="all", paths=None):
+    """Returns the statuses of the files in the working tree and the index.
+
+    If paths are given, only the statuses of those paths are returned.
+    """
+    args = ["--"] + list(paths) if paths is not None else []
+    out, err, code = git.status.communicate(
+        *args, porcelain="v2", z=True, untracked_files=untracked_files, decode=False
+    )
+    return parse_status(out)
@@ -0,0 +1,275 @@
+import binascii
+import bisect
+import glob
+import mmap
+import os
+import struct
+import zlib
+
+from therapist.exc import Error
+
+
+# Object types as they are numbered in packfiles
+OBJECT_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+OFS_DELTA = 6
+REF_DELTA = 7
+
+IDX_MAGIC = b"\377tOc"
+IDX_HEADER = struct.Struct(">4sI")
+FANOUT = struct.Struct(">256I")
+
+READ_SIZE = 65536
+
+
+class UnsupportedObject(Error):
+    pass
+
+
+def _decompress(data, offset=0):
+    """Decompresses the zlib stream that starts at an offset in a buffer."""
+    decompressor = zlib.decompressobj()
+    chunks = []
+    while not decompressor.eof:
+        end = offset + READ_SIZE
+        chunk = data[offset:end]
+        if not chunk:
+            raise UnsupportedObject("Truncated object.")
+        chunks.append(decompressor.decompress(chunk))
+        offset = end
+    return b"".join(chunks)
+
+
+def _read_size(data, offset):
+    """Reads one of the little-endian variable length sizes used in deltas."""
+    size = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        size |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return size, offset
+
+
+def apply_delta(base, delta):
+    """Rebuilds an object from its base and a git delta."""
+    base_size, offset = _read_size(delta, 0)
+    target_size, offset = _read_size(delta, offset)
+    if base_size != len(base):
+        raise UnsupportedObject("The delta does not match its base.")
+
+    chunks = []
+    while offset < len(delta):
+        opcode = delta[offset]
+        offset += 1
+
+        if opcode & 0x80:
+            # Copy a range of the base, with the offset and size bytes present given by flags
+            copy_offset = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    copy_offset |= delta[offset] << (i * 8)
+                    offset += 1
+            copy_size = 0
+            for i in range(3):
+                if opcode & (1 << (4 + i)):
+                    copy_size |= delta[offset] << (i * 8)
+                    offset += 1
+            end = copy_offset + (copy_size or 0x10000)
+            chunks.append(base[copy_offset:end])
+        elif opcode:
+            # Insert the next bytes of the delta
+            end = offset + opcode
+            chunks.append(delta[offset:end])
+            offset = end
+        else:
+            raise UnsupportedObject("Invalid delta.")
+
+    target = b"".join(chunks)
+    if len(target) != target_size:
+        raise UnsupportedObject("The delta produced the wrong size of object.")
+    return target
+
+
+class Pack(object):
+    """A packfile and its version 2 index."""
+
+    def __init__(self, idx_path):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-4] + ".pack"
+
+        with open(idx_path, "rb") as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.pack_path, "rb") as f:
+            self._pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = IDX_HEADER.unpack_from(self._idx, 0)
+        if magic != IDX_MAGIC or version != 2:
+            self.close()
+            raise UnsupportedObject("Unsupported pack index: {}".format(idx_path))
+
+        self._fanout = FANOUT.unpack_from(self._idx, IDX_HEADER.size)
+        self.count = self._fanout[-1]
+        self._ids_offset = IDX_HEADER.size + FANOUT.size
+        self._offsets_offset = self._ids_offset + self.count * 24
+        self._large_offsets_offset = self._offsets_offset + self.count * 4
+
+    def close(self):
+        self._idx.close()
+        self._pack.close()
+
+    def _object_id(self, index):
+        start = self._ids_offset + index * 20
+        end = start + 20
+        return self._idx[start:end]
+
+    def find(self, object_id):
+        """Returns the offset of an object in the pack or None if it isn't in the pack."""
+        first = object_id[0]
+        low = self._fanout[first - 1] if first else 0
+        high = self._fanout[first]
+
+        ids = _IndexedIds(self, low, high)
+        index = bisect.bisect_left(ids, object_id) + low
+        if index >= high or self._object_id(index) != object_id:
+            return None
+
+        (offset,) = struct.unpack_from(">I", self._idx, self._offsets_offset + index * 4)
+        if offset & 0x80000000:
+            position = self._large_offsets_offset + (offset & 0x7FFFFFFF) * 8
+            (offset,) = struct.unpack_from(">Q", self._idx, position)
+        return offset
+
+    def _read_header(self, offset):
+        byte = self._pack[offset]
+        offset += 1
+        object_type = (byte >> 4) & 0x7
+        size = byte & 0x0F
+        shift = 4
+        while byte & 0x80:
+            byte = self._pack[offset]
+            offset += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+        return object_type, size, offset
+
+    def read(self, offset, store):
+        """Returns the type and contents of the object at an offset, resolving any deltas."""
+        deltas = []
+
+        while True:
+            object_type, size, data_offset = self._read_header(offset)
+
+            if object_type == OFS_DELTA:
+                # The base is at a negative offset, in a big-endian variable length encoding
+                byte = self._pack[data_offset]
+                data_offset += 1
+                distance = byte & 0x7F
+                while byte & 0x80:
+                    byte = self._pack[data_offset]
+                    data_offset += 1
+                    distance = ((distance + 1) << 7) | (byte & 0x7F)
+                deltas.append(_decompress(self._pack, data_offset))
+                offset -= distance
+            elif object_type == REF_DELTA:
+                end = data_offset + 20
+                base_id = self._pack[data_offset:end]
+                deltas.append(_decompress(self._pack, end))
+
+                base = store.read(binascii.hexlify(base_id).decode("ascii"))
+                if base is None:
+                    raise UnsupportedObject("Missing delta base.")
+                base_type, data = base
+                break
+            elif object_type in OBJECT_TYPES:
+                base_type, data = OBJECT_TYPES[object_type], _decompress(self._pack, data_offset)
+                break
+            else:
+                raise UnsupportedObject("Unknown object type: {}".format(object_type))
+
+        for delta in reversed(deltas):
+            data = apply_delta(data, delta)
+
+        return base_type, data
+
+
+class _IndexedIds(object):
+    """A sequence view of a range of the object ids in a pack index, for bisecting."""
+
+    def __init__(self, pack, low, high):
+        self.pack = pack
+        self.low = low
+        self.high = high
+
+    def __len__(self):
+        return self.high - self.low
+
+    def __getitem__(self, index):
+        return self.pack._object_id(self.low + index)
+
+
+class ObjectStore(object):
+    """Reads objects from a repository's loose objects and packfiles without running git."""
+
+    def __init__(self, objects_dir):
+        self.objects_dirs = [objects_dir]
+        self._packs = None
+
+        # Objects may also be borrowed from other repositories
+        try:
+            with open(os.path.join(objects_dir, "info", "alternates"), "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        self.objects_dirs.append(os.path.join(objects_dir, line))
+        except IOError:
+            pass
+
+    @property
+    def packs(self):
+        if self._packs is None:
+            # The list is only shared once it is complete, as objects are read from threads
+            packs = []
+            for objects_dir in self.objects_dirs:
+                for idx_path in sorted(glob.glob(os.path.join(objects_dir, "pack", "*.idx"))):
+                    try:
+                        packs.append(Pack(idx_path))
+                    except (IOError, OSError, ValueError, UnsupportedObject):
+                        pass
+            self._packs = packs
+        return self._packs
+
+    def close(self):
+        for pack in self._packs or []:
+            pack.close()
+        self._packs = None
+
+    def _read_loose(self, object_id):
+        for objects_dir in self.objects_dirs:
+            path = os.path.join(objects_dir, object_id[:2], object_id[2:])
+            try:
+                with open(path, "rb") as f:
+                    data = zlib.decompress(f.read())
+            except IOError:
+                continue
+            except zlib.error:
+                raise UnsupportedObject("Corrupt object: {}".format(object_id))
+
+            header, _, contents = data.partition(b"\0")
+            object_type, size = header.decode("ascii").split(" ")
+            return object_type, contents
+        return None
+
+    def read(self, object_id):
+        """Returns the type and contents of an object or None if it can't be found."""
+        found = self._read_loose(object_id)
+        if found:
+            return found
+
+        raw_id = binascii.unhexlify(object_id)
+        for pack in self.packs:
+            offset = pack.find(raw_id)
+            if offset is not None:
+                return pack.read(offset, self)
+        return None
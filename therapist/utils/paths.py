@@ -0,0 +1,129 @@
+import os
+import posixpath
+import re
+import sys
+
+from pathspec.patterns import GitWildMatchPattern
+from pathspec.util import NORMALIZE_PATH_SEPS
+
+
+def normalize_path(path):
+    """Normalizes a path the way `pathspec` does before matching it against patterns."""
+    for sep in NORMALIZE_PATH_SEPS:
+        path = path.replace(sep, posixpath.sep)
+
+    # Most paths need nothing else done to them
+    first = path[:1]
+    if first == "/":
+        return path[1:]
+    if first == "." and path[1:2] == "/":
+        return path[2:]
+    return path
+
+
+def split_path(path):
+    """Splits an absolute path into a tuple of its components."""
+    return tuple(sys.intern(part) for part in path.split(os.sep) if part)
+
+
+class PathIndex(object):
+    """The forms of the paths in a run that processes need, worked out once and shared.
+
+    The components of each path's absolute path are kept so checking that a file is within a
+    directory is a comparison of tuples of interned strings, and paths relative to each working
+    directory are kept for every process that uses it.
+    """
+
+    def __init__(self):
+        self._components = {}
+        self._relative = {}
+
+    def components(self, path, cwd):
+        """Returns the components of the absolute path of a path relative to `cwd`."""
+        cache = self._components.get(cwd)
+        if cache is None:
+            cache = self._components.setdefault(cwd, {})
+
+        parts = cache.get(path)
+        if parts is None:
+            parts = cache[path] = split_path(os.path.abspath(os.path.join(cwd, path)))
+        return parts
+
+    def is_within(self, path, root, cwd):
+        """Checks if a path is within a directory, given as the components of its path."""
+        length = len(root)
+        return self.components(path, cwd)[:length] == root
+
+    def relative_paths(self, files, cwd, working_dir):
+        """Rewrites paths relative to `cwd` as paths relative to `working_dir`."""
+        key = (cwd, working_dir)
+        cache = self._relative.get(key)
+        if cache is None:
+            cache = self._relative.setdefault(key, {})
+
+        paths = []
+        for f in files:
+            path = cache.get(f)
+            if path is None:
+                path = cache[f] = sys.intern(os.path.relpath(os.path.join(cwd, f), working_dir))
+            paths.append(path)
+        return paths
+
+
+class PathMatcher(object):
+    """Matches paths against a list of gitwildmatch patterns, like a `pathspec.PathSpec`.
+
+    The patterns are compiled once. Without any negated patterns, they are combined into a
+    single regular expression so each path is matched in one go.
+    """
+
+    def __init__(self, patterns):
+        self.sources = list(patterns)
+        self.patterns = [GitWildMatchPattern(pattern) for pattern in self.sources]
+
+        # Patterns such as comments and blank lines don't match anything
+        active = [p for p in self.patterns if p.include is not None]
+        self._regexes = [(p.regex, p.include) for p in active]
+
+        # Patterns that go on to match anything after what they match: those ending in `/.*`
+        # once they match `dir/` and those ending in `(?:/.*)?` once they match `dir`. With any
+        # negated patterns, some paths within a directory may not be matched after all.
+        self._covering = []
+        if all(p.include for p in active):
+            for regex, include in self._regexes:
+                if regex.pattern.endswith("(?:/.*)?$"):
+                    self._covering.append((regex, ""))
+                elif regex.pattern.endswith("/.*$"):
+                    self._covering.append((regex, "/"))
+
+        self._regex_match = None
+        if active and all(p.include and not p.regex.groupindex for p in active):
+            combined = "|".join("(?:{})".format(p.regex.pattern) for p in active)
+            self._regex_match = re.compile(combined).match
+
+    def match(self, path):
+        return self.match_normalized(normalize_path(path))
+
+    def match_normalized(self, path):
+        """Matches a path that has already been through `normalize_path`."""
+        if self._regex_match is not None:
+            return self._regex_match(path) is not None
+
+        return bool(self.check_normalized(path))
+
+    def matches_within(self, directory):
+        """Checks if the patterns match every path within a normalized directory path.
+
+        This errs on the side of False where it can't be told from the patterns alone.
+        """
+        return any(regex.match(directory + suffix) for regex, suffix in self._covering)
+
+    def check_normalized(self, path):
+        """Returns whether the last pattern to match a normalized path includes or excludes it,
+        or None if none of the patterns match it.
+        """
+        matched = None
+        for regex, include in self._regexes:
+            if regex.match(path):
+                matched = include
+        return matched
@@ -0,0 +1,144 @@
+import math
+import os
+import signal
+import struct
+import sys
+import threading
+
+from contextlib import contextmanager
+
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Linux caps the length of each single argument and a shell command is passed to `sh -c` as a
+# single argument, so this is an upper bound on the length of a command line there.
+MAX_ARG_STRLEN = 131072
+
+# Leave some room for anything the shell or the OS adds to the command line
+ARG_HEADROOM = 4096
+
+
+def _read_first_line(path):
+    with open(path, "r") as f:
+        return f.readline().strip()
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """Returns the number of CPUs allowed by the cgroup CPU quota or None if unlimited."""
+    try:
+        # cgroup v2 exposes the quota and period on a single line, e.g. "200000 100000"
+        quota, period = _read_first_line(os.path.join(root, "cpu.max")).split()[:2]
+    except (IOError, ValueError):
+        try:
+            quota = _read_first_line(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+            period = _read_first_line(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+        except IOError:
+            return None
+
+    try:
+        quota = int(quota)
+        period = int(period)
+    except ValueError:  # An unlimited quota is reported as "max"
+        return None
+
+    if quota <= 0 or period <= 0:
+        return None
+
+    return max(1, int(math.ceil(quota / float(period))))
+
+
+def cpu_count():
+    """Returns the number of CPUs available to the current process."""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        count = os.cpu_count() or 1
+
+    limit = cgroup_cpu_limit()
+    if limit:
+        count = min(count, limit)
+
+    return max(count, 1)
+
+
+def max_command_length():
+    """Returns the maximum length in bytes of a command line that can be run in a shell."""
+    try:
+        arg_max = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, ValueError, OSError):  # pragma: no cover
+        arg_max = -1
+
+    if arg_max <= 0:  # pragma: no cover
+        arg_max = MAX_ARG_STRLEN
+
+    # The environment is passed to the new process in the same space as the arguments
+    pointer_size = struct.calcsize("P")
+    env_size = sum(len(k) + len(v) + 2 + pointer_size for k, v in os.environb.items())
+
+    limit = arg_max - env_size - ARG_HEADROOM
+    if sys.platform.startswith("linux"):
+        limit = min(limit, MAX_ARG_STRLEN - 1)
+
+    return max(limit, ARG_HEADROOM)
+
+
+def kill_process_group(process):
+    """Kills a process started in a new session along with anything it started."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:  # pragma: no cover
+            process.kill()
+    except OSError:  # The process has already exited
+        pass
+
+
+def _is_main_thread():
+    return threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def signals_as_interrupts(signals=(signal.SIGTERM, signal.SIGHUP)):
+    """Raises `KeyboardInterrupt` when any of the signals is received so cleanup code can run."""
+    if not _is_main_thread():
+        yield
+        return
+
+    def handler(signum, frame):
+        raise KeyboardInterrupt()
+
+    previous = {}
+    for signum in signals:
+        previous[signum] = signal.signal(signum, handler)
+
+    try:
+        yield
+    finally:
+        for signum, prev_handler in previous.items():
+            signal.signal(signum, prev_handler)
+
+
+@contextmanager
+def deferred_signals(signals=(signal.SIGINT, signal.SIGTERM, signal.SIGHUP)):
+    """Holds off any of the signals until the end of the context, then delivers them."""
+    if not _is_main_thread():
+        yield
+        return
+
+    received = []
+
+    def handler(signum, frame):
+        received.append(signum)
+
+    previous = {}
+    for signum in signals:
+        previous[signum] = signal.signal(signum, handler)
+
+    try:
+        yield
+    finally:
+        for signum, prev_handler in previous.items():
+            signal.signal(signum, prev_handler)
+
+        for signum in sorted(set(received), key=received.index):
+            os.kill(os.getpid(), signum)